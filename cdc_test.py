@@ -9,18 +9,31 @@ from collections import namedtuple
 from itertools import izip as zip
 from itertools import repeat
 
-from cassandra import WriteFailure
+from cassandra import ConsistencyLevel, WriteFailure
 from cassandra.concurrent import (execute_concurrent,
                                   execute_concurrent_with_args)
 from ccmlib.node import Node
 from nose.tools import assert_equal, assert_less_equal
 
 from dtest import Tester, create_ks, debug
+from tools.benchmark import record_result
+from tools.bulkload import BulkLoader
+from tools.cdc import CDCConsumer
 from tools.data import rows_to_list
-from tools.decorators import since
+from tools.decorators import benchmark, since
 from tools.files import size_of_files_in_dir
 from tools.funcutils import get_rate_limited_function
 from tools.hacks import advance_to_next_cl_segment
+from tools.resource_monitor import disk_usage
+
+# the CDC benchmark runs every combination of these. Consumer rates are in
+# MB/s; 'none' runs without a consumer, and 'unlimited' with one that reads
+# as fast as it can
+BENCHMARK_CONSUMER_RATES = os.environ.get('CDC_BENCHMARK_CONSUMER_RATES', 'none,unlimited,4,1')
+BENCHMARK_TOTAL_SPACES = os.environ.get('CDC_BENCHMARK_TOTAL_SPACE_MB', '16,64')
+BENCHMARK_SEGMENT_SIZE = os.environ.get('CDC_BENCHMARK_SEGMENT_SIZE_MB', '4')
+# rows of 16 uuids written by each run
+BENCHMARK_ROWS = os.environ.get('CDC_BENCHMARK_ROWS', '300000')
 
 _16_uuid_column_spec = (
     'a uuid PRIMARY KEY, b uuid, c uuid, d uuid, e uuid, f uuid, g uuid, '
@@ -543,3 +556,90 @@ class TestCDC(Tester):
             # of items, so we print something else here
             msg='not all expected data selected'
         )
+
+
+@since('3.8')
+class TestCDCBenchmark(Tester):
+    """
+    Measures the write throughput and latency of a table with CDC enabled,
+    against the same table without CDC, and when writes start being
+    rejected, for each cdc_total_space_in_mb and speed of the consumer of
+    cdc_raw (a tools.cdc.CDCConsumer). Results are recorded with
+    tools.benchmark under the 'cdc' suite.
+    """
+
+    def _write(self, node, cdc, total_space_in_mb, consumer_rate, rows):
+        """
+        Writes rows into a table of a fresh node while a consumer reads its
+        cdc_raw, and returns the measurements.
+        """
+        if node.is_running():
+            node.stop(gently=False)
+        node.clear()
+        node.set_configuration_options(values={
+            'cdc_enabled': True,
+            'cdc_total_space_in_mb': total_space_in_mb,
+            'commitlog_segment_size_in_mb': int(BENCHMARK_SEGMENT_SIZE),
+            # flush, and so hand segments over to cdc_raw, once the commitlog takes the CDC space
+            'commitlog_total_space_in_mb': total_space_in_mb,
+        })
+        node.start(wait_for_binary_proto=True)
+        session = self.patient_cql_connection(node)
+        create_ks(session, 'ks', rf=1)
+        table = TableInfo(ks_name='ks', table_name='tab', column_spec=_16_uuid_column_spec,
+                          insert_stmt=_get_16_uuid_insert_stmt('ks', 'tab'),
+                          options={'cdc': 'true' if cdc else 'false'})
+        session.execute(table.create_stmt)
+
+        cdc_raw_dir = os.path.join(node.get_path(), 'cdc_raw')
+        consumer = None
+        if cdc and consumer_rate != 'none':
+            consumer = CDCConsumer(cdc_raw_dir, indexed=self.cluster.version() >= '4.0',
+                                   bytes_per_second=None if consumer_rate == 'unlimited' else float(consumer_rate) * 1024 * 1024)
+            consumer.start()
+        try:
+            # rejected writes are part of the measurement
+            loader = BulkLoader(session, table.insert_stmt, consistency_level=ConsistencyLevel.ONE, max_errors=rows)
+            stats = loader.load(repeat((), rows))
+        finally:
+            if consumer is not None:
+                consumer.stop()
+        session.cluster.shutdown()
+        self.assertEqual([], [e for e in stats.errors if not isinstance(e, WriteFailure)])
+
+        metrics = {'rows_written': stats.count,
+                   'rows_rejected': stats.error_count,
+                   'elapsed': stats.elapsed,
+                   'writes_per_second': stats.throughput,
+                   'latency_p50_ms': stats.percentile(50) * 1000,
+                   'latency_p95_ms': stats.percentile(95) * 1000,
+                   'latency_p99_ms': stats.percentile(99) * 1000,
+                   'latency_max_ms': max(stats.latencies or [0]) * 1000,
+                   # rows accepted, and seconds, before the first write was rejected
+                   'first_rejection_after_rows': stats.first_error_count,
+                   'first_rejection_seconds': stats.first_error_time,
+                   'cdc_raw_bytes': disk_usage([cdc_raw_dir])}
+        if consumer is not None:
+            metrics.update(consumer.stats())
+        return metrics
+
+    @benchmark
+    def cdc_benchmark_test(self):
+        """
+        Benchmark writes without CDC, and with CDC for every combination of
+        BENCHMARK_TOTAL_SPACES and BENCHMARK_CONSUMER_RATES.
+        """
+        cluster = self.cluster
+        cluster.populate(1)
+        [node1] = cluster.nodelist()
+        rows = int(BENCHMARK_ROWS)
+
+        for total_space in BENCHMARK_TOTAL_SPACES.split(','):
+            runs = [(False, 'none')] + [(True, rate) for rate in BENCHMARK_CONSUMER_RATES.split(',')]
+            for cdc, consumer_rate in runs:
+                metrics = self._write(node1, cdc, int(total_space), consumer_rate, rows)
+                record_result(cluster, 'cdc',
+                              {'cdc': cdc, 'consumer_mb_per_second': consumer_rate, 'rows': rows,
+                               'cdc_total_space_in_mb': int(total_space),
+                               'commitlog_segment_size_in_mb': int(BENCHMARK_SEGMENT_SIZE)},
+                              metrics)
@@ -6,6 +6,7 @@ import struct
 import time
 from distutils.version import LooseVersion
 
+import psutil
 from cassandra import WriteTimeout
 from cassandra.cluster import NoHostAvailable, OperationTimedOut
 from ccmlib.common import is_win
@@ -14,8 +15,18 @@ from parse import parse
 
 from dtest import Tester, debug, create_ks
 from tools.assertions import assert_almost_equal, assert_none, assert_one
+from tools.benchmark import record_result
 from tools.data import rows_to_list
-from tools.decorators import since
+from tools.decorators import benchmark, since
+from tools.logtail import log_line_time, watch_log_for
+from tools.resource_monitor import disk_usage
+
+# the replay benchmark runs every combination of these
+BENCHMARK_SEGMENT_SIZES = os.environ.get('COMMITLOG_BENCHMARK_SEGMENT_SIZES', '8,32')
+# 'none' is an uncompressed commitlog
+BENCHMARK_COMPRESSORS = os.environ.get('COMMITLOG_BENCHMARK_COMPRESSORS', 'none,LZ4Compressor,SnappyCompressor,DeflateCompressor')
+# number of rows written with stress before each crash
+BENCHMARK_KEYS = os.environ.get('COMMITLOG_BENCHMARK_KEYS', '500000')
 
 
 class TestCommitLog(Tester):
@@ -609,3 +620,74 @@ class TestCommitLog(Tester):
         node.watch_log_for(expected_error, from_mark=mark)
         with self.assertRaises(TimeoutError):
             node.wait_for_binary_interface(from_mark=mark, timeout=20)
+
+
+class TestCommitLogReplayBenchmark(Tester):
+    """
+    Measures how long a node takes to replay its commitlog and come back
+    after a crash, for each commitlog segment size and compressor, and
+    records it with tools.benchmark under the 'commitlog_replay' suite.
+    """
+
+    def _replay(self, node, segment_size_in_mb, compressor, keys):
+        """
+        Fills the commitlog of a fresh node, kills it, restarts it, and
+        returns the measurements.
+        """
+        if node.is_running():
+            node.stop(gently=False)
+        node.clear()
+        conf = {'commitlog_segment_size_in_mb': segment_size_in_mb,
+                # keep the written data in the commitlog rather than flushing it
+                'commitlog_total_space_in_mb': 16384}
+        if compressor != 'none':
+            conf['commitlog_compression'] = [{'class_name': compressor}]
+        node.set_configuration_options(values=conf)
+        node.start(wait_for_binary_proto=True)
+        node.stress(['write', 'n={}'.format(keys), 'no-warmup', '-rate', 'threads=50', '-schema', 'replication(factor=1)'])
+        node.stop(gently=False)
+
+        commitlog_dir = os.path.join(node.get_path(), 'commitlogs')
+        commitlog_bytes = disk_usage([commitlog_dir])
+        segments = len(os.listdir(commitlog_dir))
+
+        mark = node.mark_log()
+        start = time.time()
+        node.start(wait_for_binary_proto=True)
+        wall_time = time.time() - start
+        process_start = psutil.Process(node.pid).create_time()
+        (replaying, _), (complete, complete_match), (listening, _) = watch_log_for(
+            node, [r'Replaying ', r'Log replay complete, (\d+) replayed mutations', 'Starting listening for CQL clients'],
+            from_mark=mark, timeout=60)
+
+        replay_seconds = log_line_time(complete) - log_line_time(replaying)
+        replayed_mutations = int(complete_match.group(1))
+        return {'commitlog_bytes': commitlog_bytes,
+                'segments': segments,
+                'replayed_mutations': replayed_mutations,
+                'replay_seconds': replay_seconds,
+                'replay_mutations_per_second': replayed_mutations / replay_seconds if replay_seconds else None,
+                'replay_mb_per_second': commitlog_bytes / replay_seconds / (1024 * 1024) if replay_seconds else None,
+                # from the JVM starting to clients being able to connect
+                'startup_to_native_transport_seconds': log_line_time(listening) - process_start,
+                'restart_wall_seconds': wall_time}
+
+    @benchmark
+    def commitlog_replay_benchmark_test(self):
+        """
+        Benchmark replay for every combination of BENCHMARK_SEGMENT_SIZES and BENCHMARK_COMPRESSORS.
+        """
+        cluster = self.cluster
+        cluster.populate(1)
+        [node1] = cluster.nodelist()
+        compressors = BENCHMARK_COMPRESSORS.split(',')
+        if cluster.version() < '2.2':
+            debug("Commitlog compression was added in 2.2, only benchmarking uncompressed commitlogs")
+            compressors = [c for c in compressors if c == 'none']
+
+        for segment_size in BENCHMARK_SEGMENT_SIZES.split(','):
+            for compressor in compressors:
+                metrics = self._replay(node1, int(segment_size), compressor, int(BENCHMARK_KEYS))
+                record_result(cluster, 'commitlog_replay',
+                              {'segment_size_in_mb': int(segment_size), 'compressor': compressor, 'keys': int(BENCHMARK_KEYS)},
+                              metrics)
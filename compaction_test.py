@@ -1,3 +1,4 @@
+import glob
 import os
 import random
 import re
@@ -10,7 +11,16 @@ import parse
 
 from dtest import Tester, debug, create_ks
 from tools.assertions import assert_length_equal, assert_none, assert_one
-from tools.decorators import since
+from tools.benchmark import ResourceUsage, record_result
+from tools.compaction import compaction_history, wait_for_compactions
+from tools.decorators import benchmark, since
+from tools.jmxutils import remove_perf_disable_shared_mem
+
+# datasets of the compaction benchmark, as <keys>x<rounds>: every round writes
+# (or overwrites) the same <keys> keys and flushes them to a new sstable
+BENCHMARK_DATASETS = os.environ.get('COMPACTION_BENCHMARK_DATASETS', '500000x4,100000x16')
+# compaction throughput settings of the benchmark, in MB/s; 0 is unthrottled
+BENCHMARK_THROUGHPUTS = os.environ.get('COMPACTION_BENCHMARK_THROUGHPUTS', '0,16')
 
 
 class TestCompaction(Tester):
@@ -66,8 +76,11 @@ class TestCompaction(Tester):
         Insert data and check data size before and after a compaction.
         """
         cluster = self.cluster
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         [node1] = cluster.nodelist()
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
 
         stress_write(node1)
 
@@ -85,7 +98,7 @@ class TestCompaction(Tester):
 
         node1.flush()
         node1.compact()
-        node1.wait_for_compactions()
+        wait_for_compactions(node1)
 
         output = node1.nodetool('cfstats').stdout
         if output.find(table_name) != -1:
@@ -114,8 +127,11 @@ class TestCompaction(Tester):
             min_bf_size = 100000
             max_bf_size = 150000
         cluster = self.cluster
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         [node1] = cluster.nodelist()
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
 
         for x in xrange(0, 5):
             node1.stress(['write', 'n=100K', "no-warmup", "cl=ONE", "-rate",
@@ -124,7 +140,7 @@ class TestCompaction(Tester):
             node1.flush()
 
         node1.nodetool('enableautocompaction')
-        node1.wait_for_compactions()
+        wait_for_compactions(node1)
 
         table_name = 'standard1'
         output = node1.nodetool('cfstats').stdout
@@ -159,8 +175,11 @@ class TestCompaction(Tester):
         """
         self.skip_if_no_major_compaction()
         cluster = self.cluster
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         [node1] = cluster.nodelist()
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
         session = self.patient_cql_connection(node1)
         create_ks(session, 'ks', 1)
         session.execute("create table cf (key int PRIMARY KEY, val int) with gc_grace_seconds = 0 and compaction= {'class':'" + self.strategy + "'}")
@@ -173,7 +192,7 @@ class TestCompaction(Tester):
 
         node1.flush()
         node1.nodetool("compact ks cf")
-        node1.wait_for_compactions()
+        wait_for_compactions(node1)
         time.sleep(1)
         try:
             for data_dir in node1.data_directories():
@@ -570,11 +589,103 @@ def get_random_word(wordLen, population=string.ascii_letters + string.digits):
     return ''.join([random.choice(population) for _ in range(wordLen)])
 
 
-def stress_write(node, keycount=100000):
-    node.stress(['write', 'n={keycount}'.format(keycount=keycount)])
+def stress_write(node, keycount=100000, args=()):
+    node.stress(['write', 'n={keycount}'.format(keycount=keycount)] + list(args))
 
 
 strategies = ['LeveledCompactionStrategy', 'SizeTieredCompactionStrategy', 'DateTieredCompactionStrategy']
 for strategy in strategies:
     cls_name = ('TestCompaction_with_' + strategy)
     vars()[cls_name] = type(cls_name, (TestCompaction,), {'strategy': strategy, '__test__': True})
+
+
+def _sstables_bytes(node, ks, table):
+    """
+    Returns the size of the files of ks.table on node, without its snapshots
+    and backups, which are in subdirectories of the table directory.
+    """
+    total = 0
+    for data_dir in node.data_directories():
+        # before 2.1, table directories don't have the table id
+        for table_dir in glob.glob(os.path.join(data_dir, ks, table + '-*')) + glob.glob(os.path.join(data_dir, ks, table)):
+            for name in os.listdir(table_dir):
+                path = os.path.join(table_dir, name)
+                if os.path.isfile(path):
+                    total += os.path.getsize(path)
+    return total
+
+
+class TestCompactionBenchmark(Tester):
+    """
+    Measures how much work each compaction strategy does to compact the same
+    datasets, at each compaction throughput setting, and records it with
+    tools.benchmark under the 'compaction' suite.
+    """
+
+    __test__ = False
+
+    def _compact_dataset(self, node, session, keys, rounds, throughput):
+        """
+        Writes a dataset with compaction disabled, then lets the strategy
+        compact it, and returns the measurements.
+        """
+        session.execute("DROP KEYSPACE IF EXISTS keyspace1")
+        # auto_snapshot is off, but don't count leftovers of earlier runs either
+        node.nodetool('clearsnapshot')
+        node.nodetool('setcompactionthroughput -- {}'.format(throughput))
+        for _ in range(rounds):
+            stress_write(node, keycount=keys, args=['no-warmup', '-rate', 'threads=50', '-schema', 'replication(factor=1)',
+                                                    'compaction(strategy={},enabled=false)'.format(self.strategy)])
+            node.flush()
+
+        flushed_bytes = _sstables_bytes(node, 'keyspace1', 'standard1')
+        before = set(e.id for e in compaction_history(session, 'keyspace1', 'standard1'))
+
+        with ResourceUsage([node]) as usage:
+            node.nodetool('enableautocompaction keyspace1 standard1')
+            wait_for_compactions(node, timeout=3600)
+
+        history = compaction_history(session, 'keyspace1', 'standard1', exclude=before)
+        bytes_read = sum(e.bytes_in for e in history)
+        bytes_written = sum(e.bytes_out for e in history)
+        return dict(usage.metrics(),
+                    compactions=len(history),
+                    flushed_bytes=flushed_bytes,
+                    bytes_read=bytes_read,
+                    bytes_written=bytes_written,
+                    # every byte is written once by the flush, then once more by each compaction it goes through
+                    write_amplification=float(flushed_bytes + bytes_written) / flushed_bytes,
+                    read_throughput_mb=bytes_read / usage.elapsed / (1024 * 1024),
+                    live_bytes=_sstables_bytes(node, 'keyspace1', 'standard1'),
+                    sstables=len(node.get_sstables('keyspace1', 'standard1')))
+
+    @benchmark
+    def compaction_benchmark_test(self):
+        """
+        Benchmark every combination of BENCHMARK_DATASETS and BENCHMARK_THROUGHPUTS.
+        """
+        if self.strategy == 'TimeWindowCompactionStrategy' and self.cluster.version() < '3.0.8':
+            self.skipTest('TimeWindowCompactionStrategy was added in 3.0.8')
+        cluster = self.cluster
+        # dropping the keyspace of the previous run must not leave a snapshot of it behind
+        cluster.set_configuration_options(values={'auto_snapshot': False})
+        cluster.populate(1)
+        [node1] = cluster.nodelist()
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
+        session = self.patient_exclusive_cql_connection(node1)
+
+        for dataset in BENCHMARK_DATASETS.split(','):
+            keys, rounds = (int(n) for n in dataset.split('x'))
+            for throughput in BENCHMARK_THROUGHPUTS.split(','):
+                metrics = self._compact_dataset(node1, session, keys, rounds, int(throughput))
+                record_result(cluster, 'compaction',
+                              {'strategy': self.strategy, 'keys': keys, 'rounds': rounds,
+                               'compaction_throughput_mb': int(throughput), 'data_dir_count': cluster.data_dir_count},
+                              metrics)
+
+
+for strategy in strategies + ['TimeWindowCompactionStrategy']:
+    cls_name = ('TestCompactionBenchmark_with_' + strategy)
+    vars()[cls_name] = type(cls_name, (TestCompactionBenchmark,), {'strategy': strategy, '__test__': True})
@@ -22,12 +22,14 @@ from cassandra.murmur3 import murmur3
 from cassandra.util import SortedSet
 from ccmlib.common import is_win
 
-from cqlsh_tools import (DummyColorMap, assert_csvs_items_equal, csv_rows,
-                         monkeypatch_driver, random_list, unmonkeypatch_driver,
-                         write_rows_to_csv)
+from cqlsh_tools import (CSV_MEMORY_THRESHOLD, CqlshSessions, DummyColorMap,
+                         assert_csvs_items_equal, assert_items_equal_external,
+                         csv_rows, exclusive_connect, monkeypatch_driver,
+                         random_list, unmonkeypatch_driver, write_rows_to_csv)
 from dtest import (DISABLE_VNODES, Tester, debug, warning, create_ks)
+from tools.benchmark import ChildProcessUsage, record_result
 from tools.data import rows_to_list
-from tools.decorators import since
+from tools.decorators import benchmark, since
 from tools.metadata_wrapper import (UpdatingClusterMetadataWrapper,
                                     UpdatingTableMetadataWrapper)
 
@@ -38,6 +40,20 @@ PARTITIONERS = {
     "order": "org.apache.cassandra.dht.OrderPreservingPartitioner"
 }
 
+# the COPY benchmark changes one option at a time from the defaults, going through
+# these values, for the COPY directions the option applies to
+BENCHMARK_SWEEPS = (
+    ('NUMPROCESSES', (1, 2, 4, 8, 16), ('TO', 'FROM')),
+    ('CHUNKSIZE', (1000, 5000, 20000), ('FROM',)),
+    ('MAXBATCHSIZE', (5, 20, 50), ('FROM',)),
+    ('INGESTRATE', (10000, 100000, 1000000), ('FROM',)),
+    ('PREPAREDSTATEMENTS', (True, False), ('FROM',)),
+)
+BENCHMARK_ROWS = int(os.environ.get('COPY_BENCHMARK_ROWS', '200000'))
+
+# e.g. "1000 rows exported to 1 files in 0.335 seconds." or "1000 rows imported from 1 files in 0.5 seconds (0 skipped)."
+_COPY_SUMMARY = re.compile(r'(\d+) rows (?:exported|imported).*? in ([\d.]+) seconds')
+
 
 class UTC(datetime.tzinfo):
     """
@@ -63,6 +79,7 @@ class CqlshCopyTest(Tester):
     def __init__(self, *args, **kwargs):
         Tester.__init__(self, *args, **kwargs)
         self._tempfiles = []
+        self._cqlsh_sessions = CqlshSessions(connect=exclusive_connect(self))
 
     @classmethod
     def setUpClass(cls):
@@ -73,6 +90,7 @@ class CqlshCopyTest(Tester):
         unmonkeypatch_driver(cls._cached_driver_methods)
 
     def tearDown(self):
+        self._cqlsh_sessions.close_all()
         self.delete_temp_files()
         super(CqlshCopyTest, self).tearDown()
 
@@ -154,10 +172,11 @@ class CqlshCopyTest(Tester):
         return cqlshrc
 
     def run_cqlsh(self, cmds=None, cqlsh_options=None, use_debug=True, skip_cqlshrc=False,
-                  auth_enabled=False, show_output=True, retry_on_request_timeout=True):
+                  auth_enabled=False, show_output=True, retry_on_request_timeout=True, persistent=True):
         """
         Run cqlsh on node1 adding the debug and cqlshrc to the clqsh options, unless the caller
-        has specified its own options.
+        has specified its own options. Unless persistent is False, the commands may run in
+        a cqlsh process kept for the test (see CqlshSessions).
         """
         if cqlsh_options is None:
             cqlsh_options = []
@@ -172,17 +191,27 @@ class CqlshCopyTest(Tester):
             cqlsh_options.append('--username=cassandra')
             cqlsh_options.append('--password=cassandra')
 
+        def one_shot():
+            return self.node1.run_cqlsh(cmds=cmds, cqlsh_options=cqlsh_options)
+
+        def run():
+            if not persistent:
+                return one_shot()
+            # same statements as node.run_cqlsh sends, in a persistent cqlsh when possible
+            statements = [cmd.strip() for cmd in (cmds or '').split(';') if cmd.strip()]
+            return self._cqlsh_sessions.run(self.node1, statements, one_shot, cqlsh_options=cqlsh_options)
+
         if retry_on_request_timeout:
             num_attempts = 0
             while num_attempts < 5:
-                ret = self.node1.run_cqlsh(cmds=cmds, cqlsh_options=cqlsh_options)
+                ret = run()
 
                 if not re.search(r"Client request timeout", ret[0]):
                     break
 
                 num_attempts += 1
         else:
-            ret = self.node1.run_cqlsh(cmds=cmds, cqlsh_options=cqlsh_options)
+            ret = run()
 
         if show_output:
             debug('Output:\n{}'.format(ret[0]))  # show stdout of copy cmd
@@ -373,7 +402,13 @@ class CqlshCopyTest(Tester):
             else:
                 raise RuntimeError("table_name is required if cql_type_names are not specified")
 
-        processed_results = list(self.result_to_csv_rows(results, cql_type_names, nullval=nullval))
+        if os.path.getsize(csv_filename) > CSV_MEMORY_THRESHOLD:
+            # compare the rows on disk, formatting the results as they are paged in
+            assert_items_equal_external((repr(row) for row in csv_rows(csv_filename)),
+                                        (repr(row) for row in self.iter_csv_rows(results, cql_type_names, nullval=nullval)))
+            return
+
+        processed_results = self.result_to_csv_rows(results, cql_type_names, nullval=nullval)
         csv_results = list(csv_rows(csv_filename))
 
         self.maxDiff = None
@@ -453,13 +488,19 @@ class CqlshCopyTest(Tester):
         Given an object returned from a CQL query, returns a string formatted by
         the cqlsh formatting utilities.
         """
+        return list(self.iter_csv_rows(results, cql_type_names, time_format=time_format, nullval=nullval))
+
+    def iter_csv_rows(self, results, cql_type_names, time_format=None, nullval=''):
+        """
+        Like result_to_csv_rows, but formats rows one at a time as they are
+        iterated, so results don't have to fit in memory.
+        """
         # This has no real dependencies on Tester except that self._cqlshlib has
         # to grab self.cluster's install directory. This should be pulled out
         # into a bare function if cqlshlib is made easier to interact with.
         if not time_format:
             time_format = self.default_time_format
 
-        processed = []
         format_fn = self.make_csv_formatter(time_format, nullval)
 
         # build the typemap once ahead of time to speed up formatting
@@ -471,11 +512,8 @@ class CqlshCopyTest(Tester):
         except ImportError:
             cql_type_map = {}
 
-        for i, row in enumerate(results):
-            formatted_row = [format_fn(v, t, cql_type_map.get(t))
-                             for v, t in zip(row, cql_type_names)]
-            processed.append(formatted_row)
-        return processed
+        for row in results:
+            yield [format_fn(v, t, cql_type_map.get(t)) for v, t in zip(row, cql_type_names)]
 
     def test_list_data(self):
         """
@@ -2472,25 +2510,15 @@ class CqlshCopyTest(Tester):
 
         def run_copy_to(filename):
             debug('Exporting to csv file: {}'.format(filename.name))
-            start = datetime.datetime.now()
-            copy_to_cmd = "CONSISTENCY ALL; COPY {} TO '{}'".format(stress_table, filename.name)
-            if copy_to_options:
-                copy_to_cmd += ' WITH ' + ' AND '.join('{} = {}'.format(k, v) for k, v in copy_to_options.iteritems())
-            debug('Running {}'.format(copy_to_cmd))
-            result = self.run_cqlsh(cmds=copy_to_cmd)
+            result, measurement = self._run_copy('TO', stress_table, filename.name, copy_to_options)
             ret.append(result)
-            debug("COPY TO took {} to export {} records".format(datetime.datetime.now() - start, num_records))
+            debug("COPY TO took {:.3f}s to export {} records".format(measurement['wall_seconds'], num_records))
 
         def run_copy_from(filename):
             debug('Importing from csv file: {}'.format(filename.name))
-            start = datetime.datetime.now()
-            copy_from_cmd = "COPY {} FROM '{}'".format(stress_table, filename.name)
-            if copy_from_options:
-                copy_from_cmd += ' WITH ' + ' AND '.join('{} = {}'.format(k, v) for k, v in copy_from_options.iteritems())
-            debug('Running {}'.format(copy_from_cmd))
-            result = self.run_cqlsh(cmds=copy_from_cmd)
+            result, measurement = self._run_copy('FROM', stress_table, filename.name, copy_from_options)
             ret.append(result)
-            debug("COPY FROM took {} to import {} records".format(datetime.datetime.now() - start, num_records))
+            debug("COPY FROM took {:.3f}s to import {} records".format(measurement['wall_seconds'], num_records))
 
         num_records = create_records()
 
@@ -2516,6 +2544,87 @@ class CqlshCopyTest(Tester):
 
         return ret
 
+    def _run_copy(self, direction, table, filename, options=None):
+        """
+        Runs COPY <table> TO or FROM filename with cqlsh, and measures it.
+
+        @param direction 'TO' or 'FROM'
+        @param options COPY options, as a dict
+        @return the (stdout, stderr) of cqlsh, and a dict of measurements:
+                wall_seconds, copy_seconds (as reported by cqlsh, None if it didn't report),
+                startup_seconds (the rest of wall_seconds: starting cqlsh and connecting),
+                rows (as reported by cqlsh), bytes (the size of the csv file after the copy),
+                peak_worker_rss and worker_processes (of cqlsh and its worker processes)
+        """
+        cmd = "COPY {} {} '{}'".format(table, direction, filename)
+        if direction == 'TO':
+            cmd = "CONSISTENCY ALL; " + cmd
+        if options:
+            cmd += ' WITH ' + ' AND '.join('{} = {}'.format(k, v) for k, v in options.iteritems())
+        debug('Running {}'.format(cmd))
+
+        start = time.time()
+        with ChildProcessUsage() as usage:
+            # startup time and worker processes are only measured for a new cqlsh
+            result = self.run_cqlsh(cmds=cmd, persistent=False)
+        wall_seconds = time.time() - start
+
+        summary = _COPY_SUMMARY.search(result[0])
+        copy_seconds = float(summary.group(2)) if summary else None
+        return result, {
+            'wall_seconds': wall_seconds,
+            'copy_seconds': copy_seconds,
+            'startup_seconds': wall_seconds - copy_seconds if copy_seconds is not None else None,
+            'rows': int(summary.group(1)) if summary else None,
+            'bytes': os.path.getsize(filename),
+            'peak_worker_rss': usage.peak_rss,
+            'worker_processes': usage.peak_processes,
+        }
+
+    def _benchmark_copy(self, nodes):
+        """
+        Measures COPY TO and COPY FROM of BENCHMARK_ROWS stress rows on a cluster of nodes,
+        for each value of each option of BENCHMARK_SWEEPS, and records the results with
+        tools.benchmark under the 'cqlsh_copy' suite.
+        """
+        self.prepare(nodes=nodes, configuration_options={'truncate_request_timeout_in_ms': 60000})
+        table = 'keyspace1.standard1'
+        self.node1.stress(['write', 'n={} cl=ALL'.format(BENCHMARK_ROWS), 'no-warmup', '-rate', 'threads=50'])
+
+        def measure(direction, filename, option=None, value=None):
+            if direction == 'FROM':
+                self.session.execute("TRUNCATE {}".format(table))
+            result, metrics = self._run_copy(direction, table, filename, {option: value} if option else None)
+            self.assertEqual(metrics['rows'], BENCHMARK_ROWS, "COPY {} didn't copy every row: {}".format(direction, result[1]))
+            metrics['rows_per_second'] = metrics['rows'] / metrics['wall_seconds']
+            metrics['bytes_per_second'] = metrics['bytes'] / metrics['wall_seconds']
+            record_result(self.cluster, 'cqlsh_copy',
+                          {'direction': direction, 'nodes': nodes, 'rows': BENCHMARK_ROWS, 'option': option, 'value': value},
+                          metrics)
+
+        exported = self.get_temp_file()
+        measure('TO', exported.name)
+        for option, values, directions in BENCHMARK_SWEEPS:
+            for value in values:
+                if 'TO' in directions:
+                    measure('TO', self.get_temp_file().name, option, value)
+                if 'FROM' in directions:
+                    measure('FROM', exported.name, option, value)
+
+    @benchmark
+    def copy_benchmark_one_node_test(self):
+        """
+        Benchmark COPY against a single node.
+        """
+        self._benchmark_copy(nodes=1)
+
+    @benchmark
+    def copy_benchmark_three_nodes_test(self):
+        """
+        Benchmark COPY against three nodes.
+        """
+        self._benchmark_copy(nodes=3)
+
     def test_bulk_round_trip_default(self):
         """
         Test bulk import with default stress import (one row per operation)
@@ -16,7 +16,8 @@ from cassandra.concurrent import execute_concurrent_with_args
 from cassandra.query import BatchStatement, BatchType
 from ccmlib import common
 
-from cqlsh_tools import monkeypatch_driver, unmonkeypatch_driver
+from cqlsh_tools import (CqlshSessions, exclusive_connect, monkeypatch_driver,
+                         unmonkeypatch_driver)
 from dtest import Tester, debug, create_ks, create_cf
 from tools.assertions import assert_all, assert_none
 from tools.data import create_c1c2_table, insert_c1c2, rows_to_list
@@ -34,7 +35,12 @@ class TestCqlsh(Tester):
     def tearDownClass(cls):
         unmonkeypatch_driver(cls._cached_driver_methods)
 
+    def setUp(self):
+        super(TestCqlsh, self).setUp()
+        self._cqlsh_sessions = CqlshSessions(connect=exclusive_connect(self))
+
     def tearDown(self):
+        self._cqlsh_sessions.close_all()
         if hasattr(self, 'tempfile') and not common.is_win():
             os.unlink(self.tempfile.name)
         super(TestCqlsh, self).tearDown()
@@ -1656,11 +1662,15 @@ Tracing session:""")
             port = node.network_interfaces['thrift'][1]
         args = cqlsh_options + [host, str(port)]
         sys.stdout.flush()
-        p = subprocess.Popen([cli] + args, env=env, stdin=subprocess.PIPE, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        for cmd in cmds.split(';'):
-            p.stdin.write(cmd + ';\n')
-        p.stdin.write("quit;\n")
-        return p.communicate()
+
+        def one_shot():
+            p = subprocess.Popen([cli] + args, env=env, stdin=subprocess.PIPE, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+            for cmd in cmds.split(';'):
+                p.stdin.write(cmd + ';\n')
+            p.stdin.write("quit;\n")
+            return p.communicate()
+
+        return self._cqlsh_sessions.run(node, cmds.split(';'), one_shot, cqlsh_options=cqlsh_options, env=env)[:2]
 
 
 class CqlshSmokeTest(Tester):
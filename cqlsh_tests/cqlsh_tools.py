@@ -1,9 +1,45 @@
 import csv
+import errno
+import heapq
+import itertools
+import os
 import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from collections import namedtuple
 
 import cassandra
+import six
+from ccmlib import common
 from nose.tools import assert_items_equal
 
+# csv files bigger than this are compared with an external sort rather than in memory
+CSV_MEMORY_THRESHOLD = int(os.environ.get('CSV_MEMORY_THRESHOLD_MB', '64')) * 1024 * 1024
+# how many lines are sorted in memory at once by external_sort
+SORT_CHUNK_LINES = 200000
+# how many differing items are reported by assert_items_equal_external
+MAX_REPORTED_DIFFS = 10
+
+_END = object()
+
+# set to true to run cqlsh commands in a cqlsh process kept for the whole test,
+# instead of a new process for every command as ccm does
+PERSISTENT_CQLSH = os.environ.get('PERSISTENT_CQLSH', '').lower() in ('yes', 'true')
+# statements that change the state of a cqlsh session or depend on it being fresh,
+# which CqlshSession doesn't run so they can't leak into later commands
+_SESSION_STATEFUL = re.compile(r'^\s*(USE|CONSISTENCY|SERIAL\s+CONSISTENCY|TRACING|EXPAND|PAGING|CAPTURE|LOGIN|SOURCE|DESC|DESCRIBE|DEBUG|EXIT|QUIT)\b',
+                               re.IGNORECASE)
+_STDIN_LINE = re.compile(r'<stdin>:(\d+):')
+# options that make cqlsh run something else than its stdin
+_NON_INTERACTIVE_OPTIONS = ('-f', '--file', '-e', '--execute')
+
+# what CqlshSessions.run returns, like ccm's node.run_cqlsh
+CqlshOutput = namedtuple('CqlshOutput', ('stdout', 'stderr', 'rc'))
+
 
 class DummyColorMap(object):
 
@@ -23,7 +59,103 @@ def csv_rows(filename, delimiter=None):
             yield row
 
 
+def _sorted_runs(lines, tmpdir, chunk_lines):
+    """
+    Writes lines to tmpdir in sorted runs of chunk_lines lines, and returns their paths.
+    """
+    runs = []
+    for chunk in iter(lambda: list(itertools.islice(lines, chunk_lines)), []):
+        chunk.sort()
+        path = os.path.join(tmpdir, 'run{}'.format(len(runs)))
+        with open(path, 'w') as f:
+            f.writelines(line + '\n' for line in chunk)
+        runs.append(path)
+    return runs
+
+
+def _read_run(path):
+    with open(path) as f:
+        for line in f:
+            yield line[:-1]
+
+
+def external_sort(lines, tmpdir, chunk_lines=SORT_CHUNK_LINES):
+    """
+    Returns an iterator over lines, sorted, keeping at most chunk_lines of
+    them in memory at once. The lines must not contain newlines; sorted runs
+    are written to tmpdir, which must outlive the iterator.
+    """
+    return heapq.merge(*[_read_run(path) for path in _sorted_runs(iter(lines), tmpdir, chunk_lines)])
+
+
+def sorted_items_diff(first, second, max_diffs=MAX_REPORTED_DIFFS):
+    """
+    Compares two sorted iterators as multisets.
+
+    @return the first max_diffs items of first that aren't in second, the
+            first max_diffs items of second that aren't in first, and the
+            total number of each
+    """
+    only_first, only_second = [], []
+    first_count = second_count = 0
+    a, b = next(first, _END), next(second, _END)
+    while a is not _END or b is not _END:
+        if b is _END or (a is not _END and a < b):
+            if first_count < max_diffs:
+                only_first.append(a)
+            first_count += 1
+            a = next(first, _END)
+        elif a is _END or b < a:
+            if second_count < max_diffs:
+                only_second.append(b)
+            second_count += 1
+            b = next(second, _END)
+        else:
+            a, b = next(first, _END), next(second, _END)
+    return only_first, only_second, first_count, second_count
+
+
+def assert_items_equal_external(first, second, max_diffs=MAX_REPORTED_DIFFS, chunk_lines=SORT_CHUNK_LINES):
+    """
+    Like assert_items_equal for iterables of single line strings too big to
+    hold in memory: both are sorted on disk and merged. On failure, reports
+    the first max_diffs items of each that the other doesn't have.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='dtest-sort-')
+    try:
+        first_dir, second_dir = os.path.join(tmpdir, 'first'), os.path.join(tmpdir, 'second')
+        os.mkdir(first_dir)
+        os.mkdir(second_dir)
+        only_first, only_second, first_count, second_count = sorted_items_diff(
+            external_sort(first, first_dir, chunk_lines), external_sort(second, second_dir, chunk_lines), max_diffs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if first_count or second_count:
+        message = ['Items differ: {} only in the first, {} only in the second'.format(first_count, second_count)]
+        if only_first:
+            message.append('First {} only in the first:'.format(len(only_first)))
+            message.extend('  ' + item for item in only_first)
+        if only_second:
+            message.append('First {} only in the second:'.format(len(only_second)))
+            message.extend('  ' + item for item in only_second)
+        raise AssertionError('\n'.join(message))
+
+
+def _lines(filename):
+    with open(filename, 'r') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
 def assert_csvs_items_equal(filename1, filename2):
+    """
+    Checks two files have the same lines, in any order. Files bigger than
+    CSV_MEMORY_THRESHOLD are compared with assert_items_equal_external.
+    """
+    if max(os.path.getsize(filename1), os.path.getsize(filename2)) > CSV_MEMORY_THRESHOLD:
+        assert_items_equal_external(_lines(filename1), _lines(filename2))
+        return
     with open(filename1, 'r') as x, open(filename2, 'r') as y:
         assert_items_equal(list(x.readlines()), list(y.readlines()))
 
@@ -90,3 +222,243 @@ def unmonkeypatch_driver(cache):
 
     if hasattr(cassandra, 'deserializers'):
         cassandra.deserializers.DesDateType = cache['DesDateType']
+
+
+class CqlshSessionError(Exception):
+    """
+    Raised when a CqlshSession's process died or didn't answer in time; the
+    session is closed. sent tells whether the command had been written to
+    cqlsh: if it had, it may have been partly applied, and running it again
+    could apply it twice.
+    """
+
+    def __init__(self, message, sent=True):
+        super(CqlshSessionError, self).__init__(message)
+        self.sent = sent
+
+
+class CqlshSession(object):
+    """
+    A cqlsh process that stays connected and runs commands sent to its
+    stdin, to avoid starting a python process and connecting to the cluster
+    for every command.
+
+    Each batch of statements is followed by a SOURCE of a file that doesn't
+    exist, named with a unique token: cqlsh reports it on stderr once it is
+    done with the batch, and everything it printed to stdout before that is
+    already in the pipe, so the output of the batch is what was read up to
+    the token. Error line numbers ("<stdin>:N:") are made relative to the
+    batch, so the output is the same as a cqlsh process that only ran it.
+
+    Use can_run to check a batch doesn't change the session's state, and run
+    it in a one-shot process otherwise. Sessions need non-blocking pipes and
+    select on them, so they aren't available on Windows.
+
+    @param node The node to connect to
+    @param cqlsh_options Command line options of cqlsh
+    @param env The environment of cqlsh; the node's by default
+    @param timeout Seconds a batch may take
+    """
+
+    def __init__(self, node, cqlsh_options=None, env=None, timeout=300):
+        import fcntl
+
+        cli = os.path.join(node.get_install_dir(), 'bin', common.platform_binary('cqlsh'))
+        if node.get_base_cassandra_version() >= 2.1:
+            host, port = node.network_interfaces['binary']
+        else:
+            host, port = node.network_interfaces['thrift']
+        env = dict(env if env is not None else node.get_env())
+        # stdout must reach the pipe as soon as it's written
+        env['PYTHONUNBUFFERED'] = '1'
+        self.timeout = timeout
+        # the schema version of the node when the session started, set by CqlshSessions
+        self.schema_version = None
+        self.lines_sent = 0
+        self.missing_dir = tempfile.mkdtemp(prefix='dtest-cqlsh-')
+        self.process = subprocess.Popen([cli] + list(cqlsh_options or []) + [host, str(port)], env=env,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for f in (self.process.stdout, self.process.stderr):
+            fcntl.fcntl(f, fcntl.F_SETFL, fcntl.fcntl(f, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    @staticmethod
+    def can_run(statements, cqlsh_options=None):
+        """
+        Whether statements can run in a persistent session started with
+        cqlsh_options without changing its state for later commands.
+        """
+        if any(option.split('=')[0] in _NON_INTERACTIVE_OPTIONS for option in cqlsh_options or ()):
+            return False
+        return not any(_SESSION_STATEFUL.match(statement) for statement in statements)
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def _read(self, f):
+        try:
+            data = os.read(f.fileno(), 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return ''
+            raise
+        if not data:
+            raise CqlshSessionError('cqlsh exited with status {}'.format(self.process.wait()))
+        return data
+
+    def execute(self, statements):
+        """
+        Runs statements, each written to cqlsh followed by ';' and a newline.
+
+        @return the stdout and stderr of cqlsh for the statements
+        """
+        import select
+
+        token = 'dtest-end-{}'.format(uuid.uuid4())
+        offset = self.lines_sent
+        batch = ''.join(statement + ';\n' for statement in statements)
+        batch += "SOURCE '{}';\n".format(os.path.join(self.missing_dir, token))
+        if isinstance(batch, six.text_type):
+            batch = batch.encode('utf-8')
+        self.lines_sent += batch.count('\n')
+
+        try:
+            self.process.stdin.write(batch)
+            self.process.stdin.flush()
+        except (IOError, OSError) as e:
+            # e.g. EPIPE, cqlsh exited before it got the batch
+            self.close()
+            raise CqlshSessionError(str(e), sent=False)
+
+        out, err = [], ''
+        deadline = time.time() + self.timeout
+        try:
+            # the sentinel's whole error line, up to its newline
+            while not re.search(re.escape(token) + '.*\n', err):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise CqlshSessionError('cqlsh took more than {}s to run {}'.format(self.timeout, statements))
+                readable, _, _ = select.select([self.process.stdout, self.process.stderr], [], [], remaining)
+                if self.process.stdout in readable:
+                    out.append(self._read(self.process.stdout))
+                if self.process.stderr in readable:
+                    err += self._read(self.process.stderr)
+            # everything printed before the sentinel is in the pipe by now
+            data = self._read(self.process.stdout)
+            while data:
+                out.append(data)
+                data = self._read(self.process.stdout)
+        except (CqlshSessionError, IOError, OSError) as e:
+            self.close()
+            if isinstance(e, CqlshSessionError):
+                raise
+            raise CqlshSessionError(str(e))
+
+        err = ''.join(line for line in err.splitlines(True) if token not in line)
+
+        def relative(m):
+            return '<stdin>:{}:'.format(int(m.group(1)) - offset)
+        return _STDIN_LINE.sub(relative, ''.join(out)), _STDIN_LINE.sub(relative, err)
+
+    def close(self):
+        if self.alive:
+            try:
+                self.process.stdin.write('quit;\n')
+                self.process.stdin.close()
+            except IOError:
+                pass
+            deadline = time.time() + 10
+            while self.alive and time.time() < deadline:
+                time.sleep(0.05)
+            if self.alive:
+                self.process.kill()
+                self.process.wait()
+        shutil.rmtree(self.missing_dir, ignore_errors=True)
+
+
+def exclusive_connect(tester):
+    """
+    Returns a connect function for CqlshSessions that opens exclusive
+    connections of tester, as the default superuser when the cluster uses
+    password authentication.
+    """
+    def connect(node):
+        if 'PasswordAuthenticator' in tester.cluster._config_options.get('authenticator', ''):
+            return tester.exclusive_cql_connection(node, user='cassandra', password='cassandra')
+        return tester.exclusive_cql_connection(node)
+    return connect
+
+
+class CqlshSessions(object):
+    """
+    The CqlshSessions of a test, one per node and set of options.
+
+    run returns the output of a command from a persistent session when it
+    can, and from a new cqlsh process started by one_shot otherwise, or when
+    the session exits before it is sent the command. Commands always run in
+    one-shot processes on Windows. Call close_all when the test ends.
+
+    cqlsh only learns about schema changes made by other clients from the
+    events the driver debounces, and doesn't look a table up again when it's
+    missing, so a session is replaced whenever the schema version of its
+    node changed since its previous command. connect(node) returns the
+    driver session that version is read with; without it, or when it can't
+    be read, commands run in a one-shot process.
+
+    @param connect A function returning a driver session connected to a node
+    """
+
+    def __init__(self, connect=None):
+        self.connect = connect
+        self.sessions = {}
+        self._schema_sessions = {}
+
+    def _schema_version(self, node):
+        try:
+            session = self._schema_sessions.get(node.name)
+            if session is None:
+                session = self._schema_sessions[node.name] = self.connect(node)
+            return session.execute("SELECT schema_version FROM system.local")[0][0]
+        except Exception:
+            # e.g. the node is down; connect again next time
+            self._schema_sessions.pop(node.name, None)
+            return None
+
+    def run(self, node, statements, one_shot, cqlsh_options=None, env=None):
+        """
+        @param statements The statements of the command, split on ';'
+        @param one_shot Called without arguments to run the command in a new process
+        @return the CqlshOutput of the command, or what one_shot returned
+
+        Raises CqlshSessionError if the session failed after it was sent the
+        command.
+        """
+        if (not PERSISTENT_CQLSH or common.is_win() or self.connect is None or
+                not CqlshSession.can_run(statements, cqlsh_options)):
+            return one_shot()
+        schema_version = self._schema_version(node)
+        if schema_version is None:
+            return one_shot()
+        # one-shot processes see the current environment, and a restarted node needs a new connection
+        key = (node.name, node.pid, tuple(cqlsh_options or ()), tuple(sorted((env if env is not None else os.environ).items())))
+        session = self.sessions.get(key)
+        try:
+            if session is None or not session.alive or session.schema_version != schema_version:
+                for stale in [k for k in self.sessions if k == key or (k[0] == node.name and k[1] != node.pid)]:
+                    self.sessions.pop(stale).close()
+                session = self.sessions[key] = CqlshSession(node, cqlsh_options, env)
+                session.schema_version = schema_version
+            return CqlshOutput(*session.execute(statements), rc=0)
+        except CqlshSessionError as e:
+            self.sessions.pop(key, None)
+            if e.sent:
+                # the command may have been partly applied, don't apply it twice
+                raise
+            return one_shot()
+
+    def close_all(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        # the test shuts its driver sessions down itself
+        self._schema_sessions.clear()
@@ -1,9 +1,12 @@
 from __future__ import with_statement
 
 import ConfigParser
+import atexit
 import copy
 import errno
 import glob
+import hashlib
+import json
 import logging
 import os
 import pprint
@@ -44,6 +47,9 @@ from plugins.dtestconfig import _CONFIG as CONFIG
 from plugins.dtestconfig import GlobalConfigObject
 from tools.context import log_filter
 from tools.funcutils import merge_dicts
+from tools.logtail import LogTailer, LogWatchThread, ignore_patterns_regex
+from tools.readiness import wait_for_schema_agreement
+from tools.resource_monitor import ResourceMonitor
 
 LOG_SAVED_DIR = "logs"
 try:
@@ -51,9 +57,17 @@ try:
 except OSError:
     pass
 
-LAST_LOG = os.path.join(LOG_SAVED_DIR, "last")
+# run_dtests.py --workers runs several nose processes side by side; each one
+# is handed a distinct worker id so that the clusters they create don't fight
+# over loopback addresses, JMX ports or the files that track the last test.
+# 0 means this process isn't one of several workers.
+DTEST_WORKER_ID = int(os.environ.get('DTEST_WORKER_ID', '0'))
+WORKER_SUFFIX = '_worker{}'.format(DTEST_WORKER_ID) if DTEST_WORKER_ID else ''
+WORKER_IP_PREFIX = '127.0.{}.'.format(DTEST_WORKER_ID)
 
-LAST_TEST_DIR = 'last_test_dir'
+LAST_LOG = os.path.join(LOG_SAVED_DIR, "last" + WORKER_SUFFIX)
+
+LAST_TEST_DIR = 'last_test_dir' + WORKER_SUFFIX
 
 DEFAULT_DIR = './'
 config = ConfigParser.RawConfigParser()
@@ -75,6 +89,14 @@ IGNORE_REQUIRE = os.environ.get('IGNORE_REQUIRE', '').lower() in ('yes', 'true')
 DATADIR_COUNT = os.environ.get('DATADIR_COUNT', '3')
 ENABLE_ACTIVE_LOG_WATCHING = os.environ.get('ENABLE_ACTIVE_LOG_WATCHING', '').lower() in ('yes', 'true')
 RUN_STATIC_UPGRADE_MATRIX = os.environ.get('RUN_STATIC_UPGRADE_MATRIX', '').lower() in ('yes', 'true')
+SHARED_UPGRADE = os.environ.get('SHARED_UPGRADE', '').lower() in ('yes', 'true')
+WARM_INSTALL_DIRS = os.environ.get('WARM_INSTALL_DIRS', '').lower() in ('yes', 'true')
+# benchmarks are skipped unless this is set, and append their results under BENCHMARK_RESULTS_DIR
+RUN_BENCHMARKS = os.environ.get('RUN_BENCHMARKS', '').lower() in ('yes', 'true')
+BENCHMARK_RESULTS_DIR = os.environ.get('BENCHMARK_RESULTS_DIR', 'benchmark_results')
+# sample the cpu, memory, fds, disk and gc pauses of every node during every test, see tools.resource_monitor
+RESOURCE_MONITOR = os.environ.get('RESOURCE_MONITOR', '').lower() in ('yes', 'true')
+RESOURCE_MONITOR_INTERVAL = float(os.environ.get('RESOURCE_MONITOR_INTERVAL', '1'))
 
 # devault values for configuration from configuration plugin
 _default_config = GlobalConfigObject(
@@ -93,7 +115,7 @@ if os.environ.get('DISABLE_VNODES', '').lower() in ('yes', 'true'):
 
 CURRENT_TEST = ""
 
-logging.basicConfig(filename=os.path.join(LOG_SAVED_DIR, "dtest.log"),
+logging.basicConfig(filename=os.path.join(LOG_SAVED_DIR, "dtest{}.log".format(WORKER_SUFFIX)),
                     filemode='w',
                     format='%(asctime)s,%(msecs)d %(name)s %(current_test)s %(levelname)s %(message)s',
                     datefmt='%H:%M:%S',
@@ -281,6 +303,14 @@ class Tester(TestCase):
     maxDiff = None
     allow_log_errors = False  # scan the log of each node for errors after every test.
     cluster_options = None
+    # Set to a node count (or a list of per-DC node counts, as taken by
+    # cluster.populate) to get an already populated and started cluster from
+    # CLUSTER_POOL in setUp instead of an empty one. See ClusterPool for what
+    # tests opting in have to be careful about.
+    pooled_topology = None
+    # Set to True to sample the resources of the nodes during the tests of
+    # this class even when RESOURCE_MONITOR isn't set.
+    monitor_resources = False
 
     def set_node_to_current_version(self, node):
         version = os.environ.get('CASSANDRA_VERSION')
@@ -294,23 +324,44 @@ class Tester(TestCase):
     def init_config(self):
         init_default_config(self.cluster, self.cluster_options)
 
+    def create_cluster(self):
+        """
+        Creates self.cluster, configured but not populated.
+
+        @return (test_path, cluster)
+        """
+        self.test_path = get_test_path()
+        self.cluster = create_ccm_cluster(self.test_path, name='test', **self.cluster_install_args())
+        maybe_setup_jacoco(self.test_path)
+        self.init_config()
+        set_log_levels(self.cluster)
+        return self.test_path, self.cluster
+
+    def cluster_install_args(self):
+        """
+        Returns the keyword arguments of create_ccm_cluster selecting what the
+        cluster of each test runs: CASSANDRA_VERSION or CASSANDRA_DIR unless
+        overridden.
+        """
+        return {}
+
     def setUp(self):
         self.set_current_tst_name()
         kill_windows_cassandra_procs()
         maybe_cleanup_cluster_from_last_test_file()
 
-        self.test_path = get_test_path()
-        self.cluster = create_ccm_cluster(self.test_path, name='test')
+        if self.pooled_topology is not None:
+            self.test_path, self.cluster = CLUSTER_POOL.acquire(self.pooled_topology, self.create_cluster)
+        else:
+            # pooled clusters hold on to the addresses this cluster will use
+            CLUSTER_POOL.clear()
+            self.create_cluster()
 
         self.maybe_begin_active_log_watch()
-        maybe_setup_jacoco(self.test_path)
-
-        self.init_config()
         write_last_test_file(self.test_path, self.cluster)
-
-        set_log_levels(self.cluster)
         self.connections = []
         self.runners = []
+        self.maybe_begin_resource_monitor()
 
     # this is intentionally spelled 'tst' instead of 'test' to avoid
     # making unittest think it's a test method
@@ -323,11 +374,35 @@ class Tester(TestCase):
             if not self.allow_log_errors:
                 self.begin_active_log_watch()
 
+    def maybe_begin_resource_monitor(self):
+        if RESOURCE_MONITOR or self.monitor_resources:
+            self._resource_monitor = ResourceMonitor(self.cluster, os.path.join(self.test_path, 'resources.jsonl'),
+                                                     interval=RESOURCE_MONITOR_INTERVAL)
+            self._resource_monitor.start()
+
+    def stop_resource_monitor(self):
+        """
+        Stops the resource monitor, if one is running, and returns it.
+        """
+        monitor = getattr(self, '_resource_monitor', None)
+        if monitor is not None:
+            monitor.stop()
+            self._resource_monitor = None
+        return monitor
+
+    def save_resource_samples(self, monitor, directory=None):
+        """Save the samples of a resource monitor to LOG_SAVED_DIR/resources, for tests whose logs aren't saved"""
+        directory = os.path.join(directory or LOG_SAVED_DIR, 'resources')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if os.path.exists(monitor.filename):
+            shutil.copyfile(monitor.filename, os.path.join(directory, '{}_{}.jsonl'.format(int(time.time() * 1000), self.id())))
+
     def begin_active_log_watch(self):
         """
-        Calls into ccm to start actively watching logs.
+        Starts a thread actively watching the node logs.
 
-        In the event that errors are seen in logs, ccm will call back to _log_error_handler.
+        In the event that errors are seen in logs, the thread will call back to _log_error_handler.
 
         When the cluster is no longer in use, stop_active_log_watch should be called to end log watching.
         (otherwise a 'daemon' thread will (needlessly) run until the process exits).
@@ -335,7 +410,29 @@ class Tester(TestCase):
         # log watching happens in another thread, but we want it to halt the main
         # thread's execution, which we have to do by registering a signal handler
         signal.signal(signal.SIGINT, self._catch_interrupt)
-        self._log_watch_thread = self.cluster.actively_watch_logs_for_error(self._log_error_handler, interval=0.25)
+        self._log_errors_while_ending = []
+        self._log_watch_thread = LogWatchThread(self.get_log_tailer(), self._log_error_handler)
+        self._log_watch_thread.start()
+
+    def end_active_log_watch(self):
+        """
+        Stops active log watching, if it was started, once test_is_ending is set:
+        the errors it still sees are kept for check_logs_for_errors.
+        """
+        log_watch_thread = getattr(self, '_log_watch_thread', None)
+        if log_watch_thread is not None:
+            stop_active_log_watch(log_watch_thread)
+
+    def get_log_tailer(self):
+        """
+        Returns the LogTailer for the current cluster, shared by active log
+        watching and check_logs_for_errors so that each log line is only
+        scanned once per test.
+        """
+        tailer = getattr(self, '_log_tailer', None)
+        if tailer is None or tailer.cluster is not self.cluster:
+            tailer = self._log_tailer = LogTailer(self.cluster)
+        return tailer
 
     def _log_error_handler(self, errordata):
         """
@@ -351,6 +448,12 @@ class Tester(TestCase):
         if self.allow_log_errors:
             return
 
+        if getattr(self, 'test_is_ending', False):
+            # the watcher and check_logs_for_errors share a LogTailer, so errors seen
+            # here once the test is ending are reported by tearDown instead
+            self._log_errors_while_ending.extend(errordata.items())
+            return
+
         reportable_errordata = OrderedDict()
 
         for nodename, errors in errordata.items():
@@ -435,6 +538,10 @@ class Tester(TestCase):
                 if os.path.exists(compactionlog):
                     self.assertGreaterEqual(os.path.getsize(compactionlog), 0)
                     shutil.copyfile(compactionlog, os.path.join(logdir, n + "_compaction.log"))
+            # samples of the resource monitor, if there is one
+            test_path = getattr(self, 'test_path', None)
+            if test_path and os.path.exists(os.path.join(test_path, 'resources.jsonl')):
+                shutil.copyfile(os.path.join(test_path, 'resources.jsonl'), os.path.join(logdir, 'resources.jsonl'))
             if os.path.exists(name):
                 os.unlink(name)
             if not is_win():
@@ -585,6 +692,8 @@ class Tester(TestCase):
             except:
                 pass
 
+        self.end_active_log_watch()
+        monitor = self.stop_resource_monitor()
         failed = did_fail()
         try:
             if not self.allow_log_errors and self.check_logs_for_errors():
@@ -595,19 +704,25 @@ class Tester(TestCase):
                 # save the logs for inspection
                 if failed or KEEP_LOGS:
                     self.copy_logs(self.cluster)
+                elif monitor is not None:
+                    self.save_resource_samples(monitor)
             except Exception as e:
                 print "Error saving log:", str(e)
             finally:
-                log_watch_thread = getattr(self, '_log_watch_thread', None)
-                cleanup_cluster(self.cluster, self.test_path, log_watch_thread)
+                if self.pooled_topology is not None and not failed:
+                    CLUSTER_POOL.release(self.test_path, self.cluster, self.pooled_topology)
+                else:
+                    log_watch_thread = getattr(self, '_log_watch_thread', None)
+                    cleanup_cluster(self.cluster, self.test_path, log_watch_thread)
+                self.get_log_tailer().close()
 
     def check_logs_for_errors(self):
-        for node in self.cluster.nodelist():
-            errors = list(self.__filter_errors(
-                ['\n'.join(msg) for msg in node.grep_log_for_errors()]))
+        watched = getattr(self, '_log_errors_while_ending', [])
+        for node_name, node_errors in watched + self.get_log_tailer().new_errors(final=True):
+            errors = list(self.__filter_errors(['\n'.join(msg) for msg in node_errors]))
             if len(errors) is not 0:
                 for error in errors:
-                    print_("Unexpected error in {node_name} log, error: \n{error}".format(node_name=node.name, error=error))
+                    print_("Unexpected error in {node_name} log, error: \n{error}".format(node_name=node_name, error=error))
                 return True
 
     def go(self, func):
@@ -624,11 +739,9 @@ class Tester(TestCase):
         """Filter errors, removing those that match self.ignore_log_patterns"""
         if not hasattr(self, 'ignore_log_patterns'):
             self.ignore_log_patterns = []
+        ignored = ignore_patterns_regex(self.ignore_log_patterns)
         for e in errors:
-            for pattern in self.ignore_log_patterns:
-                if re.search(pattern, e):
-                    break
-            else:
+            if ignored is None or not ignored.search(e):
                 yield e
 
     # Disable docstrings printing in nosetest output
@@ -714,7 +827,7 @@ def create_cf(session, name, key_type="varchar", speculative_retry=None, read_re
         query += ' AND COMPACT STORAGE'
 
     session.execute(query)
-    time.sleep(0.2)
+    wait_for_schema_agreement(session)
 
 
 def create_ks(session, name, rf):
@@ -796,15 +909,54 @@ def get_test_path():
 get_test_path.__test__ = False
 
 
-def create_ccm_cluster(test_path, name):
+def worker_port(port):
+    """
+    Shift a ccm-assigned per-node port (JMX, remote debug, byteman) by this
+    worker's id. ccm hands these out as 7000 + i * 100 and friends, and unlike
+    storage and native ports they are bound on localhost, so concurrent
+    workers would otherwise collide. A port of '0' means 'disabled' to ccm and
+    is left alone.
+    """
+    if not DTEST_WORKER_ID or str(port) == '0':
+        return port
+    return str(int(port) + DTEST_WORKER_ID)
+
+
+class DtestCluster(Cluster):
+    """
+    A ccm Cluster that keeps its nodes inside this worker's address range and
+    port offsets. Outside of a --workers run it behaves exactly like Cluster.
+    """
+
+    def populate(self, nodes, *args, **kwargs):
+        # only default the address range; explicit ipprefix/ipformat wins
+        if len(args) < 4 and 'ipprefix' not in kwargs and 'ipformat' not in kwargs:
+            kwargs['ipprefix'] = WORKER_IP_PREFIX
+        return super(DtestCluster, self).populate(nodes, *args, **kwargs)
+
+    def create_node(self, name, auto_bootstrap, thrift_interface, storage_interface, jmx_port, remote_debug_port, initial_token, *args, **kwargs):
+        if 'byteman_port' in kwargs:
+            kwargs['byteman_port'] = worker_port(kwargs['byteman_port'])
+        return super(DtestCluster, self).create_node(name, auto_bootstrap, thrift_interface, storage_interface,
+                                                     worker_port(jmx_port), worker_port(remote_debug_port),
+                                                     initial_token, *args, **kwargs)
+
+
+def create_ccm_cluster(test_path, name, install_dir=None, version=None):
+    """
+    Creates the ccm cluster of a test, running install_dir or version if
+    given, as taken by set_install_dir, and CASSANDRA_VERSION or
+    CASSANDRA_DIR otherwise.
+    """
     debug("cluster ccm directory: " + test_path)
-    version = os.environ.get('CASSANDRA_VERSION')
-    cdir = CASSANDRA_DIR
+    if install_dir is None and version is None:
+        version = os.environ.get('CASSANDRA_VERSION')
+        install_dir = CASSANDRA_DIR
 
     if version:
-        cluster = Cluster(test_path, name, cassandra_version=version)
+        cluster = DtestCluster(test_path, name, cassandra_version=version)
     else:
-        cluster = Cluster(test_path, name, cassandra_dir=cdir)
+        cluster = DtestCluster(test_path, name, cassandra_dir=install_dir)
 
     if DISABLE_VNODES:
         cluster.set_configuration_options(values={'num_tokens': None})
@@ -885,7 +1037,7 @@ def maybe_cleanup_cluster_from_last_test_file():
             pass
 
 
-def init_default_config(cluster, cluster_options):
+def default_config_values(cluster_options):
     # the failure detector can be quite slow in such tests with quick start/stop
     phi_values = {'phi_convict_threshold': 5}
 
@@ -900,6 +1052,11 @@ def init_default_config(cluster, cluster_options):
             'truncate_request_timeout_in_ms': timeout,
             'request_timeout_in_ms': timeout
         })
+    return values
+
+
+def init_default_config(cluster, cluster_options):
+    values = default_config_values(cluster_options)
 
     # No more thrift in 4.0, and start_rpc doesn't exists anymore
     if cluster.version() >= '4' and 'start_rpc' in values:
@@ -992,11 +1149,13 @@ class ReusableClusterTester(Tester):
     def setUpClass(cls):
         kill_windows_cassandra_procs()
         maybe_cleanup_cluster_from_last_test_file()
+        CLUSTER_POOL.clear()
         cls.initialize_cluster()
 
     def setUp(self):
         self.set_current_tst_name()
         self.connections = []
+        self.maybe_begin_resource_monitor()
 
         # TODO enable active log watching
         # This needs to happen in setUp() and not setUpClass() so that individual
@@ -1010,6 +1169,8 @@ class ReusableClusterTester(Tester):
         # test_is_ending prevents active log watching from being able to interrupt the test
         self.test_is_ending = True
 
+        self.end_active_log_watch()
+        monitor = self.stop_resource_monitor()
         failed = did_fail()
         try:
             if not self.allow_log_errors and self.check_logs_for_errors():
@@ -1020,10 +1181,13 @@ class ReusableClusterTester(Tester):
                 # save the logs for inspection
                 if failed or KEEP_LOGS:
                     self.copy_logs(self.cluster)
+                elif monitor is not None:
+                    self.save_resource_samples(monitor)
             except Exception as e:
                 print "Error saving log:", str(e)
             finally:
                 reset_environment_vars()
+                self.get_log_tailer().close()
                 if failed:
                     cleanup_cluster(self.cluster, self.test_path)
                     kill_windows_cassandra_procs()
@@ -1068,6 +1232,147 @@ class ReusableClusterTester(Tester):
         init_default_config(cls.cluster, cls.cluster_options)
 
 
+class ClusterPool(object):
+    """
+    Keeps started clusters around between tests, so that a Tester that sets
+    pooled_topology pays for building the ccm directories and booting the
+    JVMs once instead of once per test. Clusters are keyed on their
+    topology, whether vnodes are in use, and the install directory,
+    partitioner and configuration options the test's own setup (e.g. its
+    init_config) gives a new cluster.
+
+    When a test passes, its cluster is recycled in a background thread: all
+    non-system keyspaces are dropped and, if every node is still up, the
+    cluster goes back into the pool. Clusters of failed tests are removed as
+    usual. Tests opting in therefore must:
+     * not leave nodes stopped, decommissioned or reconfigured;
+     * create their schema from scratch (keyspaces are dropped, but nothing
+       else is reset);
+     * use marks with watch_log_for, since the node logs carry the output of
+       earlier tests. Errors logged before the test started are ignored by
+       check_logs_for_errors.
+
+    Pooled clusters bind the same 127.0.0.x addresses and JMX ports as any
+    other cluster, so only one can run at a time: the pool holds at most one
+    idle cluster, and asking for another key, or creating a cluster outside
+    the pool, removes it.
+    """
+
+    SYSTEM_KEYSPACES = ('system', 'system_auth', 'system_distributed', 'system_schema', 'system_traces')
+
+    def __init__(self):
+        self._idle = {}  # key -> (test_path, cluster)
+        self._recycler = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(topology, cluster):
+        """
+        Returns the pool key of a configured cluster that is to have topology.
+        """
+        topology_key = tuple(topology) if isinstance(topology, list) else topology
+        options = json.dumps(cluster._config_options, sort_keys=True, default=str)
+        return (topology_key, DISABLE_VNODES, cluster.get_install_dir(), cluster.partitioner,
+                hashlib.md5(options).hexdigest())
+
+    def acquire(self, topology, create):
+        """
+        Returns (test_path, cluster) for a started cluster with the given
+        topology, configured like the cluster create() returns.
+
+        @param create A function returning (test_path, cluster) for a new,
+                      configured but unpopulated cluster. If the pool has a
+                      cluster with the same key, the new one is removed
+                      again; otherwise it is populated and started.
+        """
+        test_path, cluster = create()
+        # keyspaces are dropped between tests, don't keep snapshots of them
+        cluster.set_configuration_options({'auto_snapshot': False})
+        key = self.key(topology, cluster)
+        self._wait_for_recycler()
+        with self._lock:
+            entry = self._idle.pop(key, None)
+        # anything still idle is for another key and holds our addresses
+        self.clear()
+
+        if entry is None:
+            debug("cluster pool has no cluster for {}, creating one".format(key))
+            try:
+                cluster.populate(topology).start(wait_for_binary_proto=True)
+            except Exception:
+                # tearDown doesn't run when setUp fails
+                cleanup_cluster(cluster, test_path)
+                raise
+            entry = test_path, cluster
+        else:
+            debug("reusing pooled cluster at {} for {}".format(entry[0], key))
+            cleanup_cluster(cluster, test_path)
+
+        for node in entry[1].nodelist():
+            node.mark_log_for_errors()
+        return entry
+
+    def release(self, test_path, cluster, topology):
+        """
+        Hands a cluster back after a passing test. It is wiped and returned to
+        the pool in the background, or removed if it can't be reused.
+        """
+        key = self.key(topology, cluster)
+        # the cluster is the pool's again, the next test must not remove it as a leftover
+        cleanup_last_test_dir()
+        self._wait_for_recycler()
+        self._recycler = threading.Thread(target=self._recycle, args=(key, test_path, cluster))
+        self._recycler.daemon = True
+        self._recycler.start()
+
+    def clear(self):
+        """
+        Removes every pooled cluster.
+        """
+        self._wait_for_recycler()
+        with self._lock:
+            entries, self._idle = self._idle.values(), {}
+        for test_path, cluster in entries:
+            cleanup_cluster(cluster, test_path)
+
+    def _wait_for_recycler(self):
+        if self._recycler is not None:
+            self._recycler.join()
+            self._recycler = None
+
+    def _drop_keyspaces(self, cluster):
+        """
+        Drops every non-system keyspace of cluster.
+        """
+        node = cluster.nodelist()[0]
+        driver_cluster = PyCluster([get_ip_from_node(node)], port=get_port_from_node(node),
+                                   protocol_version=get_eager_protocol_version(cluster.version()))
+        try:
+            session = driver_cluster.connect()
+            for keyspace in driver_cluster.metadata.keyspaces:
+                if keyspace not in self.SYSTEM_KEYSPACES:
+                    session.execute('DROP KEYSPACE "{}"'.format(keyspace))
+        finally:
+            driver_cluster.shutdown()
+
+    def _recycle(self, key, test_path, cluster):
+        try:
+            if not all(node.is_running() for node in cluster.nodelist()):
+                raise RuntimeError("not all nodes are running")
+            self._drop_keyspaces(cluster)
+        except Exception as e:
+            debug("removing cluster at {} instead of pooling it: {}".format(test_path, e))
+            cleanup_cluster(cluster, test_path)
+            return
+
+        with self._lock:
+            self._idle[key] = (test_path, cluster)
+
+
+CLUSTER_POOL = ClusterPool()
+atexit.register(CLUSTER_POOL.clear)
+
+
 class MultiError(Exception):
     """
     Extends Exception to provide reporting multiple exceptions at once.
@@ -7,11 +7,16 @@ from ccmlib.node import ToolError
 
 from dtest import Tester, debug
 from tools.decorators import since
+from tools.fixture_cache import start_with_fixture
 from tools.jmxutils import (JolokiaAgent, enable_jmx_ssl, make_mbean,
                             remove_perf_disable_shared_mem)
 from tools.misc import generate_ssl_stores
 
 
+def _stress_500k_rf3(tester):
+    tester.cluster.nodelist()[0].stress(['write', 'n=500K', 'no-warmup', '-schema', 'replication(factor=3)'])
+
+
 class TestJMX(Tester):
     def netstats_test(self):
         """
@@ -20,10 +25,9 @@ class TestJMX(Tester):
         """
 
         cluster = self.cluster
-        cluster.populate(3).start(wait_for_binary_proto=True)
+        cluster.populate(3)
+        start_with_fixture(self, 'stress_500k_rf3', _stress_500k_rf3)
         node1, node2, node3 = cluster.nodelist()
-
-        node1.stress(['write', 'n=500K', 'no-warmup', '-schema', 'replication(factor=3)'])
         node1.flush()
         node1.stop(gently=False)
 
@@ -24,6 +24,7 @@ from tools.assertions import (assert_all, assert_crc_check_chance_equal,
                               assert_unavailable)
 from tools.decorators import since
 from tools.misc import new_node
+from tools.parallel import nodetool_on_nodes, on_nodes
 from tools.jmxutils import (JolokiaAgent, make_mbean, remove_perf_disable_shared_mem)
 
 # CASSANDRA-10978. Migration wait (in seconds) to use in bootstrapping tests. Needed to handle
@@ -83,13 +84,14 @@ class TestMaterializedViews(Tester):
                         return False
             return True
 
-        for node in self.cluster.nodelist():
-            if node.is_running():
-                node.nodetool("replaybatchlog")
-                attempts = 50  # 100 milliseconds per attempt, so 5 seconds total
-                while attempts > 0 and not _settled_stages(node):
-                    time.sleep(0.1)
-                    attempts -= 1
+        def _settle_node(node):
+            node.nodetool("replaybatchlog")
+            attempts = 50  # 100 milliseconds per attempt, so 5 seconds total
+            while attempts > 0 and not _settled_stages(node):
+                time.sleep(0.1)
+                attempts -= 1
+
+        on_nodes([node for node in self.cluster.nodelist() if node.is_running()], _settle_node)
 
     def _wait_for_view(self, ks, view):
         debug("waiting for view")
@@ -117,9 +119,7 @@ class TestMaterializedViews(Tester):
 
     def _replay_batchlogs(self):
         debug("Replaying batchlog on all nodes")
-        for node in self.cluster.nodelist():
-            if node.is_running():
-                node.nodetool("replaybatchlog")
+        nodetool_on_nodes([node for node in self.cluster.nodelist() if node.is_running()], "replaybatchlog")
 
     def create_test(self):
         """Test the materialized view creation"""
@@ -1793,12 +1793,8 @@ class TestMaterializedViewsConsistency(Tester):
         while self.num_request_done < upper:
             time.sleep(1)
 
-        debug("Making sure all batchlogs are replayed on node1")
-        node1.nodetool("replaybatchlog")
-        debug("Making sure all batchlogs are replayed on node2")
-        node2.nodetool("replaybatchlog")
-        debug("Making sure all batchlogs are replayed on node3")
-        node3.nodetool("replaybatchlog")
+        debug("Making sure all batchlogs are replayed on node1, node2 and node3")
+        nodetool_on_nodes([node1, node2, node3], "replaybatchlog")
 
         debug("Finished writes, now verifying reads")
         self._populate_rows()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from run_dtests import (estimate_durations, merge_xunit_reports,
+                        nose_name_from_xunit_case, shard_by_class)
+
+
+class TestShardTestIds(TestCase):
+
+    def test_id_from_class_test_case(self):
+        """
+        xunit test cases belonging to a class become module:Class.method names.
+        """
+        case = ElementTree.Element('testcase', classname='repair_tests.repair_test.TestRepair', name='simple_repair_test')
+        self.assertEqual(nose_name_from_xunit_case(case), 'repair_tests.repair_test:TestRepair.simple_repair_test')
+
+    def test_id_from_module_level_test_case(self):
+        """
+        xunit test cases for module-level functions become module:function names.
+        """
+        case = ElementTree.Element('testcase', classname='meta_tests.some_test', name='a_function_test')
+        self.assertEqual(nose_name_from_xunit_case(case), 'meta_tests.some_test:a_function_test')
+
+    def test_classes_are_not_split(self):
+        """
+        All the tests of a class end up on the same worker.
+        """
+        test_ids = ['m:A.t1', 'm:B.t1', 'm:A.t2', 'm:C.t1', 'm:B.t2']
+        shards = shard_by_class(test_ids, 2)
+        self.assertEqual(shards, [['m:A.t1', 'm:A.t2', 'm:C.t1'], ['m:B.t1', 'm:B.t2']])
+
+    def test_no_empty_shards(self):
+        """
+        Asking for more workers than there are classes doesn't produce empty shards.
+        """
+        self.assertEqual(shard_by_class(['m:A.t1', 'm:A.t2'], 4), [['m:A.t1', 'm:A.t2']])
+
+    def test_longest_classes_are_balanced(self):
+        """
+        With durations, one long class gets a worker to itself while the short ones share the other.
+        """
+        test_ids = ['m:A.t1', 'm:B.t1', 'm:C.t1', 'm:D.t1']
+        durations = {'m:A.t1': 10, 'm:B.t1': 100, 'm:C.t1': 20, 'm:D.t1': 30}
+        shards = shard_by_class(test_ids, 2, durations)
+        self.assertEqual(shards, [['m:B.t1'], ['m:D.t1', 'm:C.t1', 'm:A.t1']])
+
+
+class TestEstimateDurations(TestCase):
+
+    def test_recorded_timings_are_used(self):
+        """
+        Tests with a recorded timing are expected to take that long.
+        """
+        self.assertEqual(estimate_durations(['m:A.t1'], {'m:A.t1': 42.0}), {'m:A.t1': 42.0})
+
+    def test_unseen_tests_scale_with_module_size(self):
+        """
+        Tests without a timing are charged by module size at the rate observed for timed tests in the same run.
+        """
+        run_dtests = 'run_dtests:TestRunner.t1'
+        dtest_a, dtest_b = 'dtest:Tester.a', 'dtest:Tester.b'
+        durations = estimate_durations([run_dtests, dtest_a, dtest_b], {run_dtests: 10.0})
+
+        rate = 10.0 / os.path.getsize('run_dtests.py')
+        self.assertEqual(durations[run_dtests], 10.0)
+        self.assertAlmostEqual(durations[dtest_a], os.path.getsize('dtest.py') / 2.0 * rate)
+        self.assertAlmostEqual(durations[dtest_b], durations[dtest_a])
+
+
+class TestMergeXunitReports(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_report(self, name, tests, failures, cases):
+        path = os.path.join(self.tmpdir, name)
+        suite = ElementTree.Element('testsuite', name='nosetests', tests=str(tests), errors='0', failures=str(failures), skip='0')
+        for case in cases:
+            ElementTree.SubElement(suite, 'testcase', classname='m.A', name=case)
+        ElementTree.ElementTree(suite).write(path)
+        return path
+
+    def test_merge_sums_counters_and_keeps_cases(self):
+        """
+        Merging reports sums their counters and keeps every test case; missing reports are ignored.
+        """
+        reports = [self._write_report('w1.xml', 2, 1, ['t1', 't2']),
+                   self._write_report('w2.xml', 1, 0, ['t3']),
+                   os.path.join(self.tmpdir, 'missing.xml')]
+        merged_file = os.path.join(self.tmpdir, 'merged.xml')
+
+        totals = merge_xunit_reports(reports, merged_file)
+
+        self.assertEqual(totals, {'tests': 3, 'errors': 0, 'failures': 1, 'skip': 0})
+        merged = ElementTree.parse(merged_file).getroot()
+        self.assertEqual(merged.get('tests'), '3')
+        self.assertEqual([case.get('name') for case in merged.iter('testcase')], ['t1', 't2', 't3'])
@@ -0,0 +1,96 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from tools.benchmark import ChildProcessUsage, ResourceUsage, load_results, record_result
+from tools.resource_monitor import disk_usage
+
+
+class _FakeCluster(object):
+
+    def __init__(self, install_dir):
+        self.install_dir = install_dir
+
+    def version(self):
+        return '3.0.9'
+
+    def get_install_dir(self):
+        return self.install_dir
+
+
+class _FakeNode(object):
+    """
+    Stands in for a node running as this process.
+    """
+
+    def __init__(self, path):
+        self.name = 'node1'
+        self.pid = os.getpid()
+        self.path = path
+
+    def data_directories(self):
+        return [os.path.join(self.path, 'data0')]
+
+    def get_path(self):
+        return self.path
+
+
+class TestBenchmark(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, size):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+    def test_record_result(self):
+        """
+        Results are appended to the file of their suite, with the version they were measured on
+        """
+        results_dir = os.path.join(self.root, 'results')
+        cluster = _FakeCluster(self.root)
+        record_result(cluster, 'compaction', {'strategy': 'LCS'}, {'elapsed': 1.5}, results_dir=results_dir)
+        record_result(cluster, 'compaction', {'strategy': 'STCS'}, {'elapsed': 2.5}, results_dir=results_dir)
+
+        results = load_results('compaction', results_dir=results_dir)
+        self.assertEqual([(r['params']['strategy'], r['metrics']['elapsed']) for r in results], [('LCS', 1.5), ('STCS', 2.5)])
+        self.assertEqual(results[0]['cassandra_version'], '3.0.9')
+        self.assertIsNone(results[0]['cassandra_sha'])
+        self.assertEqual(load_results('commitlog', results_dir=results_dir), [])
+
+    def test_resource_usage(self):
+        """
+        Peak disk usage is kept after files are removed, and cpu time is counted
+        """
+        node = _FakeNode(self.root)
+        data_file = os.path.join(self.root, 'data0', 'ks', 'cf', 'mc-1-big-Data.db')
+        self._write(os.path.join(self.root, 'commitlogs', 'CommitLog-6-1.log'), 1000)
+
+        with ResourceUsage([node], interval=0.05) as usage:
+            self._write(data_file, 5000)
+            usage._sample()
+            os.remove(data_file)
+            sum(i * i for i in range(200000))
+
+        self.assertEqual(disk_usage([self.root]), 1000)
+        metrics = usage.metrics()
+        self.assertEqual(metrics['peak_disk_bytes'], 6000)
+        self.assertGreater(metrics['cpu_seconds'], 0)
+        self.assertGreater(metrics['elapsed'], 0)
+
+    def test_child_process_usage(self):
+        """
+        The memory of processes started during the block is counted
+        """
+        with ChildProcessUsage(interval=0.05) as usage:
+            subprocess.check_call(['sleep', '0.3'])
+        self.assertEqual(usage.peak_processes, 1)
+        self.assertGreater(usage.peak_rss, 0)
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from mock import Mock
+
+from tools.bulkload import BulkLoader
+
+
+class _ImmediateFuture(object):
+    """
+    A stand-in for a driver ResponseFuture that completes as soon as callbacks are added.
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        if self.error is None:
+            callback([], *callback_args)
+        else:
+            errback(self.error, *errback_args)
+
+
+class TestBulkLoader(TestCase):
+
+    def _session(self, fail_on=()):
+        session = Mock()
+
+        def execute_async(statement, row, **kwargs):
+            return _ImmediateFuture(error=ValueError(row) if row[0] in fail_on else None)
+
+        session.execute_async = Mock(side_effect=execute_async)
+        return session
+
+    def test_every_row_is_executed_from_a_generator(self):
+        """
+        Rows are consumed lazily from a generator and each one is executed once.
+        """
+        session = self._session()
+        stats = BulkLoader(session, 'INSERT', concurrency=4, token_aware=False).load((i,) for i in range(100))
+
+        self.assertEqual(stats.count, 100)
+        self.assertEqual(stats.error_count, 0)
+        self.assertEqual(session.execute_async.call_count, 100)
+        session.prepare.assert_called_once_with('INSERT')
+        self.assertLessEqual(stats.percentile(50), stats.percentile(99))
+
+    def test_errors_beyond_max_errors_stop_the_load(self):
+        """
+        Once more than max_errors requests have failed, no more rows are sent and the first error is raised.
+        """
+        session = self._session(fail_on=(3, 4))
+        loader = BulkLoader(session, 'INSERT', concurrency=1, token_aware=False, max_errors=1)
+        with self.assertRaises(ValueError):
+            loader.load((i,) for i in range(100))
+        self.assertEqual(session.execute_async.call_count, 5)
+
+    def test_tolerated_errors_are_counted(self):
+        """
+        Failed requests within max_errors are counted but don't stop the load.
+        """
+        session = self._session(fail_on=(3,))
+        stats = BulkLoader(session, 'INSERT', concurrency=2, token_aware=False, max_errors=1).load((i,) for i in range(10))
+        self.assertEqual((stats.count, stats.error_count), (9, 1))
+        self.assertEqual(stats.first_error_count, 3)
+        self.assertGreaterEqual(stats.first_error_time, 0)
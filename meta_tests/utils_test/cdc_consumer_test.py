@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from unittest import TestCase
+
+from tools.cdc import CDCConsumer, cdc_index_path, read_descriptor
+
+
+class TestCDCConsumer(TestCase):
+
+    def setUp(self):
+        self.cdc_raw = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cdc_raw)
+
+    def _segment(self, segment_id, size=1000, parameters=None, index=None):
+        """
+        Writes a segment of version 6 (3.0) with size bytes after its header,
+        and its _cdc.idx file if index is given.
+        """
+        path = os.path.join(self.cdc_raw, 'CommitLog-6-{}.log'.format(segment_id))
+        params = json.dumps(parameters) if parameters else ''
+        with open(path, 'wb') as f:
+            f.write(struct.pack('>iqH', 6, segment_id, len(params)) + params + struct.pack('>i', 0))
+            f.write('x' * size)
+        if index is not None:
+            with open(cdc_index_path(path), 'w') as f:
+                f.write(index)
+        return path
+
+    def test_read_descriptor(self):
+        """
+        The version, id and parameters of a segment are read from its header
+        """
+        path = self._segment(12, parameters={'compressionClass': 'LZ4Compressor'})
+        with open(path, 'rb') as f:
+            descriptor = read_descriptor(f)
+        self.assertEqual(descriptor, (6, 12, {'compressionClass': 'LZ4Compressor'}))
+
+    def test_complete_segments(self):
+        """
+        Segments are consumed oldest first, and indexed segments only once they are completed
+        """
+        self._segment(20, index='1024\nCOMPLETED\n')
+        self._segment(3, index='1024\nCOMPLETED\n')
+        self._segment(100, index='512\n')
+        with open(os.path.join(self.cdc_raw, 'unrelated'), 'w'):
+            pass
+
+        names = [os.path.basename(p) for p in CDCConsumer(self.cdc_raw).complete_segments()]
+        self.assertEqual(names, ['CommitLog-6-3.log', 'CommitLog-6-20.log', 'CommitLog-6-100.log'])
+        names = [os.path.basename(p) for p in CDCConsumer(self.cdc_raw, indexed=True).complete_segments()]
+        self.assertEqual(names, ['CommitLog-6-3.log', 'CommitLog-6-20.log'])
+
+    def test_consumer(self):
+        """
+        Segments written while the consumer runs are read at the configured rate and deleted
+        """
+        start = time.time()
+        with CDCConsumer(self.cdc_raw, bytes_per_second=1000 * 1000, indexed=True, interval=0.01) as consumer:
+            self._segment(1, size=100 * 1000, index='COMPLETED')
+            self._segment(2, size=100 * 1000, index='COMPLETED')
+            while os.listdir(self.cdc_raw) and time.time() - start < 10:
+                time.sleep(0.01)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(os.listdir(self.cdc_raw), [])
+        self.assertEqual(consumer.stats()['consumed_segments'], 2)
+        self.assertEqual(consumer.stats()['consumed_bytes'], 2 * (100 * 1000 + 18))
+        self.assertGreater(consumer.stats()['peak_cdc_raw_bytes'], 0)
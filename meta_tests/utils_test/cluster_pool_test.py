@@ -0,0 +1,153 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from dtest import ClusterPool
+
+
+class _FakeNode(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.running = True
+        self.error_marks = 0
+
+    def is_running(self):
+        return self.running
+
+    def mark_log_for_errors(self):
+        self.error_marks += 1
+
+
+class _FakeCluster(object):
+    name = 'test'
+    partitioner = None
+
+    def __init__(self, options, fail_start=False):
+        self._config_options = dict(options)
+        self.fail_start = fail_start
+        self.nodes = []
+        self.started = False
+        self.removed = False
+
+    def get_install_dir(self):
+        return '/cassandra'
+
+    def set_configuration_options(self, values):
+        self._config_options.update(values)
+
+    def populate(self, nodes):
+        self.nodes = [_FakeNode('node{}'.format(i + 1)) for i in range(nodes)]
+        return self
+
+    def start(self, **kwargs):
+        if self.fail_start:
+            raise RuntimeError("node1 didn't start")
+        self.started = True
+
+    def stop(self, **kwargs):
+        pass
+
+    def nodelist(self):
+        return self.nodes
+
+    def remove(self):
+        self.removed = True
+
+
+class _Pool(ClusterPool):
+    """
+    A pool that records the clusters it wipes instead of connecting to them.
+    """
+
+    def __init__(self, wipe_error=None):
+        super(_Pool, self).__init__()
+        self.wiped = []
+        self.wipe_error = wipe_error
+
+    def _drop_keyspaces(self, cluster):
+        if self.wipe_error is not None:
+            raise self.wipe_error
+        self.wiped.append(cluster)
+
+
+class TestClusterPool(TestCase):
+
+    def setUp(self):
+        self.created = []
+
+    def _create(self, options=None, fail_start=False):
+        def create():
+            test_path = tempfile.mkdtemp()
+            cluster = _FakeCluster(options or {'phi_convict_threshold': 5}, fail_start=fail_start)
+            self.created.append((test_path, cluster))
+            return test_path, cluster
+        return create
+
+    def tearDown(self):
+        for test_path, cluster in self.created:
+            if os.path.exists(test_path):
+                os.rmdir(test_path)
+
+    def test_acquire_and_release(self):
+        """
+        A released cluster is wiped and handed to the next test asking for the same topology and configuration,
+        and the cluster that test would have made is removed
+        """
+        pool = _Pool()
+        test_path, cluster = pool.acquire(2, self._create())
+        self.assertTrue(cluster.started)
+        self.assertFalse(cluster._config_options['auto_snapshot'])
+        self.assertEqual([n.error_marks for n in cluster.nodelist()], [1, 1])
+
+        pool.release(test_path, cluster, 2)
+        self.assertEqual(pool.acquire(2, self._create()), (test_path, cluster))
+        self.assertEqual(pool.wiped, [cluster])
+        self.assertEqual([n.error_marks for n in cluster.nodelist()], [2, 2])
+        unused_path, unused = self.created[1]
+        self.assertTrue(unused.removed)
+        self.assertFalse(os.path.exists(unused_path))
+        self.assertFalse(cluster.removed)
+
+    def test_other_configuration(self):
+        """
+        A test configuring its cluster differently gets a new cluster, and the pooled one is removed
+        """
+        pool = _Pool()
+        test_path, cluster = pool.acquire(1, self._create())
+        pool.release(test_path, cluster, 1)
+
+        other_path, other = pool.acquire(1, self._create({'enable_user_defined_functions': 'true'}))
+        self.assertIsNot(other, cluster)
+        self.assertTrue(other.started)
+        self.assertTrue(cluster.removed)
+        self.assertFalse(os.path.exists(test_path))
+
+        pool.release(other_path, other, 1)
+        pool.clear()
+        self.assertTrue(other.removed)
+
+    def test_clusters_that_cannot_be_recycled(self):
+        """
+        Clusters with a stopped node, or whose keyspaces can't be dropped, are removed instead of pooled
+        """
+        for pool, stop_node in ((_Pool(), True), (_Pool(wipe_error=RuntimeError("timed out")), False)):
+            test_path, cluster = pool.acquire(1, self._create())
+            cluster.nodelist()[0].running = not stop_node
+            pool.release(test_path, cluster, 1)
+
+            _, new = pool.acquire(1, self._create())
+            self.assertIsNot(new, cluster)
+            self.assertTrue(cluster.removed)
+            self.assertEqual(pool.wiped, [])
+
+    def test_start_failure(self):
+        """
+        A cluster that fails to start is removed, and the error raised
+        """
+        pool = _Pool()
+        with self.assertRaises(RuntimeError):
+            pool.acquire(1, self._create(fail_start=True))
+        test_path, cluster = self.created[0]
+        self.assertTrue(cluster.removed)
+        self.assertFalse(os.path.exists(test_path))
@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+from collections import namedtuple
+from unittest import TestCase
+
+from tools import jmxutils
+from tools.compaction import (COMPLETED_TASKS, PENDING_TASKS, CompactionTracker,
+                              parse_compactionstats, wait_for_compactions)
+from tools.readiness import NotReadyError
+
+_NodetoolResult = namedtuple('_NodetoolResult', 'stdout stderr rc')
+
+_BUSY = """pending tasks: 3
+- ks.cf: 3
+
+id                                   compaction type              keyspace table completed total    unit  progress
+8a4cfa60-1b3b-11e7-8e3e-5b5e2c0a1f10 Compaction                   ks       cf    1024      4096     bytes 25.00%
+9b5d0b71-1b3b-11e7-8e3e-5b5e2c0a1f10 Anticompaction after repair  ks       cf2   10        20       bytes 50.00%
+Active compaction remaining time :   0h00m00s
+"""
+
+
+class _FakeNode(object):
+
+    def __init__(self, outputs, name='node1', pid=1234):
+        self.name = name
+        self.pid = pid
+        self.network_interfaces = {'binary': ('127.0.0.{}'.format(pid), 9042)}
+        self.outputs = outputs
+        self.calls = 0
+
+    def nodetool(self, cmd):
+        self.calls += 1
+        return _NodetoolResult(self.outputs.pop(0) if len(self.outputs) > 1 else self.outputs[0], '', 0)
+
+    def is_running(self):
+        return True
+
+    def get_cassandra_version(self):
+        return '3.0'
+
+
+class _FakeAgent(object):
+    """
+    Answers bulk reads with the next of a list of compaction states.
+    """
+    keep_attached = True
+
+    def __init__(self, states):
+        self.states = states
+
+    def read_attributes(self, reads):
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return [state[read[1] if read[1] != 'Value' else read[0]] for read in reads]
+
+
+class TestCompactionTracker(TestCase):
+
+    def tearDown(self):
+        jmxutils._attached_agents.clear()
+
+    def test_parse_compactionstats(self):
+        """
+        Pending tasks and every active compaction are read from compactionstats
+        """
+        status = parse_compactionstats(_BUSY)
+        self.assertEqual(status.pending, 3)
+        self.assertEqual([(c.table, c.task_type, c.completed, c.total) for c in status.active],
+                         [('cf', 'Compaction', 1024, 4096), ('cf2', 'Anticompaction after repair', 10, 20)])
+        self.assertFalse(status.idle)
+        self.assertTrue(parse_compactionstats("pending tasks: 0\n").idle)
+
+    def test_wait_for_compactions_nodetool(self):
+        """
+        Without JMX, compactionstats is polled until the node is idle
+        """
+        node = _FakeNode([_BUSY, _BUSY, "pending tasks: 0\n"])
+        wait_for_compactions([node], timeout=30)
+        self.assertEqual(node.calls, 3)
+
+        with self.assertRaises(NotReadyError):
+            CompactionTracker(_FakeNode([_BUSY]), use_jmx=False).wait_for_idle(timeout=0.3)
+
+    def test_tracker_jmx(self):
+        """
+        Over JMX, per-table waits and started/finished events are available
+        """
+        node = _FakeNode(["not used"], pid=99)
+        compaction = {'compactionId': 'a', 'keyspace': 'ks', 'columnfamily': 'cf', 'taskType': 'COMPACTION',
+                      'completed': '1', 'total': '2', 'unit': 'bytes'}
+        other = dict(compaction, compactionId='b', columnfamily='other')
+        pending = jmxutils.make_mbean('metrics', type='Compaction', name='PendingTasks')
+        completed = jmxutils.make_mbean('metrics', type='Compaction', name='CompletedTasks')
+        table = jmxutils.make_mbean('metrics', type='Table', keyspace='ks', scope='cf', name='PendingCompactions')
+
+        def state(active, done):
+            return {pending: len(active), completed: done, table: len([c for c in active if c['columnfamily'] == 'cf']),
+                    'Compactions': active}
+
+        jmxutils._attached_agents[('127.0.0.99', 99)] = _FakeAgent(
+            [state([], 5), state([compaction, other], 5), state([other], 6), state([other], 6), state([], 7)])
+        tracker = CompactionTracker(node)
+
+        self.assertEqual(tracker.events(), ([], []))
+        started, finished = tracker.events()
+        self.assertEqual(sorted(c.id for c in started), ['a', 'b'])
+        tracker.wait_for_table('ks', 'cf', timeout=30)
+        started, finished = tracker.events()
+        self.assertEqual([c.id for c in finished], ['a'])
+        tracker.wait_for_completed(1, since=6, timeout=30)
+        self.assertEqual(node.calls, 0)
+
+    def test_status_and_wait_for_idle_jmx(self):
+        """
+        Over JMX, the status comes from one bulk read of the agent, and waiting for idle doesn't run nodetool
+        """
+        node = _FakeNode(["not used"], pid=98)
+        compaction = {'compactionId': 'a', 'keyspace': 'ks', 'columnfamily': 'cf', 'taskType': 'COMPACTION',
+                      'completed': '1', 'total': '2', 'unit': 'bytes'}
+
+        def state(pending, active, done):
+            return {PENDING_TASKS[0]: pending, 'Compactions': active, COMPLETED_TASKS[0]: done}
+
+        jmxutils._attached_agents[('127.0.0.98', 98)] = _FakeAgent(
+            [state(1, [compaction], 3), state(1, [compaction], 3), state(0, [compaction], 4), state(0, [], 4)])
+        tracker = CompactionTracker(node)
+
+        status = tracker.status()
+        self.assertEqual((status.pending, status.completed), (1, 3))
+        self.assertEqual([(c.id, c.keyspace, c.table, c.completed, c.total) for c in status.active], [('a', 'ks', 'cf', 1, 2)])
+        tracker.wait_for_idle(timeout=30)
+        self.assertTrue(tracker.status().idle)
+        self.assertEqual(node.calls, 0)
+
+    def test_unattachable_node_uses_nodetool(self):
+        """
+        The agent isn't launched for a node running with -XX:+PerfDisableSharedMem
+        """
+        process = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdin.read()', '-XX:+PerfDisableSharedMem'],
+                                   stdin=subprocess.PIPE)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.stdin.close)
+        self.assertTrue(jmxutils.agent_attachable(_FakeNode([], pid=os.getpid())))
+        self.assertFalse(jmxutils.agent_attachable(_FakeNode([], pid=process.pid)))
+
+        node = _FakeNode(["pending tasks: 0\n"], pid=process.pid)
+        self.assertTrue(CompactionTracker(node).status().idle)
+        self.assertEqual(node.calls, 1)
+        self.assertEqual(jmxutils._attached_agents, {})
@@ -0,0 +1,223 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from cqlsh_tests import cqlsh_tools
+from cqlsh_tests.cqlsh_tools import (CqlshOutput, CqlshSession, CqlshSessionError, CqlshSessions,
+                                     assert_csvs_items_equal, assert_items_equal_external,
+                                     external_sort, sorted_items_diff)
+
+
+class TestExternalComparison(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_external_sort(self):
+        """
+        Lines are sorted across several runs written to disk
+        """
+        lines = ['{},{}'.format(random.randint(0, 100), i) for i in range(1000)]
+        self.assertEqual(list(external_sort(lines, self.tmpdir, chunk_lines=64)), sorted(lines))
+        self.assertEqual(len(os.listdir(self.tmpdir)), 16)
+
+    def test_sorted_items_diff(self):
+        """
+        Duplicates count, and only the first differences are kept
+        """
+        diff = sorted_items_diff(iter(['a', 'a', 'b', 'd', 'e', 'f']), iter(['a', 'b', 'c', 'd']), max_diffs=2)
+        self.assertEqual(diff, (['a', 'e'], ['c'], 3, 1))
+
+    def test_assert_items_equal_external(self):
+        """
+        Items in any order are equal, and a failure reports the differing items
+        """
+        first = ['{},{}'.format(i, i * 2) for i in range(500)]
+        second = list(reversed(first))
+        assert_items_equal_external(iter(first), iter(second), chunk_lines=50)
+
+        second[10] = '10,21'
+        with self.assertRaises(AssertionError) as cm:
+            assert_items_equal_external(iter(first), iter(second), chunk_lines=50)
+        self.assertIn('1 only in the first, 1 only in the second', str(cm.exception))
+        self.assertIn('  489,978', str(cm.exception))
+        self.assertIn('  10,21', str(cm.exception))
+
+    def test_assert_csvs_items_equal_on_disk(self):
+        """
+        Files over the memory threshold are compared on disk
+        """
+        paths = [os.path.join(self.tmpdir, name) for name in ('first.csv', 'second.csv')]
+        rows = ['{},"text {}"\n'.format(i, i) for i in range(100)]
+        for path, content in zip(paths, (rows, rows[::-1])):
+            with open(path, 'w') as f:
+                f.writelines(content)
+
+        threshold = cqlsh_tools.CSV_MEMORY_THRESHOLD
+        cqlsh_tools.CSV_MEMORY_THRESHOLD = 10
+        try:
+            assert_csvs_items_equal(*paths)
+            with open(paths[1], 'a') as f:
+                f.write('100,"text 100"\n')
+            with self.assertRaises(AssertionError):
+                assert_csvs_items_equal(*paths)
+        finally:
+            cqlsh_tools.CSV_MEMORY_THRESHOLD = threshold
+
+
+_FAKE_CQLSH = """#!{python}
+import sys
+
+lineno = 0
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    lineno += 1
+    statement = line.strip().rstrip(';')
+    if statement == 'quit':
+        break
+    elif statement.startswith('SOURCE '):
+        sys.stderr.write("<stdin>:%d:Could not open %s: [Errno 2] No such file or directory\\n" % (lineno, statement[7:]))
+    elif statement == 'crash':
+        sys.exit(1)
+    elif statement.startswith('bad'):
+        sys.stderr.write("<stdin>:%d:SyntaxException: %s\\n" % (lineno, statement))
+    else:
+        sys.stdout.write((statement + '\\n') * 2000)
+"""
+
+
+class _FakeNode(object):
+
+    def __init__(self, install_dir):
+        self.name = 'node1'
+        self.pid = 1
+        self.install_dir = install_dir
+        self.network_interfaces = {'binary': ('127.0.0.1', 9042)}
+
+    def get_install_dir(self):
+        return self.install_dir
+
+    def get_base_cassandra_version(self):
+        return 3.0
+
+    def get_env(self):
+        return dict(os.environ)
+
+
+class TestCqlshSession(TestCase):
+
+    def setUp(self):
+        self.install_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.install_dir, 'bin'))
+        cqlsh = os.path.join(self.install_dir, 'bin', 'cqlsh')
+        with open(cqlsh, 'w') as f:
+            f.write(_FAKE_CQLSH.format(python=sys.executable))
+        os.chmod(cqlsh, 0o755)
+        self.node = _FakeNode(self.install_dir)
+        self.schema_version = 'v1'
+        self.sessions = CqlshSessions(connect=lambda node: self)
+        self.one_shots = []
+        persistent = cqlsh_tools.PERSISTENT_CQLSH
+        cqlsh_tools.PERSISTENT_CQLSH = True
+        self.addCleanup(setattr, cqlsh_tools, 'PERSISTENT_CQLSH', persistent)
+
+    def execute(self, query):
+        # the driver session schema versions are read with
+        if self.schema_version is None:
+            raise IOError('node down')
+        return [(self.schema_version,)]
+
+    def tearDown(self):
+        self.sessions.close_all()
+        shutil.rmtree(self.install_dir)
+
+    def _one_shot(self):
+        self.one_shots.append(True)
+        return CqlshOutput('one shot', '', 0)
+
+    def test_session_output(self):
+        """
+        Each batch gets its own output, with error line numbers relative to the batch
+        """
+        session = CqlshSession(self.node)
+        try:
+            out, err = session.execute(['select 1', 'select 2'])
+            self.assertEqual(out, 'select 1\n' * 2000 + 'select 2\n' * 2000)
+            self.assertEqual(err, '')
+            out, err = session.execute(['select 3', 'bad statement'])
+            self.assertEqual(out, 'select 3\n' * 2000)
+            self.assertEqual(err, '<stdin>:2:SyntaxException: bad statement\n')
+            with self.assertRaises(CqlshSessionError) as cm:
+                session.execute(['crash'])
+            self.assertTrue(cm.exception.sent)
+            self.assertFalse(session.alive)
+        finally:
+            session.close()
+
+    def test_session_exited_before_sending(self):
+        """
+        A batch written to a cqlsh that already exited fails as not sent
+        """
+        session = CqlshSession(self.node)
+        try:
+            session.process.kill()
+            session.process.wait()
+            with self.assertRaises(CqlshSessionError) as cm:
+                session.execute(['select 1'])
+            self.assertFalse(cm.exception.sent)
+        finally:
+            session.close()
+
+    def test_sessions_fall_back(self):
+        """
+        Stateful statements run in a one-shot process, sessions are reused, and a command a failed session
+        was sent isn't run again
+        """
+        self.assertEqual(self.sessions.run(self.node, ['USE ks', 'select 1'], self._one_shot), ('one shot', '', 0))
+        self.assertEqual(self.sessions.run(self.node, ['select 1'], self._one_shot, cqlsh_options=['--file=x.cql']).stdout, 'one shot')
+        self.assertEqual(self.sessions.run(self.node, ['select 1'], self._one_shot).stdout, 'select 1\n' * 2000)
+        self.assertEqual(len(self.one_shots), 2)
+
+        with self.assertRaises(CqlshSessionError):
+            self.sessions.run(self.node, ['crash'], self._one_shot)
+        self.assertEqual(len(self.one_shots), 2)
+        self.assertEqual(self.sessions.sessions, {})
+        self.assertEqual(self.sessions.run(self.node, ['select 2'], self._one_shot).stdout, 'select 2\n' * 2000)
+        self.assertEqual(len(self.sessions.sessions), 1)
+
+        with patch.object(cqlsh_tools.common, 'is_win', Mock(return_value=True)):
+            self.assertEqual(self.sessions.run(self.node, ['select 2'], self._one_shot).stdout, 'one shot')
+
+        self.node.pid = 2
+        self.sessions.run(self.node, ['select 3'], self._one_shot)
+        self.assertEqual([key[1] for key in self.sessions.sessions], [2])
+
+    def test_sessions_follow_schema_changes(self):
+        """
+        A session is replaced when the schema changed since its previous command
+        """
+        self.sessions.run(self.node, ['select 1'], self._one_shot)
+        [first] = self.sessions.sessions.values()
+        self.sessions.run(self.node, ['select 2'], self._one_shot)
+        self.assertIs(self.sessions.sessions.values()[0], first)
+
+        self.schema_version = 'v2'
+        self.assertEqual(self.sessions.run(self.node, ['select 3'], self._one_shot).stdout, 'select 3\n' * 2000)
+        [second] = self.sessions.sessions.values()
+        self.assertIsNot(second, first)
+        self.assertFalse(first.alive)
+
+        # without a schema version there is no telling whether the session is current
+        self.schema_version = None
+        self.assertEqual(self.sessions.run(self.node, ['select 4'], self._one_shot).stdout, 'one shot')
+        self.assertEqual(self.one_shots, [True])
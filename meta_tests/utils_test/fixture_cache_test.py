@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from tools.fixture_cache import (COMPLETE_MARKER, fixture_key, restore_fixture,
+                                 save_fixture)
+
+
+class TestFixtureCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fixture_dir = os.path.join(self.tmpdir, 'fixture')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _mock_cluster(self, root):
+        node_path = os.path.join(root, 'node1')
+        node = Mock(get_path=Mock(return_value=node_path),
+                    data_directories=Mock(return_value=[os.path.join(node_path, 'data0'), os.path.join(node_path, 'data1')]))
+        node.name = 'node1'
+        node.data_center = None
+        node.network_interfaces = {'storage': ('127.0.0.1', 7000), 'binary': ('127.0.0.1', 9042)}
+        return Mock(nodelist=Mock(return_value=[node]),
+                    version=Mock(return_value='3.11'),
+                    get_install_dir=Mock(return_value=root),
+                    _config_options={'auto_snapshot': False})
+
+    def _write(self, path, contents):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def test_save_and_restore_round_trip(self):
+        """
+        Restoring a saved fixture replaces the nodes' data and commitlogs with the saved ones;
+        sstables are hardlinked, commitlogs are copied.
+        """
+        source = self._mock_cluster(os.path.join(self.tmpdir, 'source'))
+        source_path = os.path.join(self.tmpdir, 'source', 'node1')
+        self._write(os.path.join(source_path, 'data0', 'ks', 'cf', 'mc-1-big-Data.db'), 'sstable')
+        self._write(os.path.join(source_path, 'commitlogs', 'CommitLog-6-1.log'), 'commitlog')
+        save_fixture(source, self.fixture_dir)
+        self.assertTrue(os.path.exists(os.path.join(self.fixture_dir, COMPLETE_MARKER)))
+
+        target = self._mock_cluster(os.path.join(self.tmpdir, 'target'))
+        target_path = os.path.join(self.tmpdir, 'target', 'node1')
+        self._write(os.path.join(target_path, 'data1', 'ks', 'cf', 'stale-Data.db'), 'stale')
+        restore_fixture(target, self.fixture_dir)
+
+        restored_sstable = os.path.join(target_path, 'data0', 'ks', 'cf', 'mc-1-big-Data.db')
+        restored_commitlog = os.path.join(target_path, 'commitlogs', 'CommitLog-6-1.log')
+        self.assertEqual(open(restored_sstable).read(), 'sstable')
+        self.assertEqual(open(restored_commitlog).read(), 'commitlog')
+        self.assertEqual(os.listdir(os.path.join(target_path, 'data1')), [])
+        self.assertGreater(os.stat(restored_sstable).st_nlink, 1)
+        self.assertEqual(os.stat(restored_commitlog).st_nlink, 1)
+
+    @patch('tools.fixture_cache.get_sha', Mock(return_value=None))
+    def test_key_depends_on_addresses_and_config(self):
+        """
+        Clusters whose nodes have other addresses, or with other configuration options, get other datasets
+        """
+        def populate(tester):
+            pass
+
+        cluster = self._mock_cluster(self.tmpdir)
+        key = fixture_key(cluster, 'dataset', populate)
+        self.assertEqual(fixture_key(self._mock_cluster(self.tmpdir), 'dataset', populate), key)
+
+        other_worker = self._mock_cluster(self.tmpdir)
+        other_worker.nodelist()[0].network_interfaces = {'storage': ('127.0.1.1', 7000), 'binary': ('127.0.1.1', 9042)}
+        self.assertNotEqual(fixture_key(other_worker, 'dataset', populate), key)
+
+        other_config = self._mock_cluster(self.tmpdir)
+        other_config._config_options = {'auto_snapshot': True}
+        self.assertNotEqual(fixture_key(other_config, 'dataset', populate), key)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from ccmlib import repository
+
+from dtest import create_ccm_cluster
+from tools import install_cache
+from tools.install_cache import git_source, install_dir_args, resolve_sha
+
+
+class TestInstallCache(TestCase):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        for cmd in (['git', 'init', '--quiet'],
+                    ['git', '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '--quiet', '--allow-empty', '-m', 'first'],
+                    ['git', 'branch', 'cassandra-3.0'],
+                    ['git', '-c', 'user.name=t', '-c', 'user.email=t@t', 'tag', '-a', '-m', 'release', 'cassandra-3.0.12']):
+            subprocess.check_call(cmd, cwd=self.repo)
+        self.head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=self.repo).strip()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+        install_cache._install_dirs.clear()
+
+    def test_git_source(self):
+        """
+        Git versions map to their repository and ref, released versions to None
+        """
+        self.assertEqual(git_source('github:apache/cassandra-3.0'), (repository.github_repo_for_user('apache'), 'cassandra-3.0'))
+        self.assertEqual(git_source('git:trunk'), (repository.GIT_REPO, 'trunk'))
+        self.assertEqual(git_source('local:/src/cassandra/:my-branch'), ('/src/cassandra/', 'my-branch'))
+        self.assertIsNone(git_source('3.0.12'))
+
+    def test_resolve_sha(self):
+        """
+        Branches and annotated tags resolve to the commit they point to
+        """
+        self.assertEqual(resolve_sha(self.repo, 'cassandra-3.0'), self.head)
+        self.assertEqual(resolve_sha(self.repo, 'cassandra-3.0.12'), self.head)
+        self.assertEqual(resolve_sha(self.repo, self.head), self.head)
+        with self.assertRaises(ValueError):
+            resolve_sha(self.repo, 'no-such-branch')
+
+    def test_install_dir_args(self):
+        """
+        Warmed versions are set by directory, others are left to ccm
+        """
+        install_cache._install_dirs['github:apache/cassandra-3.0'] = os.path.join('cache', self.head)
+        self.assertEqual(install_dir_args('github:apache/cassandra-3.0'), {'install_dir': os.path.join('cache', self.head)})
+        self.assertEqual(install_dir_args('3.0.12'), {'version': '3.0.12'})
+
+    def test_failed_build_is_removed(self):
+        """
+        A build that fails leaves neither its temporary directory nor the target behind
+        """
+        target = os.path.join(tempfile.mkdtemp(), 'a' * 40)
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+        with self.assertRaises(subprocess.CalledProcessError):
+            install_cache._build('local:{}:cassandra-3.0'.format(self.repo), self.repo, 'a' * 40, target)
+        self.assertEqual(os.listdir(os.path.dirname(target)), [])
+
+    def test_cluster_created_from_warmed_dir(self):
+        """
+        A cluster created with the install_dir_args of a warmed version runs its directory
+        without ccm setting the version up
+        """
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        install_dir = os.path.join(root, 'a' * 40)
+        for directory in ('bin', 'conf'):
+            os.makedirs(os.path.join(install_dir, directory))
+        open(os.path.join(install_dir, 'conf', 'cassandra.yaml'), 'w').close()
+        with open(os.path.join(install_dir, 'build.xml'), 'w') as f:
+            f.write('<project><property name="base.version" value="3.0.13"/></project>')
+        install_cache._install_dirs['github:apache/cassandra-3.0'] = install_dir
+
+        os.makedirs(os.path.join(root, 'test_path'))
+        cluster = create_ccm_cluster(os.path.join(root, 'test_path'), 'test', **install_dir_args('github:apache/cassandra-3.0'))
+        self.assertEqual(cluster.get_install_dir(), install_dir)
+        self.assertEqual(str(cluster.version()), '3.0.13')
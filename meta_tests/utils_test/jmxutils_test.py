@@ -0,0 +1,214 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+from tools import jmxutils
+from tools.jmxutils import JolokiaAgent, MetricSampler
+
+
+class _FakeJolokiaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    values = {}
+
+    def _response(self, request):
+        key = (request['mbean'], request['attribute'])
+        if key not in self.values:
+            return {'status': 404, 'error': 'InstanceNotFoundException', 'request': request}
+        return {'status': 200, 'value': self.values[key], 'request': request}
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+        if not isinstance(body, list) and body['mbean'] == 'slow':
+            time.sleep(0.5)
+        if isinstance(body, list):
+            data = json.dumps([self._response(request) for request in body])
+        else:
+            data = json.dumps(self._response(body))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        # close keep-alive connections behind the client's back, like an idle timeout
+        self.close_connection = self.server.close_after_response
+
+    def log_message(self, *args):
+        pass
+
+
+class _FakeNode(object):
+
+    def __init__(self, name, pid=4242):
+        self.name = name
+        self.pid = pid
+        self.network_interfaces = {'binary': ('127.0.0.1', 9042)}
+
+    def is_running(self):
+        return True
+
+
+class TestJolokiaAgent(TestCase):
+
+    def setUp(self):
+        _FakeJolokiaHandler.values = {('m1', 'a'): 1, ('m2', 'b'): 2}
+        self.server = HTTPServer(('127.0.0.1', 0), _FakeJolokiaHandler)
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.close_after_response = False
+        threading.Thread(target=self.server.serve_forever).start()
+        self.node = _FakeNode('node1')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        jmxutils._attached_agents.clear()
+        jmxutils._attachment_counts.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def _agent(self, **kwargs):
+        agent = JolokiaAgent(self.node, **kwargs)
+        agent.port = self.server.server_port
+        return agent
+
+    def test_requests_share_a_connection(self):
+        """
+        Successive requests reuse the same keep-alive connection.
+        """
+        agent = self._agent()
+        self.assertEqual(agent.read_attribute('m1', 'a'), 1)
+        self.assertEqual(agent.read_attribute('m2', 'b'), 2)
+        self.assertEqual(agent.read_attributes([('m1', 'a'), ('m2', 'b')]), [1, 2])
+        agent.close()
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_bulk_read_failure(self):
+        """
+        read_attributes raises if any of the reads failed.
+        """
+        agent = self._agent()
+        with self.assertRaises(Exception):
+            agent.read_attributes([('m1', 'a'), ('missing', 'a')], verbose=False)
+        agent.close()
+
+    def _fake_launcher(self):
+        """
+        Points JAVA_HOME at a java that records the agent commands it's given.
+        """
+        java_home = os.path.join(self.tmpdir, 'java')
+        os.makedirs(os.path.join(java_home, 'bin'))
+        java = os.path.join(java_home, 'bin', 'java')
+        calls = os.path.join(self.tmpdir, 'calls')
+        with open(java, 'w') as f:
+            # the command is the argument before the pid
+            f.write('#!/bin/sh\nfor arg; do command=$pid; pid=$arg; done\necho $command >> {}\n'.format(calls))
+            # attaching to the node of pid 1111 is slow
+            f.write('[ $pid = 1111 ] && sleep 1\nexit 0\n')
+        os.chmod(java, 0o755)
+        old_java_home = os.environ.get('JAVA_HOME')
+        os.environ['JAVA_HOME'] = java_home
+        if old_java_home is None:
+            self.addCleanup(os.environ.pop, 'JAVA_HOME')
+        else:
+            self.addCleanup(os.environ.__setitem__, 'JAVA_HOME', old_java_home)
+
+        def launched():
+            if not os.path.exists(calls):
+                return []
+            with open(calls) as f:
+                return f.read().split()
+        return launched
+
+    def test_nested_agents(self):
+        """
+        The agent is attached once however many agents are started, concurrently or nested,
+        and detached when the last of them stops.
+        """
+        launched = self._fake_launcher()
+        outer = self._agent()
+        threads = [threading.Thread(target=agent.start) for agent in (outer, self._agent(), self._agent())]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(launched(), ['start'])
+
+        nested = self._agent()
+        nested.start()
+        nested.stop()
+        for _ in range(2):
+            outer.stop()
+        self.assertEqual(launched(), ['start'])
+        outer.stop()
+        self.assertEqual(launched(), ['start', 'stop'])
+        self.assertEqual(jmxutils._attached_agents, {})
+
+    def test_attaching_to_nodes_concurrently(self):
+        """
+        Attaching to a node doesn't wait for an attachment to another node
+        """
+        self._fake_launcher()
+        slow = JolokiaAgent(_FakeNode('node2', pid=1111))
+        thread = threading.Thread(target=slow.start)
+        thread.start()
+        time.sleep(0.2)
+        start = time.time()
+        self._agent().start()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(len(jmxutils._attached_agents), 2)
+
+    def test_stale_connection_reopened(self):
+        """
+        A request over a connection the agent closed while it was idle is sent again over a new one
+        """
+        self.server.close_after_response = True
+        agent = self._agent()
+        self.assertEqual(agent.read_attribute('m1', 'a'), 1)
+        self.assertEqual(agent.read_attribute('m2', 'b'), 2)
+        agent.close()
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_timed_out_request_not_resent(self):
+        """
+        A request that timed out may have run, and isn't sent again
+        """
+        agent = self._agent()
+        agent.timeout = 0.1
+        self.assertEqual(agent.read_attribute('m1', 'a'), 1)
+        with self.assertRaises(socket.timeout):
+            agent.execute_method('slow', 'compact')
+        agent.close()
+        # a second request would be answered once the first one is done
+        time.sleep(0.8)
+        self.assertEqual([r['mbean'] for r in self.server.requests], ['m1', 'slow'])
+
+    def test_metric_sampler(self):
+        """
+        The sampler writes one line per node and sample, with null for metrics it can't read.
+        """
+        agent = self._agent(keep_attached=True)
+        jmxutils._attached_agents[('127.0.0.1', self.node.pid)] = agent
+        filename = os.path.join(self.tmpdir, 'metrics.jsonl')
+
+        sampler = MetricSampler([self.node], filename, metrics=[('a', ('m1', 'a')), ('missing', ('missing', 'a'))], interval=0.01)
+        sampler.start()
+        sampler.stop()
+        agent.close()
+
+        with open(filename) as f:
+            samples = [json.loads(line) for line in f]
+        self.assertTrue(samples)
+        for sample in samples:
+            self.assertEqual(sample['node'], 'node1')
+            self.assertEqual(sample['a'], 1)
+            self.assertIsNone(sample['missing'])
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ccmlib.node import TimeoutError
+from mock import Mock
+
+from dtest import Tester
+from tools.logtail import (LogTailer, LogWatchThread, ignore_patterns_regex,
+                           log_line_time, watch_log_for)
+
+
+class _NodeLogTestCase(TestCase):
+    """
+    A node whose system.log is written by the test, and a LogTailer of it.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'logs'))
+        self.node = Mock(spec=['name', 'get_path'], get_path=Mock(return_value=self.tmpdir))
+        self.node.name = 'node1'
+        self.tailer = LogTailer(Mock(nodelist=Mock(return_value=[self.node])))
+
+    def tearDown(self):
+        self.tailer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, text):
+        with open(os.path.join(self.tmpdir, 'logs', 'system.log'), 'a') as f:
+            f.write(text)
+
+
+class TestLogTailer(_NodeLogTestCase):
+
+    def test_errors_are_reported_once(self):
+        """
+        Errors are grouped with their stack traces and only reported by the first scan that sees them.
+        """
+        self._append('INFO  starting\nERROR something broke\n\tat Foo.bar\nINFO  still here\n')
+        self.assertEqual(self.tailer.new_errors(), [('node1', [['ERROR something broke', '\tat Foo.bar']])])
+
+        self._append('WARN  an exception happened\nINFO  done\n')
+        self.assertEqual(self.tailer.new_errors(), [('node1', [['WARN  an exception happened']])])
+        self.assertEqual(self.tailer.new_errors(), [])
+
+    def test_stack_trace_split_across_scans(self):
+        """
+        An error whose stack trace is still being written is held back until it's complete, or the scan is final.
+        """
+        self._append('ERROR something broke\n\tat Foo.b')
+        self.assertEqual(self.tailer.new_errors(), [])
+
+        self._append('ar\n\tat Foo.baz\n')
+        self.assertEqual(self.tailer.new_errors(final=True), [('node1', [['ERROR something broke', '\tat Foo.bar', '\tat Foo.baz']])])
+
+    def test_errors_before_error_mark_are_skipped(self):
+        """
+        Errors logged before node.mark_log_for_errors was called are not reported.
+        """
+        self._append('ERROR old error\nINFO  fine\n')
+        self.node.error_mark = os.path.getsize(os.path.join(self.tmpdir, 'logs', 'system.log'))
+        self._append('ERROR new error\n')
+        self.assertEqual(self.tailer.new_errors(final=True), [('node1', [['ERROR new error']])])
+
+    def test_watch_log_for(self):
+        """
+        watch_log_for finds expressions written after the mark, and times out on missing ones.
+        """
+        self._append('INFO  Starting listening for CQL clients\n')
+        mark = os.path.getsize(os.path.join(self.tmpdir, 'logs', 'system.log'))
+        self._append('INFO  Node /127.0.0.2 is now part of the cluster\n')
+
+        line, match = watch_log_for(self.node, r'/127.0.0.(\d) is now part', from_mark=mark, timeout=1)
+        self.assertEqual(match.group(1), '2')
+        with self.assertRaises(TimeoutError):
+            watch_log_for(self.node, 'Starting listening', from_mark=mark, timeout=0.2)
+
+
+class TestActiveLogWatchTeardown(_NodeLogTestCase):
+
+    def test_errors_watched_while_ending_are_reported(self):
+        """
+        Errors the active log watcher sees once the test is ending are still reported by check_logs_for_errors
+        """
+        tester = Tester('check_logs_for_errors')
+        tester.cluster = self.tailer.cluster
+        tester._log_tailer = self.tailer
+        tester._log_errors_while_ending = []
+        tester._log_watch_thread = LogWatchThread(self.tailer, tester._log_error_handler, max_wait=0.05)
+        tester._log_watch_thread.start()
+
+        tester.test_is_ending = True
+        self._append('ERROR something broke during the test\n')
+        tester.end_active_log_watch()
+        self.assertFalse(tester._log_watch_thread.is_alive())
+        self.assertEqual(self.tailer.new_errors(final=True), [])
+        self.assertTrue(tester.check_logs_for_errors())
+
+
+class TestLogLineTime(TestCase):
+
+    def test_log_line_time(self):
+        """
+        Timestamps are read to the millisecond, and lines without one have no time.
+        """
+        first = log_line_time('INFO  [main] 2017-03-02 10:11:12,345 CommitLog.java:168 - Replaying /tmp/CommitLog-6-1.log')
+        second = log_line_time('INFO  [main] 2017-03-02 10:11:14,045 CommitLog.java:170 - Log replay complete')
+        self.assertAlmostEqual(second - first, 1.7)
+        self.assertIsNone(log_line_time('\tat org.apache.cassandra.db.commitlog.CommitLog.recover'))
+
+
+class TestIgnorePatternsRegex(TestCase):
+
+    def test_matches_any_pattern(self):
+        """
+        The combined regex matches anything one of the patterns matches, and is compiled only once.
+        """
+        regex = ignore_patterns_regex(['Unknown keyspace', r'Scrub of .* failed'])
+        self.assertTrue(regex.search('ERROR Scrub of sstable ks-cf failed'))
+        self.assertTrue(regex.search('ERROR Unknown keyspace ks'))
+        self.assertIsNone(regex.search('ERROR OutOfMemoryError'))
+        self.assertIs(regex, ignore_patterns_regex(['Unknown keyspace', r'Scrub of .* failed']))
+        self.assertIsNone(ignore_patterns_regex([]))
@@ -0,0 +1,53 @@
+import threading
+from unittest import TestCase
+
+from tools.paging import PageFetcher
+
+
+class _FakeResponseFuture(object):
+    """
+    Delivers canned pages to PageFetcher callbacks from another thread, like the driver does.
+    """
+
+    def __init__(self, pages):
+        self._pages = list(pages)
+        self.has_more_pages = True
+
+    def add_callbacks(self, callback, errback):
+        self._callback = callback
+        self.start_fetching_next_page()
+
+    def start_fetching_next_page(self):
+        page = self._pages.pop(0)
+        self.has_more_pages = bool(self._pages)
+        threading.Timer(0.01, self._callback, args=(page,)).start()
+
+
+class TestPageFetcher(TestCase):
+
+    def test_iter_rows_streams_every_page(self):
+        """
+        iter_rows yields the rows of every page, fetching them as it goes.
+        """
+        fetcher = PageFetcher(_FakeResponseFuture([[1, 2], [3, 4], [5]]))
+        self.assertEqual(list(fetcher.iter_rows()), [1, 2, 3, 4, 5])
+        self.assertEqual(fetcher.pagecount(), 3)
+        self.assertFalse(fetcher.has_more_pages)
+
+    def test_pages_not_kept(self):
+        """
+        With keep_pages=False pages are only handed to the iterator, not kept.
+        """
+        fetcher = PageFetcher(_FakeResponseFuture([[1, 2], [3, 4]]), keep_pages=False)
+        self.assertEqual(list(fetcher.iter_pages()), [[1, 2], [3, 4]])
+        self.assertEqual(fetcher.pages, [])
+        self.assertEqual(fetcher.retrieved_pages, 2)
+
+    def test_request_all(self):
+        """
+        request_all waits for every page and all_data flattens them.
+        """
+        fetcher = PageFetcher(_FakeResponseFuture([[1, 2], [], [3]])).request_all()
+        self.assertEqual(fetcher.all_data(), [1, 2, 3])
+        self.assertEqual(fetcher.num_results_all(), [2, 1])
+        self.assertEqual(fetcher.retrieved_empty_pages, 1)
@@ -0,0 +1,72 @@
+import threading
+import time
+from unittest import TestCase
+
+from tools.parallel import NodeOperationError, flush_nodes, on_nodes
+
+
+class _FakeNode(object):
+
+    def __init__(self, name, barrier=None):
+        self.name = name
+        self.barrier = barrier
+        self.commands = []
+
+    def nodetool(self, cmd):
+        self.commands.append(cmd)
+        if self.barrier is not None:
+            self.barrier.wait()
+        return cmd
+
+
+class _Barrier(object):
+    """
+    Blocks callers until `parties` of them are waiting (threading.Barrier is python 3 only).
+    """
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.cond = threading.Condition()
+
+    def wait(self):
+        with self.cond:
+            self.parties -= 1
+            self.cond.notify_all()
+            deadline = time.time() + 10
+            while self.parties > 0:
+                if time.time() > deadline:
+                    raise RuntimeError('operations did not run concurrently')
+                self.cond.wait(1)
+
+
+class TestOnNodes(TestCase):
+
+    def test_runs_concurrently(self):
+        """
+        Every node's operation runs at the same time, and results are keyed by node.
+        """
+        barrier = _Barrier(3)
+        nodes = [_FakeNode('node{}'.format(i), barrier) for i in range(1, 4)]
+        results = flush_nodes(nodes, 'ks', 'cf1', 'cf2')
+        self.assertEqual(list(results.items()), [(n.name, 'flush ks cf1 cf2') for n in nodes])
+        self.assertEqual(results.errors, {})
+
+    def test_errors(self):
+        """
+        Errors are collected per node, and only raised once every node is done.
+        """
+        nodes = [_FakeNode('node1'), _FakeNode('node2'), _FakeNode('node3')]
+
+        def operation(node):
+            if node.name == 'node2':
+                raise ValueError('boom')
+            return node.nodetool('drain')
+
+        with self.assertRaises(NodeOperationError) as cm:
+            on_nodes(nodes, operation)
+        self.assertEqual(list(cm.exception.errors), ['node2'])
+        self.assertEqual(list(cm.exception.results), ['node1', 'node3'])
+
+        results = on_nodes(nodes, operation, raise_errors=False)
+        self.assertIsInstance(results.errors['node2'], ValueError)
+        self.assertEqual(nodes[2].commands, ['drain', 'drain'])
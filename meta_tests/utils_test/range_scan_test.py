@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from tools.range_scan import KeyBitmap, KeyFormat, RangeScanner, split_ring
+
+MURMUR3 = 'org.apache.cassandra.dht.Murmur3Partitioner'
+
+
+class _FakeFuture(object):
+    """
+    Hands out rows two at a time, like a paged query.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.has_more_pages = True
+
+    def add_callbacks(self, callback, errback):
+        self.callback = callback
+        self.start_fetching_next_page()
+
+    def start_fetching_next_page(self):
+        page, self.rows = self.rows[:2], self.rows[2:]
+        self.has_more_pages = bool(self.rows)
+        self.callback(page)
+
+
+class _FakeMetadata(object):
+    partitioner = MURMUR3
+    token_map = None
+
+
+class _FakeCluster(object):
+    metadata = _FakeMetadata()
+
+
+class _FakeSession(object):
+    """
+    A table of keys with a token each, spread over the ring.
+    """
+    cluster = _FakeCluster()
+
+    def __init__(self, keys):
+        step = (2 ** 64) // (len(keys) + 1)
+        self.rows = [(-2 ** 63 + step * (i + 1), key, 'value1', 'value2') for i, key in enumerate(keys)]
+
+    def execute_async(self, statement, token_range):
+        start, end = token_range
+        return _FakeFuture([row for row in self.rows if start < row[0] <= end])
+
+
+class TestRangeScan(TestCase):
+
+    def test_split_ring(self):
+        """
+        Ranges cover the ring without gaps or overlaps
+        """
+        ranges = split_ring(MURMUR3, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], -2 ** 63)
+        self.assertEqual(ranges[-1][1], 2 ** 63 - 1)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+        with self.assertRaises(ValueError):
+            split_ring('org.apache.cassandra.dht.ByteOrderedPartitioner', 4)
+
+    def test_key_bitmap(self):
+        """
+        KeyBitmap behaves like a set of integers
+        """
+        bitmap = KeyBitmap([3, 17, 1000])
+        self.assertIn(17, bitmap)
+        self.assertNotIn(16, bitmap)
+        self.assertNotIn(100000, bitmap)
+        bitmap.update(KeyBitmap([0, 5000]))
+        self.assertEqual(list(bitmap), [0, 3, 17, 1000, 5000])
+        self.assertEqual(len(bitmap), 5)
+
+    def test_key_format(self):
+        """
+        Keys map to their number and back, other keys to None
+        """
+        fmt = KeyFormat('k{}')
+        self.assertEqual(fmt.index_of('k42'), 42)
+        self.assertIsNone(fmt.index_of('x42'))
+        self.assertIsNone(fmt.index_of(42))
+        self.assertEqual(fmt.key_for(42), 'k42')
+
+    def test_scan(self):
+        """
+        A scan sees every key once, whatever the number of ranges
+        """
+        session = _FakeSession(['k{}'.format(i) for i in range(100) if i != 50] + ['other'])
+        result = RangeScanner(session, 'cf', columns=('c1', 'c2'), split_count=9, max_workers=3,
+                              row_check=lambda row: row[2:] == ('value1', 'value2')).scan()
+        self.assertEqual(result.rows, 100)
+        self.assertEqual(sum(stats.rows for stats in result.range_stats), 100)
+        self.assertEqual(result.other_keys, ['other'])
+
+        result.assert_keys(present=[0, 99], absent=[50], rows=100)
+        with self.assertRaises(AssertionError) as cm:
+            result.assert_keys(expected=range(101))
+        message = str(cm.exception)
+        self.assertIn("2 missing keys in range unknown: ['k50', 'k100']", message)
+        self.assertIn("1 unexpected keys, e.g. ['other']", message)
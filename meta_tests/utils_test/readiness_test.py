@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import namedtuple
+from unittest import TestCase
+
+from cassandra.cluster import Cluster
+from cassandra.policies import (HostDistance, SimpleConvictionPolicy,
+                                WhiteListRoundRobinPolicy)
+from cassandra.pool import Host
+
+from tools.readiness import (NotReadyError, gossip_states, wait_for_gossip_normal,
+                             wait_for_hosts_up, wait_until)
+
+_NodetoolResult = namedtuple('_NodetoolResult', 'stdout stderr rc')
+
+_STATUS = """Datacenter: datacenter1
+=======================
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address    Load       Tokens       Owns (effective)  Host ID                               Rack
+UN  127.0.0.1  98.31 KiB  256          66.7%             0c62cd4d-8ba1-4b8c-9b44-3ae3d5a6f8b4  rack1
+{}  127.0.0.2  98.3 KiB   256          66.7%             5b2b2a11-a3b6-4d2c-9a8e-3c1e0e5f7e21  rack1
+"""
+
+
+class _FakeNode(object):
+
+    def __init__(self, name, address, states):
+        self.name = name
+        self._address = address
+        self.states = states
+
+    def address(self):
+        return self._address
+
+    def nodetool(self, cmd):
+        return _NodetoolResult(_STATUS.format(self.states.pop(0) if len(self.states) > 1 else self.states[0]), '', 0)
+
+
+class _FakeHost(object):
+
+    def __init__(self, address):
+        self.address = address
+        self.is_up = False
+
+
+class _FakeCluster(object):
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.listeners = set()
+        self.metadata = self
+        self.profile_manager = self
+
+    def distance(self, host):
+        return HostDistance.LOCAL
+
+    def all_hosts(self):
+        return self.hosts
+
+    def register_listener(self, listener):
+        self.listeners.add(listener)
+
+    def unregister_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def mark_up(self, host):
+        host.is_up = True
+        for listener in list(self.listeners):
+            listener.on_up(host)
+
+
+class _FakeSession(object):
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+
+class TestReadiness(TestCase):
+
+    def test_wait_until_diagnostics(self):
+        """
+        A wait that times out says what it was waiting for and the last state seen
+        """
+        with self.assertRaises(NotReadyError) as cm:
+            wait_until(lambda: False, "the impossible", timeout=0.2, diagnostics=lambda: {'node1': 'DN'})
+        self.assertIn("the impossible", str(cm.exception))
+        self.assertEqual(cm.exception.state, {'node1': 'DN'})
+
+    def test_gossip_states(self):
+        """
+        nodetool status is parsed into the state of each address
+        """
+        node = _FakeNode('node1', '127.0.0.1', ['UJ'])
+        self.assertEqual(gossip_states(node), {'127.0.0.1': 'UN', '127.0.0.2': 'UJ'})
+
+    def test_wait_for_gossip_normal(self):
+        """
+        The wait returns once every node sees every node as up and normal
+        """
+        nodes = [_FakeNode('node1', '127.0.0.1', ['DN', 'UN']), _FakeNode('node2', '127.0.0.2', ['UJ', 'UJ', 'UN'])]
+        wait_for_gossip_normal(nodes, timeout=30)
+        self.assertEqual(nodes[1].states, ['UN'])
+
+    def test_wait_for_hosts_up(self):
+        """
+        Waiting for hosts to be up wakes up on the driver's host events
+        """
+        hosts = [_FakeHost('127.0.0.1'), _FakeHost('127.0.0.2')]
+        cluster = _FakeCluster(hosts)
+        cluster.mark_up(hosts[0])
+        nodes = [_FakeNode('node1', '127.0.0.1', ['UN']), _FakeNode('node2', '127.0.0.2', ['UN'])]
+
+        timer = threading.Timer(0.1, cluster.mark_up, args=(hosts[1],))
+        timer.start()
+        start = time.time()
+        wait_for_hosts_up(_FakeSession(cluster), nodes, timeout=30)
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(cluster.listeners, set())
+
+        with self.assertRaises(NotReadyError):
+            wait_for_hosts_up(_FakeSession(cluster), nodes + [_FakeNode('node3', '127.0.0.3', ['UN'])], timeout=0.2)
+
+    def test_wait_for_hosts_up_of_an_exclusive_session(self):
+        """
+        The nodes a whitelist policy ignores are never marked up by the driver, and aren't waited for
+        """
+        cluster = Cluster(['127.0.0.1'], load_balancing_policy=WhiteListRoundRobinPolicy(['127.0.0.1']), protocol_version=4)
+        local, ignored = [cluster.metadata.add_or_return_host(Host(address, SimpleConvictionPolicy))[0]
+                          for address in ('127.0.0.1', '127.0.0.2')]
+        # what the driver does once it connected to the whitelisted host
+        local.set_up()
+        self.assertEqual(cluster.profile_manager.distance(ignored), HostDistance.IGNORED)
+        self.assertIsNone(ignored.is_up)
+
+        nodes = [_FakeNode('node1', '127.0.0.1', ['UN']), _FakeNode('node2', '127.0.0.2', ['UN'])]
+        start = time.time()
+        wait_for_hosts_up(_FakeSession(cluster), nodes, timeout=30)
+        self.assertLess(time.time() - start, 0.9)
+
+        local.set_down()
+        with self.assertRaises(NotReadyError):
+            wait_for_hosts_up(_FakeSession(cluster), nodes, timeout=0.2)
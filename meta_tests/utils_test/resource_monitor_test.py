@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from tools.resource_monitor import ResourceMonitor
+
+_STOPPED = '2017-03-02T10:11:12.345+0000: 1.234: Total time for which application threads were stopped: {} seconds, Stopping threads took: 0.0000100 seconds\n'
+
+
+class _FakeNode(object):
+    """
+    Stands in for a node running as this process.
+    """
+
+    def __init__(self, path, pid):
+        self.name = 'node1'
+        self.pid = pid
+        self.path = path
+
+    def data_directories(self):
+        return [os.path.join(self.path, 'data0')]
+
+    def get_path(self):
+        return self.path
+
+    def gclogfilename(self):
+        return os.path.join(self.path, 'logs', 'gc.log.0.current')
+
+
+class _FakeCluster(object):
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def nodelist(self):
+        return self.nodes
+
+
+class TestResourceMonitor(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ('data0', 'commitlogs', 'logs'):
+            os.makedirs(os.path.join(self.root, d))
+        self.node = _FakeNode(self.root, os.getpid())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _append(self, path, text):
+        with open(os.path.join(self.root, path), 'a') as f:
+            f.write(text)
+
+    def test_sample(self):
+        """
+        Each sample has the process counters, directory sizes and gc pauses since the previous one
+        """
+        monitor = ResourceMonitor(_FakeCluster([self.node]), os.path.join(self.root, 'resources.jsonl'))
+        monitor._start = time.time()
+        self._append('data0/mc-1-big-Data.db', 'x' * 100)
+        self._append('commitlogs/CommitLog-6-1.log', 'x' * 10)
+        self._append('logs/gc.log.0.current', _STOPPED.format('0.0100000') + _STOPPED.format('0.0025000'))
+
+        sample = monitor.sample(self.node)
+        self.assertEqual((sample['node'], sample['pid']), ('node1', os.getpid()))
+        self.assertEqual((sample['data'], sample['commitlog']), (100, 10))
+        self.assertEqual((sample['gc_ms'], sample['gc_max_ms']), (12.5, 10.0))
+        self.assertGreater(sample['rss'], 0)
+        self.assertGreater(sample['fds'], 0)
+
+        self.assertEqual(monitor.sample(self.node)['gc_ms'], 0)
+        # a restarted node starts a new gc log
+        os.remove(os.path.join(self.root, 'logs', 'gc.log.0.current'))
+        self._append('logs/gc.log.0.current', _STOPPED.format('0.001'))
+        self.assertEqual(monitor.sample(self.node)['gc_ms'], 1.0)
+
+    def test_stopped_nodes_are_skipped(self):
+        """
+        Nodes that aren't running have no samples, and the monitor writes a last sample when stopped
+        """
+        stopped = _FakeNode(self.root, None)
+        stopped.name = 'node2'
+        monitor = ResourceMonitor(_FakeCluster([self.node, stopped]), os.path.join(self.root, 'resources.jsonl'), interval=0.05)
+        monitor.start()
+        time.sleep(0.2)
+        monitor.stop()
+
+        with open(monitor.filename) as f:
+            samples = [json.loads(line) for line in f]
+        self.assertGreater(len(samples), 1)
+        self.assertEqual(set(s['node'] for s in samples), set(['node1']))
+        self.assertEqual(sorted(s['t'] for s in samples), [s['t'] for s in samples])
@@ -0,0 +1,86 @@
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+from tools import sstable_metadata
+from tools.sstable_metadata import (UnsupportedSSTableFormat, parse_data_file_name,
+                                    read_sstable_metadata, sstable_levels)
+
+
+def _stats(format_version, level, repaired_at, min_timestamp=1, max_timestamp=2):
+    """
+    Serializes a STATS component the way Cassandra does.
+    """
+    histogram = struct.pack('>i', 3) + struct.pack('>qqqqqq', 0, 5, 1, 6, 2, 7)
+    stats = histogram + histogram + struct.pack('>qi', 12, 345) + struct.pack('>qq', min_timestamp, max_timestamp)
+    stats += struct.pack('>iiii', 1, 2, 3, 4) if format_version >= 'ma' else struct.pack('>i', 2)
+    stats += struct.pack('>d', 0.5) + struct.pack('>ii', 100, 2) + struct.pack('>dqdq', 1.0, 3, 2.0, 4)
+    stats += struct.pack('>iq', level, repaired_at)
+    # the validation component comes first, as in real files
+    validation = b'\x00' * 10
+    toc = struct.pack('>i', 2) + struct.pack('>ii', 0, 20) + struct.pack('>ii', 2, 30)
+    return toc + validation + stats
+
+
+class TestSSTableMetadata(TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.table_dir = os.path.join(self.data_dir, 'ks', 'cf-0123')
+        os.makedirs(self.table_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        sstable_metadata._cache.clear()
+
+    def _write(self, name, stats):
+        path = os.path.join(self.table_dir, name)
+        open(path, 'w').close()
+        with open(path.replace('Data.db', 'Statistics.db'), 'wb') as f:
+            f.write(stats)
+        return path
+
+    def test_parse_data_file_name(self):
+        """
+        Both sstable naming schemes are understood
+        """
+        self.assertEqual(parse_data_file_name('/d/ks/cf/mc-12-big-Data.db'), ('mc', 12))
+        self.assertEqual(parse_data_file_name('/d/ks/cf/ks-cf-ka-3-Data.db'), ('ka', 3))
+        with self.assertRaises(ValueError):
+            parse_data_file_name('/d/ks/cf/manifest.json')
+
+    def test_read_sstable_metadata(self):
+        """
+        Metadata is read for 2.1 and 3.0 formats, and again when the file changes
+        """
+        path = self._write('mc-1-big-Data.db', _stats('mc', 2, 1234, min_timestamp=10, max_timestamp=20))
+        metadata = read_sstable_metadata(path)
+        self.assertEqual((metadata.format_version, metadata.generation), ('mc', 1))
+        self.assertEqual((metadata.min_timestamp, metadata.max_timestamp), (10, 20))
+        self.assertEqual((metadata.level, metadata.repaired_at), (2, 1234))
+        self.assertIs(read_sstable_metadata(path), metadata)
+
+        self._write('mc-1-big-Data.db', _stats('mc', 0, 1234, min_timestamp=10, max_timestamp=20) + b'\x00')
+        self.assertEqual(read_sstable_metadata(path).level, 0)
+
+        path = self._write('ks-cf-ka-2-Data.db', _stats('ka', 1, 0))
+        self.assertEqual((read_sstable_metadata(path).level, read_sstable_metadata(path).repaired_at), (1, 0))
+
+        with self.assertRaises(UnsupportedSSTableFormat):
+            read_sstable_metadata(self._write('ks-cf-jb-3-Data.db', b''))
+
+    def test_sstable_levels(self):
+        """
+        Compacted sstables are left out
+        """
+        class _FakeNode(object):
+            def data_directories(node):
+                return [self.data_dir]
+
+        self._write('mc-1-big-Data.db', _stats('mc', 1, 0))
+        self._write('mc-2-big-Data.db', _stats('mc', 2, 0))
+        compacted = self._write('mc-3-big-Data.db', _stats('mc', 3, 0))
+        open(compacted.replace('Data.db', 'Compacted'), 'w').close()
+        self.assertEqual(sstable_levels(_FakeNode(), 'ks', 'cf'), [1, 2])
@@ -0,0 +1,95 @@
+import os
+import shutil
+import stat
+import tempfile
+import time
+from unittest import TestCase
+
+from tools.sstableloader import link_file, link_tree, load_tables, table_dirs
+
+_FAKE_LOADER = """#!/bin/sh
+sleep 0.5
+echo "$@"
+"""
+
+
+class _FakeNode(object):
+
+    def __init__(self, path, install_dir):
+        self.path = path
+        self.install_dir = install_dir
+
+    def get_path(self):
+        return self.path
+
+    def get_install_dir(self):
+        return self.install_dir
+
+    def address(self):
+        return '127.0.0.1'
+
+
+class TestSSTableLoader(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, content=''):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_link_tree(self):
+        """
+        Files are hard linked, not copied, and the tree is recreated
+        """
+        src, dst = os.path.join(self.root, 'ks'), os.path.join(self.root, 'copy', 'ks')
+        self._write(os.path.join(src, 'cf-1', 'mc-1-big-Data.db'), 'x' * 100)
+        self._write(os.path.join(src, 'cf-2', 'mc-1-big-Data.db'), 'y' * 10)
+
+        self.assertEqual(link_tree(src, dst), 110)
+        self.assertEqual(table_dirs(dst), [os.path.join(dst, 'cf-1'), os.path.join(dst, 'cf-2')])
+        self.assertEqual(os.stat(os.path.join(src, 'cf-1', 'mc-1-big-Data.db')).st_ino,
+                         os.stat(os.path.join(dst, 'cf-1', 'mc-1-big-Data.db')).st_ino)
+
+    def test_link_file_keeps_existing_files(self):
+        """
+        A file is linked to a new name, but never over an existing file
+        """
+        source, target = os.path.join(self.root, 'mc-1-big-Data.db'), os.path.join(self.root, 'table', 'mc-1-big-Data.db')
+        self._write(source, 'x' * 100)
+        self._write(target, 'live')
+        with self.assertRaises(OSError):
+            link_file(source, target)
+        self.assertEqual(link_file(source, target.replace('-1-', '-2-')), 100)
+        with open(target) as f:
+            self.assertEqual(f.read(), 'live')
+
+    def test_load_tables(self):
+        """
+        Loaders of different directories run at the same time, and each result is recorded
+        """
+        install_dir, node_path = os.path.join(self.root, 'install'), os.path.join(self.root, 'node1')
+        self._write(os.path.join(install_dir, 'bin', 'cassandra.in.sh'), 'CASSANDRA_HOME=\nCASSANDRA_CONF=\n')
+        loader = os.path.join(install_dir, 'bin', 'sstableloader')
+        self._write(loader, _FAKE_LOADER)
+        os.chmod(loader, os.stat(loader).st_mode | stat.S_IEXEC)
+        os.makedirs(os.path.join(node_path, 'bin'))
+
+        dirs = [os.path.join(self.root, 'copy', 'ks', 'cf{}'.format(i)) for i in range(4)]
+        for d in dirs:
+            self._write(os.path.join(d, 'mc-1-big-Data.db'), 'z' * 1000)
+
+        start = time.time()
+        results = load_tables(_FakeNode(node_path, install_dir), dirs, max_workers=4)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual([r.table_dir for r in results], dirs)
+        for result in results:
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual(result.size, 1000)
+            self.assertIn('--nodes 127.0.0.1', result.stdout)
+            self.assertGreater(result.throughput, 0)
@@ -0,0 +1,111 @@
+import threading
+from unittest import TestCase
+
+from tools.workload import ContinuousWorkload, CounterWorkload
+
+
+class _FakeStatement(object):
+
+    def __init__(self, query):
+        self.query_string = query
+
+
+class _FakeFuture(object):
+
+    def __init__(self, result, error):
+        self.result = result
+        self.error = error
+
+    def add_callbacks(self, callback, callback_args, errback, errback_args):
+        if self.error is not None:
+            threading.Thread(target=errback, args=(self.error,) + callback_args).start()
+        else:
+            threading.Thread(target=callback, args=(self.result,) + callback_args).start()
+
+
+class _FakeSession(object):
+    """
+    Applies workload queries to a dict. Every fail_every-th write fails,
+    alternately before and after being applied.
+    """
+
+    def __init__(self, fail_every=None):
+        self.table = {}
+        self.fail_every = fail_every
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def prepare(self, query):
+        return _FakeStatement(query)
+
+    def execute_async(self, statement, args):
+        with self.lock:
+            query = statement.query_string
+            if query.startswith('SELECT'):
+                return _FakeFuture([(k, self.table[k]) for k in args if k in self.table], None)
+
+            self.writes += 1
+            failing = self.fail_every and self.writes % self.fail_every == 0
+            if failing and self.writes % (2 * self.fail_every) == 0:
+                return _FakeFuture(None, Exception('write timeout'))
+            if 'c = c + 1' in query:
+                self.table[args[0]] = self.table.get(args[0], 0) + 1
+            else:
+                self.table[args[1]] = args[0]
+            return _FakeFuture(None, Exception('write timeout') if failing else None)
+
+
+class _LosingSession(_FakeSession):
+    """
+    Acknowledges writes without applying them.
+    """
+
+    def execute_async(self, statement, args):
+        if statement.query_string.startswith('SELECT'):
+            return _FakeSession.execute_async(self, statement, args)
+        return _FakeFuture(None, None)
+
+
+class TestContinuousWorkload(TestCase):
+
+    def _run(self, workload_class, session):
+        workload = workload_class(session, concurrency=4, batch_size=5)
+        workload.start()
+        workload.wait_for_writes(200, timeout=30)
+        workload.start_phase('second phase')
+        workload.wait_for_writes(400, timeout=30)
+        workload.stop(timeout=30)
+        return workload
+
+    def test_writes_are_verified(self):
+        """
+        Every acknowledged write is read back and matches.
+        """
+        workload = self._run(ContinuousWorkload, _FakeSession())
+        workload.check()
+        self.assertEqual([p.name for p in workload.phases], ['initial load', 'second phase'])
+        self.assertGreaterEqual(sum(p.writes for p in workload.phases), 400)
+        self.assertEqual(sum(p.reads for p in workload.phases), sum(p.writes for p in workload.phases))
+
+    def test_failed_writes_are_ambiguous(self):
+        """
+        Writes that fail may or may not have been applied; neither is a mismatch.
+        """
+        workload = self._run(CounterWorkload, _FakeSession(fail_every=10))
+        self.assertEqual(workload.mismatches, [])
+        self.assertGreater(workload.phases[0].write_errors, 0)
+        with self.assertRaisesRegexp(AssertionError, 'Too many failed operations'):
+            workload.check()
+        workload.check(max_error_rate=0.5)
+
+    def test_mismatch(self):
+        """
+        A value that doesn't read back as written is reported.
+        """
+        workload = ContinuousWorkload(_LosingSession(), concurrency=4)
+        workload.start()
+        workload.wait_for_writes(10, timeout=30)
+        workload.stop(timeout=30)
+        self.assertTrue(workload.mismatches)
+        with self.assertRaisesRegexp(AssertionError, 'did not match'):
+            workload.check()
@@ -8,7 +8,10 @@ from ccmlib import common
 from ccmlib.node import ToolError
 
 from dtest import Tester, debug, create_ks
+from tools.compaction import wait_for_compactions
 from tools.decorators import since
+from tools.jmxutils import remove_perf_disable_shared_mem
+from tools.sstable_metadata import sstable_levels
 
 
 class TestOfflineTools(Tester):
@@ -26,8 +29,11 @@ class TestOfflineTools(Tester):
         @jira_ticket CASSANDRA-7614
         """
         cluster = self.cluster
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         node1 = cluster.nodelist()[0]
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
 
         # test by trying to run on nonexistent keyspace
         cluster.stop(gently=False)
@@ -68,12 +74,12 @@ class TestOfflineTools(Tester):
         node1.stress(['write', 'n=50K', 'no-warmup', '-schema', 'replication(factor=1)',
                       '-rate', 'threads=8'])
         cluster.flush()
-        self.wait_for_compactions(node1)
+        wait_for_compactions(node1)
         cluster.stop()
 
-        initial_levels = self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"]))
+        initial_levels = sstable_levels(node1, "keyspace1", "standard1")
         _, error, rc = node1.run_sstablelevelreset("keyspace1", "standard1")
-        final_levels = self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"]))
+        final_levels = sstable_levels(node1, "keyspace1", "standard1")
         self._check_stderr_error(error)
         self.assertEqual(rc, 0, msg=str(rc))
 
@@ -86,17 +92,6 @@ class TestOfflineTools(Tester):
         # let's check all sstables are on L0 after sstablelevelreset
         self.assertTrue(max(final_levels) == 0)
 
-    def get_levels(self, data):
-        (out, err, rc) = data
-        return map(int, re.findall("SSTable Level: ([0-9])", out))
-
-    def wait_for_compactions(self, node):
-        pattern = re.compile("pending tasks: 0")
-        while True:
-            output, err, _ = node.nodetool("compactionstats")
-            if pattern.search(output):
-                break
-
     def sstableofflinerelevel_test(self):
         """
         Generate sstables of varying levels.
@@ -108,8 +103,11 @@ class TestOfflineTools(Tester):
         """
         cluster = self.cluster
         cluster.set_configuration_options(values={'compaction_throughput_mb_per_sec': 0})
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         node1 = cluster.nodelist()[0]
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node1)
+        cluster.start(wait_for_binary_proto=True)
 
         # NOTE - As of now this does not return when it encounters Exception and causes test to hang, temporarily commented out
         # test by trying to run on nonexistent keyspace
@@ -163,21 +161,21 @@ class TestOfflineTools(Tester):
 
         node1.flush()
         debug("Waiting for compactions to finish")
-        self.wait_for_compactions(node1)
+        wait_for_compactions(node1)
         debug("Stopping node")
         cluster.stop()
         debug("Done stopping node")
 
         # Let's reset all sstables to L0
         debug("Getting initial levels")
-        initial_levels = list(self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"])))
+        initial_levels = sstable_levels(node1, "keyspace1", "standard1")
         self.assertNotEqual([], initial_levels)
         debug('initial_levels:')
         debug(initial_levels)
         debug("Running sstablelevelreset")
         node1.run_sstablelevelreset("keyspace1", "standard1")
         debug("Getting final levels")
-        final_levels = list(self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"])))
+        final_levels = sstable_levels(node1, "keyspace1", "standard1")
         self.assertNotEqual([], final_levels)
         debug('final levels:')
         debug(final_levels)
@@ -189,11 +187,11 @@ class TestOfflineTools(Tester):
 
         # time to relevel sstables
         debug("Getting initial levels")
-        initial_levels = self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"]))
+        initial_levels = sstable_levels(node1, "keyspace1", "standard1")
         debug("Running sstableofflinerelevel")
         output, error, _ = node1.run_sstableofflinerelevel("keyspace1", "standard1")
         debug("Getting final levels")
-        final_levels = self.get_levels(node1.run_sstablemetadata(keyspace="keyspace1", column_families=["standard1"]))
+        final_levels = sstable_levels(node1, "keyspace1", "standard1")
 
         debug(output)
         debug(error)
@@ -16,6 +16,7 @@ from tools.assertions import assert_almost_equal, assert_one
 from tools.data import insert_c1c2
 from tools.decorators import since, no_vnodes
 from tools.misc import new_node
+from tools.sstable_metadata import node_sstable_metadata
 
 
 class ConsistentState(object):
@@ -329,8 +330,8 @@ class TestIncRepair(Tester):
             for node in cluster.nodelist():
                 node.nodetool('compact keyspace1 standard1')
 
-        for out in (node.run_sstablemetadata(keyspace='keyspace1').stdout for node in cluster.nodelist()):
-            self.assertNotIn('Repaired at: 0', out)
+        for node in cluster.nodelist():
+            self.assertNotIn(0, [m.repaired_at for m in node_sstable_metadata(node, 'keyspace1')])
 
     def multiple_repair_test(self):
         """
@@ -646,8 +647,8 @@ class TestIncRepair(Tester):
             for node in cluster.nodelist():
                 node.nodetool('compact keyspace1 standard1')
 
-        for out in (node.run_sstablemetadata(keyspace='keyspace1').stdout for node in cluster.nodelist() if len(node.get_sstables('keyspace1', 'standard1')) > 0):
-            self.assertNotIn('Repaired at: 0', out)
+        for node in cluster.nodelist():
+            self.assertNotIn(0, [m.repaired_at for m in node_sstable_metadata(node, 'keyspace1', 'standard1')])
 
     @no_vnodes()
     @since('4.0')
@@ -1,6 +1,5 @@
 import threading
 import time
-import re
 from collections import namedtuple
 from threading import Thread
 from unittest import skip, skipIf
@@ -11,8 +10,10 @@ from ccmlib.node import ToolError
 from nose.plugins.attrib import attr
 
 from dtest import CASSANDRA_VERSION_FROM_BUILD, FlakyRetryPolicy, Tester, debug, create_ks, create_cf
-from tools.data import insert_c1c2, query_c1c2
+from tools.data import insert_c1c2
 from tools.decorators import no_vnodes, since
+from tools.range_scan import RangeScanner
+from tools.sstable_metadata import node_sstable_metadata
 
 
 def _repair_options(version, ks='', cf=None, sequential=True):
@@ -68,16 +69,8 @@ class BaseRepairTest(Tester):
                 node.stop(wait_other_notice=True)
 
         session = self.patient_exclusive_cql_connection(node_to_check, 'ks')
-        result = list(session.execute("SELECT * FROM cf LIMIT {}".format(rows * 2)))
-        self.assertEqual(len(result), rows)
-
-        for k in found:
-            query_c1c2(session, k, ConsistencyLevel.ONE)
-
-        for k in missings:
-            query = SimpleStatement("SELECT c1, c2 FROM cf WHERE key='k{}'".format(k), consistency_level=ConsistencyLevel.ONE)
-            res = list(session.execute(query))
-            self.assertEqual(len(filter(lambda x: len(x) != 0, res)), 0, res)
+        scanner = RangeScanner(session, 'cf', columns=('c1', 'c2'), row_check=lambda row: row[2:] == ('value1', 'value2'))
+        scanner.scan().assert_keys(present=found, absent=missings, rows=rows)
 
         if restart:
             for node in stopped_nodes:
@@ -265,23 +258,12 @@ class TestRepair(BaseRepairTest):
 
     def _get_repaired_data(self, node, keyspace):
         """
-        Based on incremental_repair_test.py:TestIncRepair implementation.
+        Returns the name and repaired at time of every sstable of keyspace on node.
         """
-        _sstable_name = re.compile('SSTable: (.+)')
-        _repaired_at = re.compile('Repaired at: (\d+)')
         _sstable_data = namedtuple('_sstabledata', ('name', 'repaired'))
-
-        out = node.run_sstablemetadata(keyspace=keyspace).stdout
-
-        def matches(pattern):
-            return filter(None, [pattern.match(l) for l in out.split('\n')])
-
-        names = [m.group(1) for m in matches(_sstable_name)]
-        repaired_times = [int(m.group(1)) for m in matches(_repaired_at)]
-
-        self.assertTrue(names)
-        self.assertTrue(repaired_times)
-        return [_sstable_data(*a) for a in zip(names, repaired_times)]
+        data = [_sstable_data(m.path, m.repaired_at) for m in node_sstable_metadata(node, keyspace)]
+        self.assertTrue(data)
+        return data
 
     @since('2.2.10', '4')
     def no_anticompaction_of_already_repaired_test(self):
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """
 Usage: run_dtests.py [--nose-options NOSE_OPTIONS] [TESTS...] [--vnodes VNODES_OPTIONS...]
+                 [--workers WORKERS] [--timing-db TIMING_DB]
                  [--runner-debug | --runner-quiet] [--dry-run]
 
 nosetests options:
@@ -10,6 +11,15 @@ nosetests options:
 script configuration options:
     --runner-debug -d            print debug statements in this script
     --runner-quiet -q            quiet all output from this script
+    --workers WORKERS            split the collected tests across this many
+                                 nosetests processes running side by side.
+                                 Each worker's output goes to
+                                 dtest-worker<N>.out and the results are
+                                 merged into nosetests.xml. [default: 1]
+    --timing-db TIMING_DB        JSON file of per-test durations, updated after
+                                 every --workers run and used to balance the
+                                 work across workers on the next one.
+                                 [default: dtest_timings.json]
 
 cluster configuration options:
     --vnodes VNODES_OPTIONS...   specify whether to run with or without vnodes.
@@ -19,14 +29,21 @@ example:
     The following command will execute nosetests with the '-v' (verbose) option, vnodes disabled, and run a single test:
     ./run_dtests.py --nose-options -v --vnodes false repair_tests/repair_test.py:TestRepair.token_range_repair_test_with_cf
 
+    The following command will run the repair tests split across 8 workers:
+    ./run_dtests.py --workers 8 repair_tests
+
 """
 from __future__ import print_function
 
+import heapq
+import json
+import os
 import subprocess
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from itertools import product
 from os import getcwd
 from tempfile import NamedTemporaryFile
+from xml.etree import ElementTree
 
 from docopt import docopt
 
@@ -39,6 +56,17 @@ default_config_matrix = GlobalConfigObject(
     vnodes=(True, False),
 )
 
+# dtest.py derives per-worker addresses and ports from the worker id; ids are
+# added to JMX ports spaced 100 apart, so more workers than that would collide.
+MAX_WORKERS = 99
+
+MERGED_XUNIT_FILE = 'nosetests.xml'
+
+# Rough cost model for tests that aren't in the timing database yet: a test
+# module's runtime tends to grow with its size, so unseen tests are charged a
+# share of their module's size in bytes. With no timings at all, use this rate.
+DEFAULT_SECONDS_PER_BYTE = 0.01
+
 
 def _noop(*args, **kwargs):
     pass
@@ -101,6 +129,22 @@ def _validate_and_serialize_vnodes(vnodes_value):
     return ValidationResult(serialized=serialized)
 
 
+def _validate_workers(workers_value):
+    """
+    Validate the value received for --workers. Returns a ValidationResult
+    with the worker count as an int if it validates.
+    """
+    try:
+        workers = int(workers_value)
+    except (TypeError, ValueError):
+        workers = None
+
+    if workers is None or not 1 <= workers <= MAX_WORKERS:
+        return ValidationResult(error_messages=['{} not a valid value for --workers option. '
+                                                'valid values are integers from 1 to {}'.format(workers_value, MAX_WORKERS)])
+    return ValidationResult(serialized=workers)
+
+
 def validate_and_serialize_options(docopt_options):
     """
     For each value that should be configured for a config object, attempt to
@@ -163,9 +207,194 @@ def product_of_values(d):
     return tuple(dict(result) for result in product(*tuple_list))
 
 
+def nose_name_from_xunit_case(testcase):
+    """
+    Turns a <testcase> element from a nose xunit report into a test name nose
+    accepts on the command line, e.g. classname
+    'repair_tests.repair_test.TestRepair' and name 'simple_repair_test' becomes
+    'repair_tests.repair_test:TestRepair.simple_repair_test'.
+    """
+    classname, name = testcase.get('classname'), testcase.get('name')
+    module, _, cls = classname.rpartition('.')
+    if module and cls[:1].isupper():
+        return '{}:{}.{}'.format(module, cls, name)
+    # a module-level test function; classname is just the module
+    return '{}:{}'.format(classname, name)
+
+
+def group_by_class(test_ids):
+    """
+    Groups test names by the module:Class they belong to, preserving the
+    order they were collected in. Sharding whole groups keeps the tests of a
+    class on one worker, so per-class setup (e.g. ReusableClusterTester) is
+    paid only once.
+    """
+    groups = OrderedDict()
+    for test_id in test_ids:
+        groups.setdefault(test_id.rpartition('.')[0] or test_id, []).append(test_id)
+    return groups
+
+
+def shard_by_class(test_ids, workers, durations=None):
+    """
+    Splits test names into (at most) `workers` lists of whole class groups,
+    balanced by expected duration: groups are handed out longest first, each
+    to the worker with the least work so far (LPT scheduling). Without
+    durations every test counts the same. Empty shards are dropped.
+
+    @param durations dict of test name to expected seconds
+    """
+    durations = durations or {}
+    groups = sorted(group_by_class(test_ids).values(),
+                    key=lambda group: sum(durations.get(test_id, 1) for test_id in group),
+                    reverse=True)
+
+    shards = [[] for _ in range(workers)]
+    loads = [(0, worker) for worker in range(workers)]
+    for group in groups:
+        load, worker = heapq.heappop(loads)
+        shards[worker].extend(group)
+        heapq.heappush(loads, (load + sum(durations.get(test_id, 1) for test_id in group), worker))
+    return [shard for shard in shards if shard]
+
+
+def load_timings(timing_db):
+    """
+    Returns the {test name: seconds} mapping stored in timing_db, or an empty
+    dict if it doesn't exist yet.
+    """
+    if not os.path.exists(timing_db):
+        return {}
+    with open(timing_db) as f:
+        return json.load(f)
+
+
+def record_timings(timing_db, report_file):
+    """
+    Updates timing_db with the duration of every test in the xunit report.
+    nose times each test from before setUp to after tearDown, so cluster
+    creation and removal are included.
+    """
+    timings = load_timings(timing_db)
+    for case in ElementTree.parse(report_file).getroot().iter('testcase'):
+        timings[nose_name_from_xunit_case(case)] = float(case.get('time', 0))
+    with open(timing_db, 'w') as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+    return timings
+
+
+def _module_path(test_id):
+    return test_id.partition(':')[0].replace('.', os.sep) + '.py'
+
+
+def estimate_durations(test_ids, timings):
+    """
+    Returns expected seconds for each test name: the recorded time if there
+    is one, otherwise the test's share of its module's file size, converted
+    to seconds at the rate observed for tests that do have timings.
+    """
+    module_counts = {}
+    for test_id in test_ids:
+        module_counts[_module_path(test_id)] = module_counts.get(_module_path(test_id), 0) + 1
+
+    def size_share(test_id):
+        path = _module_path(test_id)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return float(size) / module_counts[path]
+
+    known = [test_id for test_id in test_ids if test_id in timings]
+    known_share = sum(size_share(test_id) for test_id in known)
+    if known_share:
+        seconds_per_byte = sum(timings[test_id] for test_id in known) / known_share
+    else:
+        seconds_per_byte = DEFAULT_SECONDS_PER_BYTE
+
+    return {test_id: timings[test_id] if test_id in timings else size_share(test_id) * seconds_per_byte
+            for test_id in test_ids}
+
+
+def merge_xunit_reports(report_files, merged_file):
+    """
+    Combines the nose xunit reports written by each worker into a single
+    testsuite in merged_file. Missing reports (e.g. from a worker that
+    crashed before writing one) are skipped.
+    """
+    counters = ('tests', 'errors', 'failures', 'skip')
+    totals = dict.fromkeys(counters, 0)
+    merged = ElementTree.Element('testsuite', name='nosetests')
+
+    for report_file in report_files:
+        if not os.path.exists(report_file):
+            continue
+        suite = ElementTree.parse(report_file).getroot()
+        for counter in counters:
+            totals[counter] += int(suite.get(counter, 0))
+        merged.extend(list(suite))
+
+    for counter in counters:
+        merged.set(counter, str(totals[counter]))
+    ElementTree.ElementTree(merged).write(merged_file, encoding='UTF-8', xml_declaration=True)
+    return totals
+
+
+def collect_nose_names(script_name, nose_argv, debug=_noop):
+    """
+    Runs nose in collect-only mode and returns the names of all the tests it
+    would run, in order.
+    """
+    collect_file = NamedTemporaryFile(dir=getcwd(), suffix='.xml')
+    cmd_list = (['python', script_name] + nose_argv +
+                ['--collect-only', '--with-xunit', '--xunit-file={}'.format(collect_file.name)])
+    debug('collecting tests with {cmd_list}'.format(cmd_list=cmd_list))
+    with open(os.devnull, 'w') as devnull:
+        subprocess.call(cmd_list, stdout=devnull, stderr=devnull)
+    if not os.path.getsize(collect_file.name):
+        raise RuntimeError('nose did not report any tests; try running {} directly'.format(' '.join(cmd_list)))
+    return [nose_name_from_xunit_case(case) for case in
+            ElementTree.parse(collect_file.name).getroot().iter('testcase')]
+
+
+def run_sharded(script_name, nose_argv, test_list, workers, timing_db, debug=_noop, output=_noop):
+    """
+    Runs the tests named by nose_argv and test_list in `workers` concurrent
+    nose processes, each with its own DTEST_WORKER_ID, then merges their
+    xunit reports and records the test durations in timing_db. Returns the
+    highest exit code among the workers.
+    """
+    test_ids = collect_nose_names(script_name, nose_argv + test_list, debug=debug)
+    durations = estimate_durations(test_ids, load_timings(timing_db))
+    shards = shard_by_class(test_ids, workers, durations)
+    output('Running {} tests across {} workers'.format(len(test_ids), len(shards)))
+    for worker_id, shard in enumerate(shards, 1):
+        debug('worker {} expected to take {:.0f}s'.format(worker_id, sum(durations[test_id] for test_id in shard)))
+
+    procs, report_files = [], []
+    for worker_id, shard in enumerate(shards, 1):
+        report_file = 'nosetests-worker{}.xml'.format(worker_id)
+        out_file = 'dtest-worker{}.out'.format(worker_id)
+        report_files.append(report_file)
+
+        cmd_list = (['python', script_name] + nose_argv +
+                    ['--with-xunit', '--xunit-file={}'.format(report_file)] + shard)
+        env = dict(os.environ, DTEST_WORKER_ID=str(worker_id))
+        debug('worker {} running {} tests, output in {}'.format(worker_id, len(shard), out_file))
+        with open(out_file, 'w') as out:
+            procs.append(subprocess.Popen(cmd_list, stdout=out, stderr=subprocess.STDOUT, env=env))
+
+    results = [proc.wait() for proc in procs]
+    totals = merge_xunit_reports(report_files, MERGED_XUNIT_FILE)
+    output('Merged results into {}: {}'.format(MERGED_XUNIT_FILE, totals))
+    record_timings(timing_db, MERGED_XUNIT_FILE)
+    return max(results) if results else 0
+
+
 if __name__ == '__main__':
     options = docopt(__doc__)
     validated_options = validate_and_serialize_options(options)
+    workers = _validate_workers(options['--workers'])
+    if workers.error_messages:
+        raise ValueError('Validation error:\n{}'.format('\t\n'.join(list(workers.error_messages))))
+    workers = workers.serialized
 
     nose_options = options['--nose-options'] or ''
     nose_option_list = nose_options.split()
@@ -232,6 +461,8 @@ if __name__ == '__main__':
         debug('subprocess.call-ing {cmd_list}'.format(cmd_list=cmd_list))
 
         if options['--dry-run']:
+            if workers > 1:
+                print('Would split the tests collected by the following command across {} workers:'.format(workers))
             print('Would run the following command:\n\t{}'.format(cmd_list))
             with open(temp.name, 'r') as f:
                 contents = f.read()
@@ -239,6 +470,9 @@ if __name__ == '__main__':
                 temp_name=temp.name,
                 contents=contents
             ))
+        elif workers > 1:
+            results.append(run_sharded(temp.name, nose_option_list, test_list, workers,
+                                       options['--timing-db'], debug=debug, output=output))
         else:
             results.append(subprocess.call(cmd_list))
         # separate the end of the last subprocess.call output from the
@@ -496,18 +496,22 @@ def _cql_name_builder(prefix, table_name):
 
 class TestSchemaMetadata(Tester):
 
+    # every test only changes the schema of ks, which the pool drops
+    pooled_topology = 1
+
+    def init_config(self):
+        Tester.init_config(self)
+        if self.cluster.version() >= '3.0':
+            self.cluster.set_configuration_options({'enable_user_defined_functions': 'true',
+                                                    'enable_scripted_user_defined_functions': 'true'})
+        elif self.cluster.version() >= '2.2':
+            self.cluster.set_configuration_options({'enable_user_defined_functions': 'true'})
+
     def setUp(self):
         Tester.setUp(self)
         cluster = self.cluster
         cluster.schema_event_refresh_window = 0
 
-        if cluster.version() >= '3.0':
-            cluster.set_configuration_options({'enable_user_defined_functions': 'true',
-                                               'enable_scripted_user_defined_functions': 'true'})
-        elif cluster.version() >= '2.2':
-            cluster.set_configuration_options({'enable_user_defined_functions': 'true'})
-        cluster.populate(1).start()
-
         self.session = self.patient_cql_connection(cluster.nodelist()[0])
         create_ks(self.session, 'ks', 1)
 
@@ -1,8 +1,7 @@
-import distutils.dir_util
 import glob
 import os
+import re
 import shutil
-import subprocess
 import time
 
 from cassandra.concurrent import execute_concurrent_with_args
@@ -14,9 +13,35 @@ from tools.files import replace_in_file, safe_mkdtemp
 from tools.hacks import advance_to_next_cl_segment
 from tools.misc import ImmutableMapping
 from tools.decorators import since
+from tools.sstableloader import link_file, link_tree, load_tables
+
+# a component of an sstable, e.g. mc-5-big-Data.db or ks-cf-ka-5-Data.db, as
+# (everything before the generation, generation, everything after it)
+_SSTABLE_COMPONENT = re.compile(r'^((?:.*-)?[a-z]{2}-)(\d+)(-.+)$')
+
+
+def _generation(name):
+    match = _SSTABLE_COMPONENT.match(name)
+    return int(match.group(2)) if match else 0
 
 
 class SnapshotTester(Tester):
+    """
+    Makes copies of table snapshots and restores them, the way a backup and
+    restore runbook would. Snapshot files are hard linked rather than copied
+    whenever the copy is on the same filesystem (sstables are immutable), and
+    how long each step took is kept in snapshot_timings.
+    """
+
+    def setUp(self):
+        super(SnapshotTester, self).setUp()
+        # (step, seconds, bytes) of every snapshot made and restored
+        self.snapshot_timings = []
+
+    def _record_timing(self, step, start, size):
+        elapsed = time.time() - start
+        debug("{}: {} bytes in {:.2f}s".format(step, size, elapsed))
+        self.snapshot_timings.append((step, elapsed, size))
 
     def create_schema(self, session):
         create_ks(session, 'ks', 1)
@@ -32,13 +57,16 @@ class SnapshotTester(Tester):
         node.flush()
         snapshot_cmd = 'snapshot {ks} -cf {cf} -t {name}'.format(ks=ks, cf=cf, name=name)
         debug("Running snapshot cmd: {snapshot_cmd}".format(snapshot_cmd=snapshot_cmd))
+        start = time.time()
         node.nodetool(snapshot_cmd)
+        self._record_timing('nodetool snapshot', start, 0)
         tmpdir = safe_mkdtemp()
         os.mkdir(os.path.join(tmpdir, ks))
         os.mkdir(os.path.join(tmpdir, ks, cf))
 
         # Find the snapshot dir, it's different in various C*
         x = 0
+        start, size = time.time(), 0
         for data_dir in node.data_directories():
             snapshot_dir = "{data_dir}/{ks}/{cf}/snapshots/{name}".format(data_dir=data_dir, ks=ks, cf=cf, name=name)
             if not os.path.isdir(snapshot_dir):
@@ -50,27 +78,93 @@ class SnapshotTester(Tester):
             debug("snapshot_dir is : " + snapshot_dir)
             debug("snapshot copy is : " + tmpdir)
 
-            # Copy files from the snapshot dir to existing temp dir
-            distutils.dir_util.copy_tree(str(snapshot_dir), os.path.join(tmpdir, str(x), ks, cf))
+            # Link files from the snapshot dir to existing temp dir
+            size += link_tree(str(snapshot_dir), os.path.join(tmpdir, str(x), ks, cf))
             x += 1
+        self._record_timing('snapshot copy', start, size)
 
         return tmpdir
 
-    def restore_snapshot(self, snapshot_dir, node, ks, cf):
+    def restore_snapshot(self, snapshot_dir, node, ks, cf, method='sstableloader'):
+        """
+        Restores a copy made by make_snapshot into ks.cf.
+
+        @param method 'sstableloader' streams the sstables of every data
+                      directory of the copy to the cluster, concurrently.
+                      'refresh' links them into the table directories of node
+                      and loads them with nodetool refresh, without streaming;
+                      node then owns all of the restored data.
+        """
         debug("Restoring snapshot....")
-        for x in xrange(0, self.cluster.data_dir_count):
-            snap_dir = os.path.join(snapshot_dir, str(x), ks, cf)
-            if os.path.exists(snap_dir):
-                ip = node.address()
+        snap_dirs = [os.path.join(snapshot_dir, str(x), ks, cf) for x in xrange(0, self.cluster.data_dir_count)]
+        snap_dirs = [d for d in snap_dirs if os.path.exists(d)]
+        start = time.time()
+        if method == 'sstableloader':
+            results = load_tables(node, snap_dirs)
+            for result in results:
+                if result.returncode != 0:
+                    raise Exception("sstableloader of '%s' failed; exit status: %d'; stdout: %s; stderr: %s" %
+                                    (result.table_dir, result.returncode, result.stdout, result.stderr))
+            self._record_timing('sstableloader restore', start, sum(r.size for r in results))
+        elif method == 'refresh':
+            size = self._link_into_table_dirs(snap_dirs, node, ks, cf)
+            node.nodetool('refresh {} {}'.format(ks, cf))
+            self._record_timing('refresh restore', start, size)
+        else:
+            raise ValueError("Unknown restore method: {}".format(method))
 
-                args = [node.get_tool('sstableloader'), '-d', ip, snap_dir]
-                p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                stdout, stderr = p.communicate()
-                exit_status = p.wait()
+    def _link_into_table_dirs(self, snap_dirs, node, ks, cf):
+        """
+        Links the sstables of each snapshot data directory into the table
+        directory of the same data directory of node. They are given
+        generations above those of the live sstables, so that the table
+        doesn't have to be truncated first.
 
-                if exit_status != 0:
-                    raise Exception("sstableloader command '%s' failed; exit status: %d'; stdout: %s; stderr: %s" %
-                                    (" ".join(args), exit_status, stdout, stderr))
+        @return the number of bytes linked or copied
+        """
+        table_dir_name = self._table_dir_name(node, ks, cf)
+        data_dirs = node.data_directories()
+        live_dirs = [os.path.join(d, ks, table_dir_name) for d in data_dirs]
+        generation = max([_generation(name) for d in live_dirs if os.path.isdir(d) for name in os.listdir(d)] + [0])
+        # new generation of each (snapshot data directory, generation)
+        generations = {}
+        size = 0
+        for snap_dir in snap_dirs:
+            # <snapshot_dir>/<x>/<ks>/<cf>
+            x = int(os.path.basename(os.path.dirname(os.path.dirname(snap_dir))))
+            table_dir = os.path.join(data_dirs[x % len(data_dirs)], ks, table_dir_name)
+            if not os.path.isdir(table_dir):
+                os.makedirs(table_dir)
+            for name in os.listdir(snap_dir):
+                source = os.path.join(snap_dir, name)
+                if name in ('manifest.json', 'schema.cql') or not os.path.isfile(source):
+                    continue
+                match = _SSTABLE_COMPONENT.match(name)
+                if match is not None:
+                    key = (snap_dir, match.group(2))
+                    if key not in generations:
+                        generation += 1
+                        generations[key] = generation
+                    name = '{}{}{}'.format(match.group(1), generations[key], match.group(3))
+                size += link_file(source, os.path.join(table_dir, name))
+        return size
+
+    def _table_dir_name(self, node, ks, cf):
+        """
+        Returns the name of the directory of the current ks.cf, which has its id from 2.1.
+        """
+        if self.cluster.version() < '2.1':
+            return cf
+        session = self.patient_exclusive_cql_connection(node)
+        try:
+            if self.cluster.version() >= '3.0':
+                query = "SELECT id FROM system_schema.tables WHERE keyspace_name=%s AND table_name=%s"
+            else:
+                query = "SELECT cf_id FROM system.schema_columnfamilies WHERE keyspace_name=%s AND columnfamily_name=%s"
+            table_id = session.execute(query, (ks, cf))[0][0]
+        finally:
+            session.cluster.shutdown()
+        return '{}-{}'.format(cf, table_id.hex)
 
     def restore_snapshot_schema(self, snapshot_dir, node, ks, cf):
         debug("Restoring snapshot schema....")
@@ -83,6 +177,15 @@ class SnapshotTester(Tester):
 class TestSnapshot(SnapshotTester):
 
     def test_basic_snapshot_and_restore(self):
+        self._basic_snapshot_and_restore('sstableloader')
+
+    def test_basic_snapshot_and_restore_with_refresh(self):
+        """
+        Restore a snapshot by dropping its files into the table directories and running nodetool refresh
+        """
+        self._basic_snapshot_and_restore('refresh')
+
+    def _basic_snapshot_and_restore(self, method):
         cluster = self.cluster
         cluster.populate(1).start()
         (node1,) = cluster.nodelist()
@@ -105,8 +208,9 @@ class TestSnapshot(SnapshotTester):
         self.assertEqual(rows[0][0], 0)
 
         # Restore data from snapshot:
-        self.restore_snapshot(snapshot_dir, node1, 'ks', 'cf')
-        node1.nodetool('refresh ks cf')
+        self.restore_snapshot(snapshot_dir, node1, 'ks', 'cf', method=method)
+        if method != 'refresh':
+            node1.nodetool('refresh ks cf')
         rows = session.execute('SELECT count(*) from ks.cf')
 
         # clean up
@@ -115,6 +219,30 @@ class TestSnapshot(SnapshotTester):
 
         self.assertEqual(rows[0][0], 100)
 
+    def test_restore_with_refresh_into_live_table(self):
+        """
+        Restore a snapshot with nodetool refresh into the table it was taken of, without truncating it first:
+        the snapshot sstables have the generations of live ones, and are linked in under new ones
+        """
+        cluster = self.cluster
+        cluster.populate(1).start()
+        (node1,) = cluster.nodelist()
+        session = self.patient_cql_connection(node1)
+        self.create_schema(session)
+
+        self.insert_rows(session, 0, 100)
+        snapshot_dir = self.make_snapshot(node1, 'ks', 'cf', 'live')
+        self.insert_rows(session, 50, 200)
+        node1.flush()
+        live_sstables = len(node1.get_sstables('ks', 'cf'))
+
+        self.restore_snapshot(snapshot_dir, node1, 'ks', 'cf', method='refresh')
+        shutil.rmtree(snapshot_dir)
+
+        self.assertGreater(len(node1.get_sstables('ks', 'cf')), live_sstables)
+        rows = session.execute('SELECT count(*) from ks.cf')
+        self.assertEqual(rows[0][0], 200)
+
     @since('3.0')
     def test_snapshot_and_restore_drop_table_remove_dropped_column(self):
         """
@@ -200,8 +328,8 @@ class TestArchiveCommitlog(SnapshotTester):
         for x in xrange(0, self.cluster.data_dir_count):
             tmpdir = os.path.join(base_tmpdir, str(x))
             os.mkdir(tmpdir)
-            # Copy files from the snapshot dir to existing temp dir
-            distutils.dir_util.copy_tree(os.path.join(node.get_path(), 'data{0}'.format(x), ks), tmpdir)
+            # Link files from the keyspace dir to existing temp dir
+            link_tree(os.path.join(node.get_path(), 'data{0}'.format(x), ks), tmpdir)
             tmpdirs.append(tmpdir)
 
         return tmpdirs
@@ -221,7 +349,7 @@ class TestArchiveCommitlog(SnapshotTester):
                 os.mkdir(os.path.join(data_dir, ks, cf_id))
 
                 debug("snapshot_dir is : " + snapshot_dir)
-                distutils.dir_util.copy_tree(snapshot_dir, os.path.join(data_dir, ks, cf_id))
+                link_tree(snapshot_dir, os.path.join(data_dir, ks, cf_id))
 
     def test_archive_commitlog(self):
         self.run_archive_commitlog(restore_point_in_time=False)
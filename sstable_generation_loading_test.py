@@ -1,13 +1,10 @@
 import os
-import subprocess
 import time
-from distutils import dir_util
-
-from ccmlib import common as ccmcommon
 
 from dtest import Tester, debug, create_ks, create_cf
 from tools.assertions import assert_all, assert_none, assert_one
 from tools.decorators import since
+from tools.sstableloader import link_tree, load_tables, table_dirs
 
 
 # WARNING: sstableloader tests should be added to TestSSTableGenerationAndLoading (below),
@@ -77,25 +74,19 @@ class BaseSStableLoaderTest(Tester):
                 keyspace_dir = os.path.join(data_dir, ddir)
                 if os.path.isdir(keyspace_dir) and ddir != 'system':
                     copy_dir = os.path.join(copy_root, ddir)
-                    dir_util.copy_tree(keyspace_dir, copy_dir)
+                    link_tree(keyspace_dir, copy_dir)
 
     def load_sstables(self, cluster, node, ks):
-        cdir = node.get_install_dir()
-        sstableloader = os.path.join(cdir, 'bin', ccmcommon.platform_binary('sstableloader'))
-        env = ccmcommon.make_cassandra_env(cdir, node.get_path())
-        host = node.address()
+        dirs = []
         for x in xrange(0, cluster.data_dir_count):
             sstablecopy_dir = os.path.join(node.get_path(), 'data{0}_copy'.format(x), ks.strip('"'))
-            for cf_dir in os.listdir(sstablecopy_dir):
-                full_cf_dir = os.path.join(sstablecopy_dir, cf_dir)
-                if os.path.isdir(full_cf_dir):
-                    cmd_args = [sstableloader, '--nodes', host, full_cf_dir]
-                    p = subprocess.Popen(cmd_args, stderr=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
-                    exit_status = p.wait()
-                    debug('stdout: {out}'.format(out=p.stdout))
-                    debug('stderr: {err}'.format(err=p.stderr))
-                    self.assertEqual(0, exit_status,
-                                     "sstableloader exited with a non-zero status: {}".format(exit_status))
+            dirs.extend(table_dirs(sstablecopy_dir))
+
+        for result in load_tables(node, dirs):
+            debug('stdout: {out}'.format(out=result.stdout))
+            debug('stderr: {err}'.format(err=result.stderr))
+            self.assertEqual(0, result.returncode,
+                             "sstableloader exited with a non-zero status: {}".format(result.returncode))
 
     def load_sstable_with_configuration(self, pre_compression=None, post_compression=None, ks="ks", create_schema=create_schema):
         """
@@ -7,8 +7,10 @@ from ccmlib import common
 from ccmlib.node import ToolError
 
 from dtest import Tester, debug
+from tools.compaction import wait_for_compactions
 from tools.decorators import since
 from tools.intervention import InterruptCompaction
+from tools.jmxutils import remove_perf_disable_shared_mem
 
 # These must match the stress schema names
 KeyspaceName = 'keyspace1'
@@ -54,8 +56,11 @@ class SSTableUtilTest(Tester):
         """
         log_file_name = 'debug.log'
         cluster = self.cluster
-        cluster.populate(1).start(wait_for_binary_proto=True)
+        cluster.populate(1)
         node = cluster.nodelist()[0]
+        # lets wait_for_compactions track compactions over JMX
+        remove_perf_disable_shared_mem(node)
+        cluster.start(wait_for_binary_proto=True)
 
         numrecords = 250000
 
@@ -92,7 +97,7 @@ class SSTableUtilTest(Tester):
         debug("Restarting node...")
         node.start(wait_for_binary_proto=True)
         # in some environments, a compaction may start that would change sstable files. We should wait if so
-        node.wait_for_compactions()
+        wait_for_compactions(node)
 
         finalfiles, tmpfiles = self._check_files(node, KeyspaceName, TableName)
         self.assertEqual(0, len(tmpfiles))
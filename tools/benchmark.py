@@ -0,0 +1,201 @@
+"""
+Recording of benchmark results, and measurement of the resources nodes use
+while a benchmark runs.
+
+Benchmarks are dtests decorated with tools.decorators.benchmark, which only
+run when RUN_BENCHMARKS is set. record_result appends each result as one
+JSON object per line to <BENCHMARK_RESULTS_DIR>/<suite>.jsonl, together
+with the Cassandra version and git sha it was measured on, so results of
+different builds and settings can be compared by loading those files:
+
+    {"suite": "compaction", "time": ..., "cassandra_version": "3.0.9", "cassandra_sha": "...",
+     "params": {"strategy": "LeveledCompactionStrategy", ...}, "metrics": {"elapsed": 12.3, ...}}
+
+Example usage:
+
+    with ResourceUsage(cluster.nodelist()) as usage:
+        ...
+    record_result(self.cluster, 'compaction', {'strategy': strategy}, dict(usage.metrics(), rows=rows))
+"""
+from __future__ import division
+
+import json
+import os
+import threading
+import time
+
+import psutil
+
+from dtest import BENCHMARK_RESULTS_DIR, debug
+from tools.git import cassandra_git_sha
+from tools.resource_monitor import disk_usage, node_storage_dirs
+
+
+def record_result(cluster, suite, params, metrics, results_dir=None):
+    """
+    Appends a benchmark result to the results file of suite.
+
+    @param params The settings the result was measured with, e.g. the strategy and dataset size
+    @param metrics The measurements, as a dict of name to number
+    @return the recorded result
+    """
+    results_dir = results_dir or BENCHMARK_RESULTS_DIR
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    result = {
+        'suite': suite,
+        'time': time.time(),
+        'cassandra_version': str(cluster.version()),
+        'cassandra_sha': cassandra_git_sha(cluster.get_install_dir()),
+        'params': params,
+        'metrics': metrics,
+    }
+    with open(os.path.join(results_dir, '{}.jsonl'.format(suite)), 'a') as f:
+        f.write(json.dumps(result, sort_keys=True) + '\n')
+    debug("{} benchmark {}: {}".format(suite, json.dumps(params, sort_keys=True), json.dumps(metrics, sort_keys=True)))
+    return result
+
+
+def load_results(suite, results_dir=None):
+    """
+    Returns every result recorded for suite, oldest first.
+    """
+    path = os.path.join(results_dir or BENCHMARK_RESULTS_DIR, '{}.jsonl'.format(suite))
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ResourceUsage(threading.Thread):
+    """
+    Measures the cpu time and disk io of the processes of a set of nodes,
+    and the peak disk usage of their data and commitlog directories, from
+    entering the block until leaving it. Disk usage is sampled every
+    interval seconds; cpu and io are read from the processes' counters when
+    entering and leaving, and on every sample, so they stay accurate for
+    nodes that die during the block.
+
+    @param nodes The nodes to measure. They must be running when entering the block.
+    @param interval Seconds between disk usage samples
+    """
+
+    def __init__(self, nodes, interval=1.0):
+        super(ResourceUsage, self).__init__()
+        self.daemon = True
+        self.nodes = list(nodes)
+        self.interval = interval
+        self.peak_disk_bytes = 0
+        self.elapsed = None
+        self._processes = {}
+        self._first = {}
+        self._last = {}
+        self._start = None
+        self._stop_requested = threading.Event()
+
+    @staticmethod
+    def _counters(process):
+        cpu = process.cpu_times()
+        io = process.io_counters()
+        return cpu.user + cpu.system, io.read_bytes, io.write_bytes
+
+    def _sample(self):
+        for name, process in self._processes.items():
+            try:
+                self._last[name] = self._counters(process)
+            except psutil.Error:
+                # the node died or was killed; keep its last counters
+                pass
+        self.peak_disk_bytes = max(self.peak_disk_bytes,
+                                   disk_usage([d for node in self.nodes for d in node_storage_dirs(node)]))
+
+    def __enter__(self):
+        for node in self.nodes:
+            process = psutil.Process(node.pid)
+            self._processes[node.name] = process
+            self._first[node.name] = self._last[node.name] = self._counters(process)
+        self._start = time.time()
+        self.start()
+        return self
+
+    def run(self):
+        while not self._stop_requested.is_set():
+            self._sample()
+            self._stop_requested.wait(self.interval)
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self._start
+        self._stop_requested.set()
+        self.join()
+        self._sample()
+
+    def _delta(self, index):
+        return sum(self._last[name][index] - self._first[name][index] for name in self._processes)
+
+    @property
+    def cpu_seconds(self):
+        return self._delta(0)
+
+    @property
+    def disk_read_bytes(self):
+        return self._delta(1)
+
+    @property
+    def disk_written_bytes(self):
+        return self._delta(2)
+
+    def metrics(self):
+        """
+        Returns the measurements as a dict, for record_result.
+        """
+        return {
+            'elapsed': self.elapsed,
+            'cpu_seconds': self.cpu_seconds,
+            'disk_read_bytes': self.disk_read_bytes,
+            'disk_written_bytes': self.disk_written_bytes,
+            'peak_disk_bytes': self.peak_disk_bytes,
+        }
+
+
+class ChildProcessUsage(threading.Thread):
+    """
+    Measures the peak total resident memory, and the peak number, of the
+    processes started by this one, e.g. cqlsh and its COPY worker processes,
+    from entering the block until leaving it.
+
+    @param interval Seconds between samples; short-lived workers can be missed
+                    with long intervals
+    """
+
+    def __init__(self, interval=0.1):
+        super(ChildProcessUsage, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_processes = 0
+        self._stop_requested = threading.Event()
+
+    def _sample(self):
+        rss = processes = 0
+        for child in psutil.Process(os.getpid()).children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+                processes += 1
+            except psutil.Error:
+                # exited since it was listed
+                pass
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_processes = max(self.peak_processes, processes)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def run(self):
+        while not self._stop_requested.is_set():
+            self._sample()
+            self._stop_requested.wait(self.interval)
+
+    def __exit__(self, *exc_info):
+        self._stop_requested.set()
+        self.join()
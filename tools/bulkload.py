@@ -0,0 +1,167 @@
+"""
+Pipelined loading of test data through the python driver.
+
+The helpers in tools/data.py build a CQL string per row and wait for each
+statement to finish before sending the next one, which leaves both the
+client and the cluster idle most of the time. BulkLoader prepares its
+statement once, keeps a bounded number of requests in flight, routes each
+request to a replica of its partition, and consumes rows from any
+iterable (including generators), so datasets never have to fit in memory.
+
+Example usage:
+
+    loader = BulkLoader(session, "INSERT INTO ks.cf (key, c1, c2) VALUES (?, ?, ?)")
+    stats = loader.load(('k{}'.format(i), 'value1', 'value2') for i in xrange(1000000))
+    debug(stats)
+"""
+from __future__ import division
+
+import threading
+import time
+from array import array
+
+from cassandra import ConsistencyLevel
+from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy
+from six import string_types
+
+from dtest import debug, make_execution_profile
+
+TOKEN_AWARE_PROFILE = 'bulkload_token_aware'
+
+
+class LoadStats(object):
+    """
+    Throughput and latency of a BulkLoader run. Latencies are kept in a
+    compact array of seconds, one entry per successful request.
+    """
+
+    def __init__(self):
+        self.latencies = array('d')
+        self.errors = []
+        self.error_count = 0
+        # successful requests, and seconds since the start, when the first request failed
+        self.first_error_count = None
+        self.first_error_time = None
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def throughput(self):
+        """
+        Successful requests per second.
+        """
+        return self.count / self.elapsed if self.elapsed else 0
+
+    def percentile(self, p):
+        """
+        Returns the latency, in seconds, below which p percent of the
+        successful requests completed.
+        """
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def __str__(self):
+        return ('{count} requests ({errors} errors) in {elapsed:.2f}s: {throughput:.0f} ops/s, '
+                'latency p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms max={max:.1f}ms').format(
+            count=self.count, errors=self.error_count, elapsed=self.elapsed, throughput=self.throughput,
+            p50=self.percentile(50) * 1000, p95=self.percentile(95) * 1000, p99=self.percentile(99) * 1000,
+            max=max(self.latencies or [0]) * 1000)
+
+
+class BulkLoader(object):
+    """
+    Executes one prepared statement for every row of an iterable, keeping at
+    most `concurrency` requests in flight.
+
+    @param session A driver session
+    @param query A CQL string, prepared once here, or an already prepared statement
+    @param concurrency Maximum number of requests in flight
+    @param consistency_level Consistency level of every request
+    @param token_aware Whether to send each request straight to a replica of
+           its partition. Turn this off to honour the session's own load
+           balancing policy, e.g. for exclusive connections.
+    @param max_errors Number of failed requests tolerated before load()
+           stops sending requests and raises the first error
+    """
+
+    def __init__(self, session, query, concurrency=100, consistency_level=ConsistencyLevel.QUORUM,
+                 token_aware=True, max_errors=0):
+        self.session = session
+        self.statement = session.prepare(query) if isinstance(query, string_types) else query
+        self.statement.consistency_level = consistency_level
+        self.concurrency = concurrency
+        self.max_errors = max_errors
+        self.execution_profile = self._token_aware_profile(session) if token_aware else None
+
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._stats = None
+
+    @staticmethod
+    def _token_aware_profile(session):
+        cluster = session.cluster
+        if TOKEN_AWARE_PROFILE not in cluster.profile_manager.profiles:
+            cluster.add_execution_profile(TOKEN_AWARE_PROFILE, make_execution_profile(
+                load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy())))
+        return TOKEN_AWARE_PROFILE
+
+    def _on_success(self, _, started):
+        with self._lock:
+            self._stats.latencies.append(time.time() - started)
+        self._slots.release()
+
+    def _on_error(self, exc, started):
+        with self._lock:
+            self._stats.error_count += 1
+            if self._stats.first_error_count is None:
+                self._stats.first_error_count = self._stats.count
+                self._stats.first_error_time = time.time() - self._stats.start
+            if len(self._stats.errors) < 10:
+                self._stats.errors.append(exc)
+        self._slots.release()
+
+    def _too_many_errors(self):
+        return self._stats.error_count > self.max_errors
+
+    def load(self, rows):
+        """
+        Executes the statement once for each sequence of bound values in rows
+        and waits for all requests to complete.
+
+        @return A LoadStats describing the run
+        @throws the first error seen, if more than max_errors requests failed
+        """
+        self._stats = stats = LoadStats()
+        kwargs = {'execution_profile': self.execution_profile} if self.execution_profile else {}
+
+        for row in rows:
+            self._slots.acquire()
+            if self._too_many_errors():
+                self._slots.release()
+                break
+            started = time.time()
+            future = self.session.execute_async(self.statement, row, **kwargs)
+            future.add_callbacks(callback=self._on_success, callback_args=(started,),
+                                 errback=self._on_error, errback_args=(started,))
+
+        # wait for the requests still in flight by taking every slot
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        for _ in range(self.concurrency):
+            self._slots.release()
+
+        stats.end = time.time()
+        debug("bulk load of {}: {}".format(self.statement.query_string, stats))
+        if self._too_many_errors():
+            raise stats.errors[0]
+        return stats
@@ -0,0 +1,189 @@
+"""
+A stand-in for the process that consumes a node's CDC log.
+
+Cassandra stops accepting writes to CDC tables once the CDC segments it
+keeps, in cdc_raw and still being written, take cdc_total_space_in_mb. In
+production a consumer reads the segments in cdc_raw and deletes them, which
+frees that space again. CDCConsumer does the same for a test: it tails a
+cdc_raw directory, reads the header and then the whole of every complete
+segment, at most bytes_per_second, and deletes it.
+
+From 4.0, segments are linked into cdc_raw when they are created and each
+has a <segment>_cdc.idx file that ends with COMPLETED once the segment is
+done; with indexed=True only those segments are consumed, and their index
+is deleted with them. Before 4.0, segments are only moved to cdc_raw once
+they are complete.
+
+Example usage:
+
+    with CDCConsumer(os.path.join(node.get_path(), 'cdc_raw'), bytes_per_second=1024 * 1024) as consumer:
+        ...
+    debug(consumer.stats())
+"""
+from __future__ import division
+
+import json
+import os
+import re
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from dtest import debug
+from tools.resource_monitor import disk_usage
+
+_SEGMENT_NAME = re.compile(r'CommitLog-(\d+)-(\d+)\.log$')
+_READ_SIZE = 64 * 1024
+
+CommitLogDescriptor = namedtuple('CommitLogDescriptor', ['version', 'id', 'parameters'])
+
+
+def read_descriptor(f):
+    """
+    Reads the header of a commitlog segment from the start of file f.
+
+    @return a CommitLogDescriptor; parameters are the compression and
+            encryption settings of segments of version 5 (2.2) and later
+    """
+    version, segment_id = struct.unpack('>iq', f.read(12))
+    parameters = {}
+    if version >= 5:
+        length = struct.unpack('>H', f.read(2))[0]
+        if length:
+            parameters = json.loads(f.read(length))
+    # the header's crc
+    f.read(4)
+    return CommitLogDescriptor(version, segment_id, parameters)
+
+
+def cdc_index_path(segment_path):
+    return segment_path[:-len('.log')] + '_cdc.idx'
+
+
+class CDCConsumer(threading.Thread):
+    """
+    Consumes the segments of a cdc_raw directory, oldest first, until stopped.
+
+    @param cdc_raw_dir The cdc_raw directory of a node
+    @param bytes_per_second How fast segments are read, or None to read them
+                            as fast as possible
+    @param indexed Whether segments have _cdc.idx files marking them complete (4.0 and later)
+    @param interval Seconds between looks at the directory when it has nothing to consume
+    """
+
+    def __init__(self, cdc_raw_dir, bytes_per_second=None, indexed=False, interval=0.1):
+        super(CDCConsumer, self).__init__()
+        self.daemon = True
+        self.cdc_raw_dir = cdc_raw_dir
+        self.bytes_per_second = bytes_per_second
+        self.indexed = indexed
+        self.interval = interval
+        self.segments_consumed = 0
+        self.bytes_consumed = 0
+        self.peak_backlog_bytes = 0
+        self.failure = None
+        self._read_until = 0
+        self._stop_requested = threading.Event()
+
+    def complete_segments(self):
+        """
+        Returns the paths of the segments that can be consumed, oldest first.
+        """
+        segments = []
+        for name in os.listdir(self.cdc_raw_dir):
+            match = _SEGMENT_NAME.match(name)
+            if match is None:
+                continue
+            path = os.path.join(self.cdc_raw_dir, name)
+            if self.indexed and not self._completed(path):
+                continue
+            segments.append((int(match.group(2)), path))
+        return [path for _, path in sorted(segments)]
+
+    @staticmethod
+    def _completed(path):
+        try:
+            with open(cdc_index_path(path)) as f:
+                return 'COMPLETED' in f.read().split()
+        except IOError:
+            return False
+
+    def _throttle(self, size):
+        """
+        Counts size more bytes as read, and waits until reading them is
+        within bytes_per_second.
+        """
+        self.bytes_consumed += size
+        if self.bytes_per_second:
+            # time spent idle doesn't allow reading faster later
+            self._read_until = max(self._read_until, time.time()) + size / self.bytes_per_second
+            delay = self._read_until - time.time()
+            if delay > 0:
+                self._stop_requested.wait(delay)
+
+    def consume(self, path):
+        """
+        Reads a segment, at most bytes_per_second, and deletes it. A segment
+        whose reading is interrupted by stop() is left in place.
+        """
+        with open(path, 'rb') as f:
+            read_descriptor(f)
+            self._throttle(f.tell())
+            while not self._stop_requested.is_set():
+                data = f.read(_READ_SIZE)
+                if not data:
+                    break
+                self._throttle(len(data))
+            else:
+                return
+        os.remove(path)
+        if self.indexed:
+            os.remove(cdc_index_path(path))
+        self.segments_consumed += 1
+
+    def run(self):
+        try:
+            while not self._stop_requested.is_set():
+                self.peak_backlog_bytes = max(self.peak_backlog_bytes, disk_usage([self.cdc_raw_dir]))
+                segments = self.complete_segments()
+                for path in segments:
+                    if self._stop_requested.is_set():
+                        break
+                    self.consume(path)
+                if not segments:
+                    self._stop_requested.wait(self.interval)
+        except Exception as e:
+            debug("CDC consumer of {} failed: {}".format(self.cdc_raw_dir, e))
+            self.failure = e
+
+    def stop(self):
+        """
+        Stops consuming and raises the error the consumer failed with, if any.
+        """
+        self._stop_requested.set()
+        self.join()
+        if self.failure is not None:
+            raise self.failure
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.stop()
+        else:
+            # don't hide the error the block failed with
+            self._stop_requested.set()
+            self.join()
+
+    def stats(self):
+        """
+        Returns the consumer's counters as a dict, e.g. for tools.benchmark.record_result.
+        """
+        return {
+            'consumed_segments': self.segments_consumed,
+            'consumed_bytes': self.bytes_consumed,
+            'peak_cdc_raw_bytes': self.peak_backlog_bytes,
+        }
@@ -0,0 +1,215 @@
+"""
+Tracking of compactions, for waiting until a node is done compacting.
+
+Waiting with `nodetool compactionstats` launches a JVM on every check, and
+loops that check back to back keep a core busy next to the node under test.
+CompactionTracker reads the CompactionManager's pending and active
+compactions over the node's attached Jolokia agent instead, one bulk read
+per check, and backs off between checks. Tests that wait for compactions
+should call remove_perf_disable_shared_mem before starting their nodes:
+when a node runs with -XX:+PerfDisableSharedMem the agent can't be
+attached, so the tracker falls back to compactionstats, still with backoff.
+
+Example usage:
+
+    tracker = CompactionTracker(node1)
+    node1.flush()
+    tracker.wait_for_table('ks', 'cf')
+    wait_for_compactions(cluster.nodelist())
+"""
+import re
+from collections import namedtuple
+
+from dtest import debug
+from tools.jmxutils import attached_agent, make_mbean
+from tools.parallel import on_nodes
+from tools.readiness import wait_until
+
+COMPACTION_MANAGER = make_mbean('db', type='CompactionManager')
+PENDING_TASKS = (make_mbean('metrics', type='Compaction', name='PendingTasks'), 'Value')
+COMPLETED_TASKS = (make_mbean('metrics', type='Compaction', name='CompletedTasks'), 'Value')
+
+_PENDING = re.compile(r'pending tasks: (\d+)')
+# columns of the table of active compactions; values are left aligned under
+# their header, but may be separated by a single space
+_COLUMNS = ('id', 'compaction type', 'keyspace', 'column family', 'table', 'completed', 'total', 'unit', 'progress')
+
+# nodes, by (address, pid), that the Jolokia agent couldn't be attached to
+_no_agent = set()
+
+CompactionHistoryEntry = namedtuple('CompactionHistoryEntry', ('id', 'keyspace', 'table', 'compacted_at', 'bytes_in', 'bytes_out'))
+CompactionProgress = namedtuple('CompactionProgress', ('id', 'keyspace', 'table', 'task_type', 'completed', 'total', 'unit'))
+
+
+class CompactionStatus(namedtuple('CompactionStatus', ('pending', 'active', 'completed'))):
+    """
+    Pending task count, CompactionProgress of each active compaction, and
+    completed task count (None when read from nodetool) of a node.
+    """
+
+    @property
+    def idle(self):
+        return self.pending == 0 and not self.active
+
+    def for_table(self, keyspace, table):
+        return [c for c in self.active if c.keyspace == keyspace and c.table == table]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        # e.g. human readable sizes
+        return 0
+
+
+def _progress(compaction):
+    return CompactionProgress(
+        id=compaction.get('compactionId', compaction.get('id')),
+        keyspace=compaction.get('keyspace'),
+        table=compaction.get('columnfamily'),
+        task_type=compaction.get('taskType', compaction.get('compactionType')),
+        completed=_int(compaction.get('completed')),
+        total=_int(compaction.get('total')),
+        unit=compaction.get('unit'))
+
+
+def parse_compactionstats(output):
+    """
+    Returns the CompactionStatus described by the output of nodetool compactionstats.
+    """
+    match = _PENDING.search(output)
+    active = []
+    columns = None
+    for line in output.splitlines():
+        if columns is None:
+            if 'compaction type' in line:
+                starts = sorted((line.index(name), name) for name in _COLUMNS if name in line)
+                columns = [(name, start, end) for (start, name), (end, _) in zip(starts, starts[1:] + [(None, None)])]
+        elif line.strip() and not line.startswith('Active compaction remaining time'):
+            row = dict((name, line[start:end].strip()) for name, start, end in columns)
+            active.append(CompactionProgress(
+                id=row.get('id'), keyspace=row.get('keyspace'), table=row.get('table', row.get('column family')),
+                task_type=row.get('compaction type'), completed=_int(row.get('completed')),
+                total=_int(row.get('total')), unit=row.get('unit')))
+    return CompactionStatus(int(match.group(1)) if match else 0, active, None)
+
+
+class CompactionTracker(object):
+    """
+    Reads the compaction state of a node, and waits for compactions to finish.
+
+    @param node The node to track
+    @param use_jmx Whether to try reading over JMX before falling back to nodetool
+    """
+
+    def __init__(self, node, use_jmx=True):
+        self.node = node
+        self.use_jmx = use_jmx
+        self._last_active = {}
+
+    def _agent(self):
+        key = (self.node.network_interfaces['binary'][0], self.node.pid)
+        if not self.use_jmx or key in _no_agent:
+            return None
+        try:
+            return attached_agent(self.node)
+        except Exception as e:
+            debug("Can't attach to {} over JMX, using nodetool compactionstats: {}".format(self.node.name, e))
+            _no_agent.add(key)
+            return None
+
+    def _table_metric(self, keyspace, table):
+        metric_type = 'ColumnFamily' if self.node.get_cassandra_version() < '3.0' else 'Table'
+        return (make_mbean('metrics', type=metric_type, keyspace=keyspace, scope=table, name='PendingCompactions'), 'Value')
+
+    def status(self):
+        """
+        Returns the current CompactionStatus of the node.
+        """
+        agent = self._agent()
+        if agent is None:
+            return parse_compactionstats(self.node.nodetool('compactionstats').stdout)
+
+        pending, compactions, completed = agent.read_attributes([PENDING_TASKS, (COMPACTION_MANAGER, 'Compactions'), COMPLETED_TASKS])
+        return CompactionStatus(pending, [_progress(c) for c in compactions], completed)
+
+    def events(self):
+        """
+        Returns the compactions that started and those that finished since
+        the last call, as two lists of CompactionProgress.
+        """
+        active = dict((c.id, c) for c in self.status().active)
+        started = [c for id, c in active.items() if id not in self._last_active]
+        finished = [c for id, c in self._last_active.items() if id not in active]
+        self._last_active = active
+        return started, finished
+
+    def wait_for_idle(self, timeout=600):
+        """
+        Waits until the node has no pending or active compactions.
+        """
+        last = []
+
+        def idle():
+            last[:] = [self.status()]
+            return last[0].idle
+
+        wait_until(idle, "compactions to finish on {}".format(self.node.name), timeout=timeout,
+                   interval=0.1, max_interval=2, diagnostics=lambda: last[0] if last else None)
+
+    def wait_for_table(self, keyspace, table, timeout=600):
+        """
+        Waits until a table has no pending or active compactions, ignoring
+        other tables. Needs JMX; without it, waits for the whole node.
+        """
+        agent = self._agent()
+        if agent is None:
+            return self.wait_for_idle(timeout)
+
+        last = []
+
+        def done():
+            pending, compactions = agent.read_attributes([self._table_metric(keyspace, table), (COMPACTION_MANAGER, 'Compactions')])
+            last[:] = [(pending, [_progress(c) for c in compactions])]
+            return pending == 0 and not [c for c in last[0][1] if c.keyspace == keyspace and c.table == table]
+
+        wait_until(done, "compactions of {}.{} to finish on {}".format(keyspace, table, self.node.name), timeout=timeout,
+                   interval=0.1, max_interval=2, diagnostics=lambda: last[0] if last else None)
+
+    def wait_for_completed(self, count, since, timeout=600):
+        """
+        Waits until count more compaction tasks completed than `since`, a
+        completed count from a previous status(). Needs JMX.
+        """
+        if self._agent() is None:
+            raise ValueError("Counting completed compactions needs JMX")
+        wait_until(lambda: self.status().completed >= since + count,
+                   "{} compactions to complete on {}".format(count, self.node.name), timeout=timeout,
+                   interval=0.1, max_interval=2, diagnostics=self.status)
+
+
+def wait_for_compactions(nodes, timeout=600):
+    """
+    Waits until none of nodes has pending or active compactions, checking
+    the nodes in parallel.
+    """
+    if not isinstance(nodes, (list, tuple)):
+        nodes = [nodes]
+    on_nodes([n for n in nodes if n.is_running()], lambda node: CompactionTracker(node).wait_for_idle(timeout))
+
+
+def compaction_history(session, keyspace, table, exclude=()):
+    """
+    Returns the CompactionHistoryEntry of every finished compaction of a
+    table recorded in system.compaction_history of the node session is
+    connected to, oldest first.
+
+    @param exclude ids of entries to leave out, e.g. those recorded before
+                   a benchmark started
+    """
+    rows = session.execute("SELECT id, keyspace_name, columnfamily_name, compacted_at, bytes_in, bytes_out "
+                           "FROM system.compaction_history")
+    entries = [CompactionHistoryEntry(*row) for row in rows
+               if row[1] == keyspace and row[2] == table and row[0] not in exclude]
+    return sorted(entries, key=lambda e: e.compacted_at)
@@ -5,7 +5,7 @@ from distutils.version import LooseVersion
 from nose.plugins.attrib import attr
 from nose.tools import assert_in, assert_is_instance
 
-from dtest import DISABLE_VNODES
+from dtest import DISABLE_VNODES, RUN_BENCHMARKS
 
 
 class since(object):
@@ -61,6 +61,17 @@ def no_vnodes():
     return unittest.skipIf(not DISABLE_VNODES, 'Test disabled for vnodes')
 
 
+def benchmark(f):
+    """
+    Marks a test as a benchmark. Benchmarks only run when RUN_BENCHMARKS is
+    set, and are tagged with the 'benchmark' attribute, so they can be run
+    on their own with:
+
+        $ RUN_BENCHMARKS=true nosetests -a benchmark
+    """
+    return attr('benchmark')(unittest.skipIf(not RUN_BENCHMARKS, 'Benchmarks only run with RUN_BENCHMARKS=true')(f))
+
+
 def known_failure(failure_source, jira_url, flaky=False, notes=''):
     """
     Tag a test as a known failure. Associate it with the URL for a JIRA
@@ -0,0 +1,190 @@
+"""
+Cache of populated cluster data, so tests that need the same large dataset
+don't each have to generate it with stress or insert loops.
+
+The first test to ask for a dataset runs the population function, then
+stops the cluster and saves every node's data directories and commitlogs
+under FIXTURE_CACHE_DIR. Later tests with the same Cassandra build,
+topology and population function get their nodes' directories restored
+from the cache with hardlinks before the cluster starts, which takes well
+under a second regardless of the dataset size.
+
+Example usage:
+
+    def populate(tester):
+        session = tester.patient_cql_connection(tester.cluster.nodelist()[0])
+        create_ks(session, 'ks', 3)
+        create_c1c2_table(tester, session)
+        insert_c1c2(session, n=100000)
+
+    cluster = self.cluster
+    cluster.populate(3)
+    start_with_fixture(self, 'c1c2_100k', populate)
+"""
+import errno
+import hashlib
+import inspect
+import json
+import os
+import shutil
+
+from dtest import DISABLE_VNODES, debug, get_sha
+
+FIXTURE_CACHE_DIR = os.environ.get('DTEST_FIXTURE_CACHE_DIR', os.path.expanduser(os.path.join('~', '.dtest-fixtures')))
+COMPLETE_MARKER = 'COMPLETE'
+
+
+def fixture_key(cluster, name, populate_fn):
+    """
+    Returns the name of the cache directory for a dataset. It depends on
+    everything that affects what ends up on disk: the Cassandra version and
+    git sha (if any), the cluster topology and token allocation, the
+    addresses of the nodes (which the system tables record, and which
+    differ between parallel workers), the cluster's configuration options,
+    and the name and source code of the population function, so editing the
+    function invalidates its cached data.
+    """
+    try:
+        source = inspect.getsource(populate_fn)
+    except (IOError, TypeError):
+        source = ''
+
+    parts = [
+        str(cluster.version()),
+        str(get_sha(cluster.get_install_dir())),
+        ','.join('{}:{}'.format(node.name, node.data_center) for node in cluster.nodelist()),
+        json.dumps(dict((node.name, node.network_interfaces) for node in cluster.nodelist()), sort_keys=True),
+        json.dumps(cluster._config_options, sort_keys=True, default=str),
+        str(DISABLE_VNODES),
+        '{}.{}'.format(populate_fn.__module__, populate_fn.__name__),
+        source,
+    ]
+    digest = hashlib.sha1('\n'.join(parts)).hexdigest()[:16]
+    return '{}-{}'.format(name, digest)
+
+
+def _node_dirs(node):
+    """
+    Returns (name, path) pairs for the directories of a node that make up its
+    dataset. Names are relative to the node's entry in the cache.
+    """
+    dirs = [('data{}'.format(i), data_dir) for i, data_dir in enumerate(node.data_directories())]
+    dirs.append(('commitlogs', os.path.join(node.get_path(), 'commitlogs')))
+    return dirs
+
+
+def _link_or_copy(src, dst, link):
+    """
+    Hardlinks src to dst, or copies it when link is False or src and dst are
+    on different filesystems.
+    """
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    shutil.copy2(src, dst)
+
+
+def _replicate_tree(src, dst, link):
+    """
+    Recreates the directory tree at src under dst, linking or copying files.
+    Sstables are never modified in place, so linking them is safe; commitlog
+    segments can be written to, so they must be copied.
+    """
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+        for filename in filenames:
+            _link_or_copy(os.path.join(dirpath, filename), os.path.join(target_dir, filename), link)
+
+
+def _clear_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+
+def save_fixture(cluster, fixture_dir):
+    """
+    Saves the data directories and commitlogs of every node of a stopped
+    cluster in fixture_dir.
+    """
+    tmp_dir = fixture_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    for node in cluster.nodelist():
+        for name, path in _node_dirs(node):
+            if os.path.exists(path):
+                _replicate_tree(path, os.path.join(tmp_dir, node.name, name), link=(name != 'commitlogs'))
+
+    open(os.path.join(tmp_dir, COMPLETE_MARKER), 'w').close()
+    # the rename makes a fixture visible only once it is complete, so
+    # concurrent workers never see a partially written one
+    try:
+        os.rename(tmp_dir, fixture_dir)
+    except OSError:
+        # another worker saved the same fixture first
+        shutil.rmtree(tmp_dir)
+
+
+def restore_fixture(cluster, fixture_dir):
+    """
+    Replaces the data directories and commitlogs of every node of a stopped
+    cluster with the ones saved in fixture_dir.
+    """
+    for node in cluster.nodelist():
+        for name, path in _node_dirs(node):
+            _clear_dir(path)
+            saved = os.path.join(fixture_dir, node.name, name)
+            if os.path.exists(saved):
+                _replicate_tree(saved, path, link=(name != 'commitlogs'))
+
+
+def start_with_fixture(tester, name, populate_fn, **start_kwargs):
+    """
+    Starts tester.cluster with the dataset produced by populate_fn(tester).
+
+    The cluster must be populated but not yet started. If the dataset is in
+    the cache, it is restored before starting the cluster; otherwise
+    populate_fn is called on the started cluster, and the resulting data is
+    drained to disk and saved for next time.
+
+    Because the system keyspaces are saved along with the dataset, the
+    restored nodes come back with the tokens, host ids and schema they had
+    when the dataset was saved, exactly as if the original cluster had been
+    restarted.
+
+    @param name A name for the dataset, used as a prefix of its cache directory
+    @param populate_fn A function taking the tester, which writes the dataset
+    @param start_kwargs Passed to cluster.start
+    @return True if the dataset was restored from the cache
+    """
+    cluster = tester.cluster
+    start_kwargs.setdefault('wait_for_binary_proto', True)
+    fixture_dir = os.path.join(FIXTURE_CACHE_DIR, fixture_key(cluster, name, populate_fn))
+
+    if os.path.exists(os.path.join(fixture_dir, COMPLETE_MARKER)):
+        debug("restoring dataset {} from {}".format(name, fixture_dir))
+        restore_fixture(cluster, fixture_dir)
+        cluster.start(**start_kwargs)
+        return True
+
+    debug("dataset {} is not cached, generating it".format(name))
+    cluster.start(**start_kwargs)
+    populate_fn(tester)
+    cluster.drain()
+    cluster.stop()
+    try:
+        os.makedirs(FIXTURE_CACHE_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    save_fixture(cluster, fixture_dir)
+    debug("saved dataset {} to {}".format(name, fixture_dir))
+    cluster.start(**start_kwargs)
+    return False
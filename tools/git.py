@@ -20,3 +20,20 @@ def cassandra_git_branch(cdir=None):
         raise RuntimeError('Git printed error: {err}'.format(err=err))
     [current_branch_line] = [line for line in out.splitlines() if line.startswith('*')]
     return current_branch_line[1:].strip()
+
+
+def cassandra_git_sha(cdir=None):
+    '''Get the sha of the commit checked out at CASSANDRA_DIR, or None if it isn't a git checkout.
+    '''
+    cdir = CASSANDRA_DIR if cdir is None else cdir
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=cdir,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        debug('shelling out to git failed: {}'.format(e))
+        return
+
+    out, err = p.communicate()
+    if p.returncode != 0:
+        return
+    return out.strip()
@@ -0,0 +1,182 @@
+"""
+Pre-built Cassandra install directories for the versions a test run needs.
+
+Every cluster.set_install_dir(version=...) call for a git version (e.g.
+'github:apache/cassandra-3.0') makes ccm fetch the branch and check whether
+it is behind, and the first call for a version also clones and builds it,
+all while a test is running. warm_install_dirs resolves each version to a
+commit up front and builds the missing ones in parallel into a cache
+indexed by commit sha, so tests can then point ccm straight at a built
+directory with install_dir_args.
+
+Released versions (e.g. '3.0.12') never change, so they are downloaded by
+ccm into its own repository as usual, just ahead of time and in parallel.
+"""
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+from ccmlib import repository
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOG = logging.getLogger('dtest')
+
+INSTALL_CACHE_DIR = os.environ.get('DTEST_INSTALL_CACHE_DIR', os.path.expanduser(os.path.join('~', '.dtest-install-cache')))
+COMPLETE_MARKER = '.dtest-build-complete'
+MAX_WORKERS = 4
+
+_SHA = re.compile(r'^[0-9a-f]{40}$')
+
+# install directory of each version warmed by this process
+_install_dirs = {}
+
+
+def git_source(version):
+    """
+    Returns (repository, ref) for a ccm version built from git, or None for
+    released versions.
+    """
+    if version.startswith('github:'):
+        user, ref = repository.github_username_and_branch_name(version)
+        return repository.github_repo_for_user(user), ref
+    if version.startswith('git:'):
+        return repository.GIT_REPO, version.split(':', 1)[1]
+    if version.startswith('local:'):
+        return tuple(version.split(':', 1)[1].rsplit(':', 1))
+    return None
+
+
+def resolve_sha(repo, ref):
+    """
+    Returns the sha of the commit ref points to in repo, without cloning it.
+    """
+    if _SHA.match(ref):
+        return ref
+    output = subprocess.check_output(['git', 'ls-remote', repo, ref, 'refs/tags/{}^{{}}'.format(ref)])
+    shas = dict((name, sha) for sha, name in (line.split() for line in output.splitlines()))
+    # an annotated tag's peeled ^{} entry is the commit it points to
+    for name in ('refs/tags/{}^{{}}'.format(ref), 'refs/heads/{}'.format(ref), 'refs/tags/{}'.format(ref), ref):
+        if name in shas:
+            return shas[name]
+    raise ValueError("Can't find {} in {}".format(ref, repo))
+
+
+class _BuildLock(object):
+    """
+    Keeps other processes, e.g. the workers of a parallel run, from building
+    the same commit at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def _ccm_mirror(version):
+    """
+    Returns the path of the mirror ccm keeps of the repository of a git
+    version, named the way repository.clone_development names it.
+    """
+    if version.startswith('github:'):
+        name = repository.github_username_and_branch_name(version)[0]
+    elif version.startswith('git:'):
+        name = 'apache'
+    else:
+        return None
+    return os.path.join(os.path.dirname(repository.directory_name(version)), '_git_cache_' + name)
+
+
+def _build(version, repo, sha, target):
+    tmp_dir = '{}.tmp{}'.format(target, os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    clone = ['git', 'clone', '--quiet']
+    # borrow objects from ccm's own clone of the repository, if there is one
+    mirror = _ccm_mirror(version)
+    if mirror and os.path.isdir(mirror):
+        clone += ['--reference', mirror, '--dissociate']
+    try:
+        subprocess.check_call(clone + [repo, tmp_dir])
+        subprocess.check_call(['git', 'checkout', '--quiet', sha], cwd=tmp_dir)
+        repository.compile_version(version, tmp_dir, verbose=False)
+    except Exception:
+        # don't leave a clone and a partial build behind for every failure
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    open(os.path.join(tmp_dir, COMPLETE_MARKER), 'w').close()
+    os.rename(tmp_dir, target)
+
+
+def _warm(version):
+    source = git_source(version)
+    if source is None:
+        install_dir, _ = repository.setup(version)
+        return install_dir
+
+    repo, ref = source
+    sha = resolve_sha(repo, ref)
+    target = os.path.join(INSTALL_CACHE_DIR, sha)
+    if not os.path.exists(os.path.join(target, COMPLETE_MARKER)):
+        with _BuildLock(target + '.lock'):
+            if not os.path.exists(os.path.join(target, COMPLETE_MARKER)):
+                if os.path.exists(target):
+                    shutil.rmtree(target)
+                LOG.debug("Building {} ({}) in {}".format(version, sha, target))
+                _build(version, repo, sha, target)
+    return target
+
+
+def warm_install_dirs(versions, max_workers=MAX_WORKERS):
+    """
+    Makes sure every version is built, building missing ones in parallel.
+    Versions that fail to build are logged and left to ccm, so the tests
+    using them fail the usual way.
+
+    @param versions ccm version strings, e.g. '3.0.12' or 'github:apache/cassandra-3.0'
+    @return a dict of the install directory of each version that was warmed
+    """
+    versions = sorted(set(v for v in versions if v not in _install_dirs))
+    if not versions:
+        return dict(_install_dirs)
+    if not os.path.exists(INSTALL_CACHE_DIR):
+        os.makedirs(INSTALL_CACHE_DIR)
+
+    LOG.debug("Preparing install directories for {}".format(', '.join(versions)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(version, executor.submit(_warm, version)) for version in versions]
+        for version, future in futures:
+            try:
+                _install_dirs[version] = future.result()
+                LOG.debug("{} is installed in {}".format(version, _install_dirs[version]))
+            except Exception as e:
+                LOG.warning("Could not prepare an install directory for {}: {}".format(version, e))
+    return dict(_install_dirs)
+
+
+def install_dir_args(version):
+    """
+    Returns the keyword arguments for set_install_dir that select version:
+    its pre-built directory if it was warmed, or the version itself
+    otherwise.
+    """
+    if version in _install_dirs:
+        return {'install_dir': _install_dirs[version]}
+    return {'version': version}
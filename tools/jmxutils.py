@@ -1,9 +1,14 @@
+import errno
 import json
 import os
+import socket
 import subprocess
-from urllib2 import urlopen
+import threading
+import time
 
 import ccmlib.common as common
+import psutil
+from six.moves.http_client import BadStatusLine, HTTPConnection, HTTPException
 
 from dtest import warning
 from distutils.version import LooseVersion
@@ -11,6 +16,36 @@ from distutils.version import LooseVersion
 JOLOKIA_JAR = os.path.join('lib', 'jolokia-jvm-1.2.3-agent.jar')
 CLASSPATH_SEP = ';' if common.is_win() else ':'
 JVM_OPTIONS = "jvm.options"
+JOLOKIA_PORT = 8778
+
+# agents attached by this process, by (address, pid) of the node's JVM, and
+# how many started agents use each attachment. Test threads and
+# MetricSampler threads attach agents concurrently, so both are guarded by
+# _attached_lock, which is only held to read or update them. Launching the
+# agent takes a JVM start, so attaching to and detaching from a node is
+# serialized by a lock of that node only.
+_attached_agents = {}
+_attachment_counts = {}
+_attached_lock = threading.Lock()
+_node_locks = {}
+
+
+def _node_lock(key):
+    with _attached_lock:
+        return _node_locks.setdefault(key, threading.RLock())
+
+
+def _closed_while_idle(error):
+    """
+    Whether a request over a reused connection failed because the agent
+    had closed the connection before the request reached it, as opposed to
+    e.g. timing out while the agent was running it.
+    """
+    if isinstance(error, BadStatusLine):
+        # the connection was closed without an answer
+        return True
+    return (isinstance(error, socket.error) and not isinstance(error, socket.timeout) and
+            error.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED))
 
 
 def jolokia_classpath():
@@ -170,11 +205,29 @@ def remove_perf_disable_shared_mem(node):
     common.replace_in_file(conf_file, pattern, replacement)
 
 
+def agent_attachable(node):
+    """
+    Returns whether a Jolokia agent can be attached to the running node,
+    i.e. its JVM wasn't started with -XX:+PerfDisableSharedMem, without
+    launching the agent.
+    """
+    try:
+        return '-XX:+PerfDisableSharedMem' not in psutil.Process(node.pid).cmdline()
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.Error:
+        # can't tell, let the launch decide
+        return True
+
+
 class JolokiaAgent(object):
     """
     This class provides a simple way to read, write, and execute
     JMX attributes and methods through a Jolokia agent.
 
+    Requests go over a single keep-alive HTTP connection, and many
+    attributes can be read in one round trip with read_attributes.
+
     Example usage:
 
         node = cluster.nodelist()[0]
@@ -183,57 +236,137 @@ class JolokiaAgent(object):
             avg_interval = jmx.read_attribute(mbean, 'AverageIndexInterval')
             jmx.write_attribute(mbean, 'MemoryPoolCapacityInMB', 0)
             jmx.execute_method(mbean, 'redistributeSummaries')
+
+    Launching the agent costs a JVM start, so tests that talk to JMX many
+    times should use attached_agent(node) instead, which attaches the agent
+    once and leaves it attached until the node's process exits.
     """
 
     node = None
 
-    def __init__(self, node):
+    def __init__(self, node, keep_attached=False):
         self.node = node
+        self.keep_attached = keep_attached
+        self.port = JOLOKIA_PORT
+        self.timeout = 10.0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self.node.network_interfaces['binary'][0]
+
+    def _agent_key(self):
+        return (self.address, self.node.pid)
 
     def start(self):
         """
         Starts the Jolokia agent.  The process will fork from the parent
         and continue running until stop() is called.
-        """
-        args = (java_bin(),
-                '-cp', jolokia_classpath(),
-                'org.jolokia.jvmagent.client.AgentLauncher',
-                '--host', self.node.network_interfaces['binary'][0],
-                'start', str(self.node.pid))
 
-        try:
-            subprocess.check_output(args, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as exc:
-            print "Failed to start jolokia agent (command was: %s): %s" % (' '.join(args), exc)
-            print "Exit status was: %d" % (exc.returncode,)
-            print "Output was: %s" % (exc.output,)
-            raise
+        Does nothing but count one more user if this process already
+        attached an agent to the node.
+        """
+        key = self._agent_key()
+        with _node_lock(key):
+            with _attached_lock:
+                if key in _attached_agents:
+                    _attachment_counts[key] = _attachment_counts.get(key, 0) + 1
+                    if self.keep_attached:
+                        _attached_agents[key] = self
+                    return
+
+            args = (java_bin(),
+                    '-cp', jolokia_classpath(),
+                    'org.jolokia.jvmagent.client.AgentLauncher',
+                    '--host', self.address,
+                    'start', str(self.node.pid))
+
+            try:
+                subprocess.check_output(args, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as exc:
+                print "Failed to start jolokia agent (command was: %s): %s" % (' '.join(args), exc)
+                print "Exit status was: %d" % (exc.returncode,)
+                print "Output was: %s" % (exc.output,)
+                raise
+            with _attached_lock:
+                _attached_agents[key] = self
+                _attachment_counts[key] = 1
 
     def stop(self):
         """
-        Stops the Jolokia agent.
+        Stops the Jolokia agent once no other started agent uses it. An
+        agent started with keep_attached keeps using it until the node's
+        process exits, so stopping it only closes its connection.
+        """
+        self.close()
+        if self.keep_attached:
+            return
+        key = self._agent_key()
+        with _node_lock(key):
+            with _attached_lock:
+                remaining = _attachment_counts.get(key, 0) - 1
+                if remaining > 0:
+                    _attachment_counts[key] = remaining
+                    return
+
+            args = (java_bin(),
+                    '-cp', jolokia_classpath(),
+                    'org.jolokia.jvmagent.client.AgentLauncher',
+                    'stop', str(self.node.pid))
+            try:
+                subprocess.check_output(args, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as exc:
+                print "Failed to stop jolokia agent (command was: %s): %s" % (' '.join(args), exc)
+                print "Exit status was: %d" % (exc.returncode,)
+                print "Output was: %s" % (exc.output,)
+                raise
+            with _attached_lock:
+                _attached_agents.pop(key, None)
+                _attachment_counts.pop(key, None)
+
+    def close(self):
+        """
+        Closes the HTTP connection to the agent, leaving the agent running.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _post(self, request_data):
+        if self._connection is None:
+            self._connection = HTTPConnection(self.address, self.port, timeout=self.timeout)
+        self._connection.request('POST', '/jolokia/', request_data, {'Content-Type': 'application/json'})
+        response = self._connection.getresponse()
+        return response.status, response.read()
+
+    def _send(self, body):
+        """
+        Posts a request body, or a list of them, over the keep-alive
+        connection and returns the decoded response. A connection the agent
+        closed while idle is reopened once; requests that may have reached
+        the agent, e.g. ones that timed out, are never sent again, as exec
+        and write requests aren't idempotent.
         """
-        args = (java_bin(),
-                '-cp', jolokia_classpath(),
-                'org.jolokia.jvmagent.client.AgentLauncher',
-                'stop', str(self.node.pid))
-        try:
-            subprocess.check_output(args, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as exc:
-            print "Failed to stop jolokia agent (command was: %s): %s" % (' '.join(args), exc)
-            print "Exit status was: %d" % (exc.returncode,)
-            print "Output was: %s" % (exc.output,)
-            raise
-
-    def _query(self, body, verbose=True):
         request_data = json.dumps(body)
-        url = 'http://%s:8778/jolokia/' % (self.node.network_interfaces['binary'][0],)
-        response = urlopen(url, data=request_data, timeout=10.0)
-        if response.code != 200:
-            raise Exception("Failed to query Jolokia agent; HTTP response code: %d; response: %s" % (response.code, response.readlines()))
-
-        raw_response = response.readline()
-        response = json.loads(raw_response)
+        with self._lock:
+            reused = self._connection is not None
+            try:
+                status, raw_response = self._post(request_data)
+            except (HTTPException, socket.error) as e:
+                if self._connection is not None:
+                    self._connection.close()
+                self._connection = None
+                if not (reused and _closed_while_idle(e)):
+                    raise
+                status, raw_response = self._post(request_data)
+
+        if status != 200:
+            raise Exception("Failed to query Jolokia agent; HTTP response code: %d; response: %s" % (status, raw_response))
+        return json.loads(raw_response)
+
+    def _check_response(self, response, verbose=True):
         if response['status'] != 200:
             stacktrace = response.get('stacktrace')
             if stacktrace and verbose:
@@ -243,6 +376,18 @@ class JolokiaAgent(object):
             raise Exception("Jolokia agent returned non-200 status: %s" % (response,))
         return response
 
+    def _query(self, body, verbose=True):
+        return self._check_response(self._send(body), verbose=verbose)
+
+    def _bulk_query(self, bodies):
+        """
+        Sends several requests in a single round trip and returns their
+        responses, in order, without checking their status.
+        """
+        if not bodies:
+            return []
+        return self._send(list(bodies))
+
     def read_attribute(self, mbean, attribute, path=None, verbose=True):
         """
         Reads a single JMX attribute.
@@ -255,14 +400,20 @@ class JolokiaAgent(object):
         `path` is an optional string that can be used to specify sub-attributes
         for complex JMX attributes.
         """
-        body = {'type': 'read',
-                'mbean': mbean,
-                'attribute': attribute}
-        if path:
-            body['path'] = path
-        response = self._query(body, verbose=verbose)
+        response = self._query(_read_body(mbean, attribute, path), verbose=verbose)
         return response['value']
 
+    def read_attributes(self, reads, verbose=True):
+        """
+        Reads many JMX attributes in one request.
+
+        `reads` is a list of (mbean, attribute) or (mbean, attribute, path)
+        tuples. Returns the values in the same order; raises if any of the
+        reads failed.
+        """
+        responses = self._bulk_query([_read_body(*read) for read in reads])
+        return [self._check_response(response, verbose=verbose)['value'] for response in responses]
+
     def write_attribute(self, mbean, attribute, value, path=None, verbose=True):
         """
         Writes a values to a single JMX attribute.
@@ -278,12 +429,9 @@ class JolokiaAgent(object):
         for complex JMX attributes.
         """
 
-        body = {'type': 'write',
-                'mbean': mbean,
-                'attribute': attribute,
-                'value': value}
-        if path:
-            body['path'] = path
+        body = _read_body(mbean, attribute, path)
+        body['type'] = 'write'
+        body['value'] = value
         self._query(body, verbose=verbose)
 
     def execute_method(self, mbean, operation, arguments=None):
@@ -318,3 +466,107 @@ class JolokiaAgent(object):
         """ For contextmanager-style usage. """
         self.stop()
         return exc_type is None
+
+
+def _read_body(mbean, attribute, path=None):
+    body = {'type': 'read',
+            'mbean': mbean,
+            'attribute': attribute}
+    if path:
+        body['path'] = path
+    return body
+
+
+def attached_agent(node):
+    """
+    Returns a started JolokiaAgent for node that stays attached, and keeps
+    its connection, until the node's process exits, so repeated calls within
+    a test (or across tests reusing the cluster) only launch the agent once.
+    Don't use it as a context manager if you want the agent to stay attached
+    after the block; exiting the block only closes the connection.
+
+    Raises without launching the agent when it can't be attached, see
+    agent_attachable.
+    """
+    key = (node.network_interfaces['binary'][0], node.pid)
+    with _node_lock(key):
+        with _attached_lock:
+            agent = _attached_agents.get(key)
+        if agent is None or not agent.keep_attached:
+            if not agent_attachable(node):
+                raise RuntimeError("{} isn't running, or runs with -XX:+PerfDisableSharedMem "
+                                   "(see remove_perf_disable_shared_mem)".format(node.name))
+            agent = JolokiaAgent(node, keep_attached=True)
+            agent.start()
+        return agent
+
+
+# metrics commonly sampled while tests run, as name -> (mbean, attribute)
+PENDING_COMPACTIONS = ('pending_compactions', (make_mbean('metrics', type='Compaction', name='PendingTasks'), 'Value'))
+DROPPED_MUTATIONS = ('dropped_mutations', (make_mbean('metrics', type='DroppedMessage', scope='MUTATION', name='Dropped'), 'Count'))
+DROPPED_READS = ('dropped_reads', (make_mbean('metrics', type='DroppedMessage', scope='READ', name='Dropped'), 'Count'))
+READ_LATENCY_P99 = ('read_latency_p99', (make_mbean('metrics', type='ClientRequest', scope='Read', name='Latency'), '99thPercentile'))
+WRITE_LATENCY_P99 = ('write_latency_p99', (make_mbean('metrics', type='ClientRequest', scope='Write', name='Latency'), '99thPercentile'))
+DEFAULT_METRICS = (PENDING_COMPACTIONS, DROPPED_MUTATIONS, DROPPED_READS, READ_LATENCY_P99, WRITE_LATENCY_P99)
+
+
+class MetricSampler(threading.Thread):
+    """
+    Records time series of JMX metrics from a set of nodes to a file, one
+    JSON object per line and node: {"time": ..., "node": ..., <metric>: value}.
+    Every sample of a node is a single bulk read. Metrics that can't be
+    read, e.g. because the mbean doesn't exist on this version, are recorded
+    as null.
+
+    Example usage:
+
+        sampler = MetricSampler(cluster.nodelist(), 'metrics.jsonl')
+        sampler.start()
+        ...
+        sampler.stop()
+
+    @param nodes The nodes to sample. Agents are attached with attached_agent.
+    @param filename Where to write the samples
+    @param metrics A sequence of (name, (mbean, attribute[, path])) pairs
+    @param interval Seconds between samples
+    """
+
+    def __init__(self, nodes, filename, metrics=DEFAULT_METRICS, interval=1.0):
+        super(MetricSampler, self).__init__()
+        self.daemon = True
+        self.nodes = list(nodes)
+        self.filename = filename
+        self.metrics = list(metrics)
+        self.interval = interval
+        self._stop_requested = threading.Event()
+
+    def sample(self, node, agent):
+        """
+        Returns one sample of every metric of a node as a dict.
+        """
+        record = {'time': time.time(), 'node': node.name}
+        try:
+            responses = agent._bulk_query([_read_body(*read) for _, read in self.metrics])
+        except Exception as e:
+            # the node may be down for part of the test
+            responses = [{'status': None, 'error': str(e)}] * len(self.metrics)
+        for (name, _), response in zip(self.metrics, responses):
+            record[name] = response.get('value') if response.get('status') == 200 else None
+        return record
+
+    def run(self):
+        with open(self.filename, 'a') as f:
+            # always take a last sample once stop() is called
+            while True:
+                stopping = self._stop_requested.is_set()
+                for node in self.nodes:
+                    if node.is_running():
+                        f.write(json.dumps(self.sample(node, attached_agent(node))) + '\n')
+                f.flush()
+                if stopping:
+                    break
+                self._stop_requested.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self._stop_requested.set()
+        self.join(timeout)
@@ -0,0 +1,265 @@
+"""
+Incremental reading of node logs, shared by active log watching, the
+error check at the end of each test and log-waiting helpers.
+
+ccm's log helpers re-read logs from the start (or from a mark) every time
+and poll on a fixed interval. LogTailer instead remembers, for every node,
+the offset up to which its log has been read, so each byte is only read and
+matched once, and waits for the log to change using inotify when pyinotify
+is installed (requirements.txt installs it on Linux), falling back to cheap
+stat() polling when it isn't.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from ccmlib.node import TimeoutError
+from six import string_types
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+_LOG_LINE_CATEGORY = re.compile(r'(INFO|DEBUG|WARN|ERROR)')
+_LOG_LINE_TIME = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3})')
+_EXCEPTION = re.compile(r'exception')
+
+# how often to look at log sizes when inotify isn't available
+POLL_INTERVAL = 0.1
+
+_ignore_regex_cache = {}
+
+
+def ignore_patterns_regex(patterns):
+    """
+    Returns a single compiled regex matching any of patterns, or None if
+    there are no patterns. Compiled regexes are cached, so this is cheap to
+    call every time a list of patterns is needed.
+    """
+    patterns = tuple(patterns)
+    if not patterns:
+        return None
+    if patterns not in _ignore_regex_cache:
+        _ignore_regex_cache[patterns] = re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+    return _ignore_regex_cache[patterns]
+
+
+def _log_line_category(line):
+    match = _LOG_LINE_CATEGORY.search(line)
+    return match.group(0) if match else None
+
+
+def log_line_time(line):
+    """
+    Returns the time a log line was logged at, as seconds since the epoch,
+    or None if the line has no timestamp. Nodes log in local time.
+    """
+    match = _LOG_LINE_TIME.search(line)
+    if match is None:
+        return None
+    return time.mktime(time.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')) + int(match.group(2)) / 1000.0
+
+
+class _ChangeWaiter(object):
+    """
+    Blocks until one of a set of log directories changes, or a timeout
+    expires. Uses inotify when available, otherwise just sleeps for
+    POLL_INTERVAL so callers re-check file sizes.
+    """
+
+    def __init__(self):
+        self._watched = set()
+        if pyinotify is not None:
+            self._watch_manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.Notifier(self._watch_manager, default_proc_fun=pyinotify.ProcessEvent())
+        else:
+            self._notifier = None
+
+    def watch(self, directory):
+        if self._notifier is None or directory in self._watched or not os.path.isdir(directory):
+            return
+        self._watch_manager.add_watch(directory, pyinotify.IN_MODIFY | pyinotify.IN_CREATE)
+        self._watched.add(directory)
+
+    def wait(self, timeout):
+        if self._notifier is None or not self._watched:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        if self._notifier.check_events(timeout=int(timeout * 1000)):
+            self._notifier.read_events()
+            self._notifier.process_events()
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+
+
+class LogTailer(object):
+    """
+    Reads the logs of a cluster's nodes incrementally and groups ERROR
+    lines, and WARN lines mentioning exceptions, with their stack traces,
+    the way ccm's grep_log_for_errors does.
+
+    Errors before a node's error mark (see node.mark_log_for_errors) are
+    skipped. An error is only reported once the line following its stack
+    trace has been written, unless final=True is passed to new_errors.
+    """
+
+    def __init__(self, cluster, filename='system.log'):
+        self.cluster = cluster
+        self.filename = filename
+        self._offsets = {}
+        self._partial_lines = {}
+        self._open_errors = {}
+        self._waiter = _ChangeWaiter()
+        self._lock = threading.RLock()
+
+    def _log_file(self, node):
+        return os.path.join(node.get_path(), 'logs', self.filename)
+
+    def _read_new_lines(self, node):
+        """
+        Returns the complete lines appended to node's log since the last
+        call, keeping any incomplete trailing line for next time.
+        """
+        log_file = self._log_file(node)
+        self._waiter.watch(os.path.dirname(log_file))
+        if not os.path.exists(log_file):
+            return []
+
+        offset = max(self._offsets.get(node.name, 0), getattr(node, 'error_mark', 0))
+        if os.path.getsize(log_file) < offset:
+            # the log was rotated or truncated
+            offset = 0
+            self._partial_lines.pop(node.name, None)
+
+        with open(log_file) as f:
+            f.seek(offset)
+            data = f.read()
+            self._offsets[node.name] = f.tell()
+
+        data = self._partial_lines.pop(node.name, '') + data
+        lines = data.split('\n')
+        if lines[-1]:
+            self._partial_lines[node.name] = lines[-1]
+        return lines[:-1]
+
+    def new_errors(self, final=False):
+        """
+        Returns an ordered list of (node name, errors) pairs for every node
+        with errors logged since the last call, where errors is a list of
+        lists of lines, as taken by Tester._log_error_handler.
+        """
+        with self._lock:
+            result = []
+            for node in self.cluster.nodelist():
+                errors = []
+                current = self._open_errors.pop(node.name, None)
+                for line in self._read_new_lines(node):
+                    category = _log_line_category(line)
+                    if category is None:
+                        if current is not None:
+                            current.append(line)
+                        continue
+                    if current is not None:
+                        errors.append(current)
+                        current = None
+                    if category == 'ERROR' or (category == 'WARN' and _EXCEPTION.search(line)):
+                        current = [line]
+                if current is not None:
+                    if final:
+                        errors.append(current)
+                    else:
+                        self._open_errors[node.name] = current
+                if errors:
+                    result.append((node.name, errors))
+            return result
+
+    def wait_for_change(self, timeout):
+        """
+        Blocks until any watched log changes or timeout seconds pass.
+        """
+        self._waiter.wait(timeout)
+
+    def close(self):
+        self._waiter.close()
+
+
+class LogWatchThread(threading.Thread):
+    """
+    Reports errors from a LogTailer to a callback as soon as they are
+    logged. A drop-in replacement for the thread returned by ccm's
+    cluster.actively_watch_logs_for_error: the callback gets an OrderedDict
+    of node name to errors, and join() does a final scan before the thread
+    exits.
+    """
+
+    def __init__(self, tailer, on_error_call, max_wait=1):
+        super(LogWatchThread, self).__init__()
+        self.daemon = True
+        self.tailer = tailer
+        self.on_error_call = on_error_call
+        self.max_wait = max_wait
+        self._stop_requested = threading.Event()
+
+    def _scan_and_report(self, final=False):
+        errordata = self.tailer.new_errors(final=final)
+        if errordata:
+            self.on_error_call(OrderedDict(errordata))
+
+    def run(self):
+        while not self._stop_requested.is_set():
+            self._scan_and_report()
+            self.tailer.wait_for_change(self.max_wait)
+        self._scan_and_report(final=True)
+
+    def join(self, timeout=None):
+        self._stop_requested.set()
+        super(LogWatchThread, self).join(timeout)
+
+
+def watch_log_for(node, exprs, from_mark=None, timeout=600, filename='system.log'):
+    """
+    Like ccm's node.watch_log_for, but wakes up as soon as the log changes
+    instead of sleeping a second at a time, and only reads each new byte
+    once. Returns (line, match) for a single expression, or a list of them
+    when exprs is a list; raises ccm's TimeoutError after timeout seconds.
+    """
+    tofind = [exprs] if isinstance(exprs, string_types) else list(exprs)
+    remaining = [re.compile(e) for e in tofind]
+    matchings = []
+    log_file = os.path.join(node.get_path(), 'logs', filename)
+    offset = from_mark or 0
+    partial = ''
+    waiter = _ChangeWaiter()
+    deadline = time.time() + timeout
+
+    try:
+        while True:
+            waiter.watch(os.path.dirname(log_file))
+            if os.path.exists(log_file):
+                with open(log_file) as f:
+                    f.seek(offset)
+                    data = partial + f.read()
+                    offset = f.tell()
+                lines = data.split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    for regex in remaining:
+                        match = regex.search(line)
+                        if match:
+                            matchings.append((line, match))
+                            remaining.remove(regex)
+                            break
+                    if not remaining:
+                        return matchings[0] if isinstance(exprs, string_types) else matchings
+
+            if time.time() > deadline:
+                raise TimeoutError("[{}] Missing: {} in {}".format(node.name, [r.pattern for r in remaining], log_file))
+            waiter.wait(deadline - time.time())
+    finally:
+        waiter.close()
@@ -5,21 +5,22 @@ from collections import Mapping
 
 from ccmlib.node import Node
 
-from dtest import debug
+from dtest import WORKER_IP_PREFIX, debug, worker_port
 
 
 # work for cluster started by populate
 def new_node(cluster, bootstrap=True, token=None, remote_debug_port='0', data_center=None):
     i = len(cluster.nodes) + 1
+    address = '{}{}'.format(WORKER_IP_PREFIX, i)
     node = Node('node%s' % i,
                 cluster,
                 bootstrap,
-                ('127.0.0.%s' % i, 9160),
-                ('127.0.0.%s' % i, 7000),
-                str(7000 + i * 100),
+                (address, 9160),
+                (address, 7000),
+                worker_port(str(7000 + i * 100)),
                 remote_debug_port,
                 token,
-                binary_interface=('127.0.0.%s' % i, 9042))
+                binary_interface=(address, 9042))
     cluster.add(node, not bootstrap, data_center=data_center)
     return node
 
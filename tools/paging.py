@@ -1,4 +1,7 @@
+import threading
 import time
+from collections import deque
+from itertools import chain
 
 from tools.datahelp import flatten_into_set
 
@@ -20,6 +23,10 @@ class PageFetcher(object):
 
     The first page is automatically retrieved, so an initial
     call to request_one is actually getting the *second* page!
+
+    Pages can also be consumed as they arrive with iter_pages/iter_rows.
+    For very large result sets, pass keep_pages=False so retrieved pages
+    are only handed to the iterator instead of being kept in self.pages.
     """
     pages = None
     error = None
@@ -28,8 +35,13 @@ class PageFetcher(object):
     retrieved_pages = None
     retrieved_empty_pages = None
 
-    def __init__(self, future):
+    def __init__(self, future, keep_pages=True):
         self.pages = []
+        self.keep_pages = keep_pages
+        # pages not yet handed out by iter_pages
+        self._unconsumed = deque()
+        # notified whenever a page (or an error) arrives
+        self._page_arrived = threading.Condition()
 
         # the first page is automagically returned (eventually)
         # so we'll count this as a request, but the retrieved count
@@ -50,21 +62,26 @@ class PageFetcher(object):
         self.wait(seconds=30)
 
     def handle_page(self, rows):
-        # occasionally get a final blank page that is useless
-        if rows == []:
-            self.retrieved_empty_pages += 1
-            return
-
-        page = Page()
-        self.pages.append(page)
-
-        for row in rows:
-            page.add_row(row)
-
-        self.retrieved_pages += 1
+        with self._page_arrived:
+            # occasionally get a final blank page that is useless
+            if rows == []:
+                self.retrieved_empty_pages += 1
+                self._page_arrived.notify_all()
+                return
+
+            page = Page()
+            page.data = list(rows)
+            if self.keep_pages:
+                self.pages.append(page)
+            self._unconsumed.append(page)
+
+            self.retrieved_pages += 1
+            self._page_arrived.notify_all()
 
     def handle_error(self, exc):
-        self.error = exc
+        with self._page_arrived:
+            self.error = exc
+            self._page_arrived.notify_all()
         raise exc
 
     def request_one(self, timeout=None):
@@ -106,15 +123,46 @@ class PageFetcher(object):
         seconds = 5 if seconds is None else seconds
         expiry = time.time() + seconds
 
-        while time.time() < expiry:
-            if self.requested_pages == (self.retrieved_pages + self.retrieved_empty_pages):
-                return self
-            # small wait so we don't need excess cpu to keep checking
-            time.sleep(0.1)
+        with self._page_arrived:
+            while self.requested_pages != (self.retrieved_pages + self.retrieved_empty_pages):
+                remaining = expiry - time.time()
+                if remaining <= 0 or self.error is not None:
+                    raise RuntimeError(
+                        "Requested pages were not delivered before timeout. " +
+                        "Requested: {}; retrieved: {}; empty retrieved: {}; error: {}".format(
+                            self.requested_pages, self.retrieved_pages, self.retrieved_empty_pages, self.error))
+                self._page_arrived.wait(remaining)
+
+        return self
+
+    def iter_pages(self, timeout=None):
+        """
+        Yields the rows of every page not yet handed out, requesting the
+        remaining pages as it goes. The next page is requested before the
+        current one is yielded, so the driver fetches it while the caller
+        checks the current one.
+
+        @param timeout Time, in seconds, to wait for each page.
+        """
+        while True:
+            self.wait(seconds=timeout)
+            more_pages = self.future.has_more_pages
+            if more_pages:
+                self.future.start_fetching_next_page()
+                with self._page_arrived:
+                    self.requested_pages += 1
+
+            while self._unconsumed:
+                yield self._unconsumed.popleft().data
 
-        raise RuntimeError(
-            "Requested pages were not delivered before timeout. " +
-            "Requested: {}; retrieved: {}; empty retrieved: {}".format(self.requested_pages, self.retrieved_pages, self.retrieved_empty_pages))
+            if not more_pages:
+                return
+
+    def iter_rows(self, timeout=None):
+        """
+        Yields rows one at a time from iter_pages.
+        """
+        return chain.from_iterable(self.iter_pages(timeout=timeout))
 
     def pagecount(self):
         """
@@ -147,11 +195,7 @@ class PageFetcher(object):
 
         The page(s) should have already been requested with request_one and/or request_all.
         """
-        all_pages_combined = []
-        for page in self.pages:
-            all_pages_combined.extend(page.data[:])
-
-        return all_pages_combined
+        return list(chain.from_iterable(page.data for page in self.pages))
 
     @property  # make property to match python driver api
     def has_more_pages(self):
@@ -0,0 +1,122 @@
+"""
+Runs operations on several nodes at once.
+
+Every nodetool call launches a JVM and nodes start, flush and drain
+independently of each other, so looping over a cluster's nodes one at a
+time wastes most of the time waiting. The helpers here run the same
+operation on each node in a thread pool and collect the result, or the
+error, of every node.
+
+Example usage:
+
+    nodetool_on_nodes(cluster.nodelist(), 'replaybatchlog')
+    flush_nodes(cluster.nodelist(), 'ks', 'cf')
+    results = on_nodes(cluster.nodelist(), lambda node: node.nodetool('status'), raise_errors=False)
+    debug(results.errors)
+"""
+from collections import OrderedDict
+
+from concurrent.futures import ThreadPoolExecutor
+
+# more threads than this just compete for cpu with the nodes' JVMs
+MAX_WORKERS = 16
+
+
+class NodeOperationError(Exception):
+    """
+    Raised when an operation failed on one or more nodes. `errors` maps the
+    names of the nodes that failed to their exceptions, and `results` holds
+    the results of the nodes that succeeded.
+    """
+
+    def __init__(self, errors, results):
+        message = "Operation failed on {}: {}".format(
+            ', '.join(errors), '; '.join('{}: {!r}'.format(name, e) for name, e in errors.items()))
+        super(NodeOperationError, self).__init__(message)
+        self.errors = errors
+        self.results = results
+
+
+class NodeResults(OrderedDict):
+    """
+    The results of an operation by node name, in the order the nodes were
+    given. Nodes where the operation failed are in `errors` instead.
+    """
+
+    def __init__(self):
+        super(NodeResults, self).__init__()
+        self.errors = OrderedDict()
+
+
+def on_nodes(nodes, operation, max_workers=None, raise_errors=True):
+    """
+    Calls operation(node) for each node concurrently and waits for all of
+    the calls to finish.
+
+    @param nodes The nodes to run the operation on
+    @param operation A function taking a node
+    @param max_workers Number of threads; defaults to one per node, up to MAX_WORKERS
+    @param raise_errors Whether to raise a NodeOperationError if the operation
+           failed on any node, once every call has finished
+    @return A NodeResults of the value returned by each call
+    """
+    nodes = list(nodes)
+    results = NodeResults()
+    if not nodes:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(nodes), MAX_WORKERS)) as executor:
+        futures = [(node, executor.submit(operation, node)) for node in nodes]
+        for node, future in futures:
+            error = future.exception()
+            if error is None:
+                results[node.name] = future.result()
+            else:
+                results.errors[node.name] = error
+
+    if results.errors and raise_errors:
+        raise NodeOperationError(results.errors, results)
+    return results
+
+
+def nodetool_on_nodes(nodes, cmd, **kwargs):
+    """
+    Runs the nodetool command cmd on every node. Returns the output of each node.
+    """
+    return on_nodes(nodes, lambda node: node.nodetool(cmd), **kwargs)
+
+
+def flush_nodes(nodes, keyspace=None, *tables, **kwargs):
+    """
+    Flushes every node, optionally only the given keyspace and tables.
+    """
+    cmd = ' '.join(['flush'] + ([keyspace] if keyspace else []) + list(tables))
+    return nodetool_on_nodes(nodes, cmd, **kwargs)
+
+
+def compact_nodes(nodes, keyspace=None, *tables, **kwargs):
+    """
+    Runs a major compaction on every node, optionally only of the given keyspace and tables.
+    """
+    cmd = ' '.join(['compact'] + ([keyspace] if keyspace else []) + list(tables))
+    return nodetool_on_nodes(nodes, cmd, **kwargs)
+
+
+def drain_nodes(nodes, **kwargs):
+    return on_nodes(nodes, lambda node: node.drain(), **kwargs)
+
+
+def start_nodes(nodes, wait_for_binary_proto=True, raise_errors=True, max_workers=None, **start_kwargs):
+    """
+    Starts every node, by default waiting until they all accept CQL
+    connections. Other keyword arguments are passed to node.start.
+    """
+    start_kwargs['wait_for_binary_proto'] = wait_for_binary_proto
+    return on_nodes(nodes, lambda node: node.start(**start_kwargs), max_workers=max_workers, raise_errors=raise_errors)
+
+
+def stop_nodes(nodes, raise_errors=True, max_workers=None, **stop_kwargs):
+    """
+    Stops every node. Keyword arguments are passed to node.stop.
+    """
+    return on_nodes(nodes, lambda node: node.stop(**stop_kwargs), max_workers=max_workers, raise_errors=raise_errors)
@@ -0,0 +1,272 @@
+"""
+Validation of the partitions of a table by scanning its token ranges.
+
+Checking a large dataset one key at a time costs a round trip per key, and
+reading a whole table with a single SELECT keeps one coordinator busy while
+every row is held in memory. RangeScanner splits the ring into token
+ranges, scans them concurrently with paging, and only records which keys
+were seen, in a bitmap indexed by the number in each key (e.g. 'k42' is
+bit 42). The result is then compared with the keys expected, and missing or
+unexpected keys are reported by token range.
+
+Example usage:
+
+    result = RangeScanner(session, 'cf').scan()
+    result.assert_keys(expected=range(2001), absent=[1000])
+"""
+from __future__ import division
+
+import re
+import threading
+from collections import namedtuple
+
+from cassandra import ConsistencyLevel
+from cassandra.query import SimpleStatement
+from concurrent.futures import ThreadPoolExecutor
+from six import string_types
+
+from tools.paging import PageFetcher
+
+# (first token, last token) of the whole ring, by partitioner; a range
+# scanned by RangeScanner excludes its start and includes its end
+RINGS = {
+    'org.apache.cassandra.dht.Murmur3Partitioner': (-2 ** 63, 2 ** 63 - 1),
+    'org.apache.cassandra.dht.RandomPartitioner': (-1, 2 ** 127),
+}
+
+# how many examples of unexpected keys to remember
+MAX_EXAMPLES = 10
+
+
+def split_ring(partitioner, count):
+    """
+    Splits the ring of partitioner into count contiguous token ranges.
+
+    @return a list of (start, end) tuples, start excluded and end included
+    """
+    if partitioner not in RINGS:
+        raise ValueError("Can't split the ring of {}".format(partitioner))
+    first, last = RINGS[partitioner]
+    bounds = [first + (last - first) * i // count for i in range(count)] + [last]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class KeyFormat(object):
+    """
+    Maps keys like 'k42' to their number and back.
+    """
+
+    def __init__(self, fmt='k{}'):
+        self.fmt = fmt
+        prefix, suffix = fmt.split('{}')
+        self._pattern = re.compile('^{}([0-9]+){}$'.format(re.escape(prefix), re.escape(suffix)))
+
+    def index_of(self, key):
+        match = self._pattern.match(key) if isinstance(key, string_types) else None
+        return int(match.group(1)) if match else None
+
+    def key_for(self, index):
+        return self.fmt.format(index)
+
+
+class KeyBitmap(object):
+    """
+    A set of non-negative integers, one bit each.
+    """
+
+    def __init__(self, indexes=()):
+        self._bits = bytearray()
+        for index in indexes:
+            self.add(index)
+
+    def add(self, index):
+        byte = index >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytearray(byte + 1 - len(self._bits)))
+        self._bits[byte] |= 1 << (index & 7)
+
+    def __contains__(self, index):
+        byte = index >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (index & 7)))
+
+    def __iter__(self):
+        for byte, bits in enumerate(self._bits):
+            if bits:
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        yield (byte << 3) | bit
+
+    def __len__(self):
+        return sum(bin(bits).count('1') for bits in self._bits)
+
+    def update(self, other):
+        if len(other._bits) > len(self._bits):
+            self._bits.extend(bytearray(len(other._bits) - len(self._bits)))
+        for byte, bits in enumerate(other._bits):
+            self._bits[byte] |= bits
+
+
+RangeStats = namedtuple('RangeStats', ('start', 'end', 'rows', 'bad_rows', 'other_keys'))
+
+
+class ScanResult(object):
+    """
+    The keys seen by a scan, overall and the number of rows by token range.
+    """
+
+    def __init__(self, scanner, ranges):
+        self.scanner = scanner
+        self.ranges = ranges
+        self.seen = KeyBitmap()
+        self.rows = 0
+        self.bad_rows = 0
+        # the first MAX_EXAMPLES keys that don't match the key format
+        self.other_keys = []
+        self.other_key_count = 0
+        self.range_stats = []
+
+    def range_of(self, index):
+        """
+        Returns the token range holding the key of the given number, or
+        None if the driver doesn't know the token map.
+        """
+        token = self.scanner.token_of(self.scanner.key_format.key_for(index))
+        if token is not None:
+            for start, end in self.ranges:
+                if start < token <= end:
+                    return start, end
+        return None
+
+    def by_range(self, indexes):
+        """
+        Groups key numbers by the token range they belong to.
+        """
+        grouped = {}
+        for index in indexes:
+            grouped.setdefault(self.range_of(index), []).append(index)
+        return grouped
+
+    def missing(self, expected):
+        return [index for index in expected if index not in self.seen]
+
+    def unexpected(self, expected):
+        expected = expected if isinstance(expected, KeyBitmap) else KeyBitmap(expected)
+        return [index for index in self.seen if index not in expected]
+
+    def assert_keys(self, expected=None, present=(), absent=(), rows=None):
+        """
+        Raises an AssertionError, listing the offending keys by token range, unless:
+
+        @param expected every key number of this iterable, and no other, was seen
+        @param present every key number of this iterable was seen
+        @param absent no key number of this iterable was seen
+        @param rows the scan returned this many rows in total
+        """
+        problems = []
+        if rows is not None and self.rows != rows:
+            problems.append("expected {} rows, got {}".format(rows, self.rows))
+        if self.bad_rows:
+            problems.append("{} rows with unexpected values".format(self.bad_rows))
+
+        missing = set(self.missing(present))
+        extra = set(index for index in absent if index in self.seen)
+        if expected is not None:
+            expected = KeyBitmap(expected)
+            missing.update(self.missing(expected))
+            extra.update(self.unexpected(expected))
+            if self.other_keys:
+                problems.append("{} unexpected keys, e.g. {}".format(self.other_key_count, self.other_keys))
+
+        for kind, indexes in (('missing', missing), ('unexpected', extra)):
+            grouped = self.by_range(sorted(indexes))
+            for token_range, in_range in sorted(grouped.items(), key=lambda item: item[0] or (0, 0)):
+                problems.append("{} {} keys in range {}: {}".format(
+                    len(in_range), kind, token_range or 'unknown',
+                    [self.scanner.key_format.key_for(i) for i in in_range[:MAX_EXAMPLES]]))
+        if problems:
+            raise AssertionError("Scan of {} doesn't match: {}".format(self.scanner.table, '; '.join(problems)))
+
+
+class RangeScanner(object):
+    """
+    Scans every partition of a table, token range by token range.
+
+    @param session A driver session connected to the table's keyspace
+    @param table The table to scan
+    @param key_column The partition key column, holding keys in key_format
+    @param columns Other columns to read, passed to row_check
+    @param row_check A function taking a row (token, key, *columns) and
+           returning whether its values are as expected
+    @param key_format A KeyFormat, or a format string like 'k{}'
+    @param split_count Number of token ranges to split the ring into
+    @param max_workers Number of ranges scanned at the same time
+    @param fetch_size Number of rows per page
+    @param page_timeout Time, in seconds, to wait for each page
+    """
+
+    def __init__(self, session, table, key_column='key', columns=(), row_check=None, key_format='k{}',
+                 split_count=32, max_workers=8, fetch_size=1000, page_timeout=60, consistency_level=ConsistencyLevel.ONE):
+        self.session = session
+        self.table = table
+        self.key_column = key_column
+        self.row_check = row_check
+        self.key_format = key_format if isinstance(key_format, KeyFormat) else KeyFormat(key_format)
+        self.split_count = split_count
+        self.max_workers = max_workers
+        self.fetch_size = fetch_size
+        self.page_timeout = page_timeout
+        self.consistency_level = consistency_level
+
+        self.query = "SELECT token({key}), {key}{columns} FROM {table} WHERE token({key}) > %s AND token({key}) <= %s".format(
+            key=key_column, columns=''.join(', ' + c for c in columns), table=table)
+        self._routing_statement = None
+        self._lock = threading.Lock()
+
+    def token_of(self, key):
+        """
+        Returns the token of a key, computed by the driver, or None if the
+        driver doesn't have the cluster's token map.
+        """
+        token_map = self.session.cluster.metadata.token_map
+        if token_map is None:
+            return None
+        if self._routing_statement is None:
+            self._routing_statement = self.session.prepare(
+                "SELECT {key} FROM {table} WHERE {key} = ?".format(key=self.key_column, table=self.table))
+        return token_map.token_class.from_key(self._routing_statement.bind([key]).routing_key).value
+
+    def _scan_range(self, result, token_range):
+        statement = SimpleStatement(self.query, consistency_level=self.consistency_level, fetch_size=self.fetch_size)
+        fetcher = PageFetcher(self.session.execute_async(statement, token_range), keep_pages=False)
+        seen = KeyBitmap()
+        rows = bad_rows = 0
+        other_keys = []
+        for row in fetcher.iter_rows(timeout=self.page_timeout):
+            rows += 1
+            index = self.key_format.index_of(row[1])
+            if index is None:
+                other_keys.append(row[1])
+            else:
+                seen.add(index)
+            if self.row_check is not None and not self.row_check(row):
+                bad_rows += 1
+
+        with self._lock:
+            result.seen.update(seen)
+            result.rows += rows
+            result.bad_rows += bad_rows
+            result.other_key_count += len(other_keys)
+            result.other_keys.extend(other_keys[:MAX_EXAMPLES - len(result.other_keys)])
+            result.range_stats.append(RangeStats(token_range[0], token_range[1], rows, bad_rows, len(other_keys)))
+
+    def scan(self):
+        """
+        Scans every token range and returns a ScanResult.
+        """
+        ranges = split_ring(self.session.cluster.metadata.partitioner, self.split_count)
+        result = ScanResult(self, ranges)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for future in [executor.submit(self._scan_range, result, token_range) for token_range in ranges]:
+                future.result()
+        result.range_stats.sort()
+        return result
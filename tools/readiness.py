@@ -0,0 +1,248 @@
+"""
+Waits for a cluster to be ready for the next step of a test, based on
+concrete signals instead of fixed sleeps:
+
+  * schema agreement, as seen by the driver's control connection,
+  * host up and down events of a driver session,
+  * the gossip state each node has of its peers, from nodetool status,
+  * native transport readiness, by connecting to the node's CQL port.
+
+A fixed sleep is either longer than needed, which adds up over a run, or
+shorter than needed, which makes tests flaky. Every wait here returns as
+soon as its condition holds, and raises a NotReadyError describing what was
+still missing when its timeout expires.
+
+Example usage:
+
+    node1.start(wait_for_binary_proto=True)
+    wait_for_gossip_normal(cluster.nodelist())
+    wait_for_hosts_up(session, cluster.nodelist())
+"""
+import logging
+import re
+import socket
+import threading
+import time
+
+from cassandra.policies import HostDistance, HostStateListener
+
+from tools.parallel import on_nodes
+
+LOG = logging.getLogger('dtest')
+
+DEFAULT_TIMEOUT = 120
+
+_STATUS_LINE = re.compile(r'^([UD][NLJM])\s+(\S+)\s', re.MULTILINE)
+
+
+class NotReadyError(AssertionError):
+    """
+    Raised when a wait times out. The message says what was being waited
+    for and the last state seen.
+    """
+
+    def __init__(self, description, timeout, state=None):
+        message = "Timed out after {}s waiting for {}".format(timeout, description)
+        if state is not None:
+            message = "{}. Last state: {}".format(message, state)
+        super(NotReadyError, self).__init__(message)
+        self.state = state
+
+
+def wait_until(check, description, timeout=DEFAULT_TIMEOUT, interval=0.05, max_interval=1, diagnostics=None):
+    """
+    Calls check until it returns a true value, backing off from interval to
+    max_interval between calls, and returns that value.
+
+    @param check A function of no arguments
+    @param description What is being waited for, for the error message
+    @param diagnostics A function returning the current state, called for
+           the error message if the wait times out
+    @throws NotReadyError if check isn't true within timeout seconds
+    """
+    deadline = time.time() + timeout
+    while True:
+        result = check()
+        if result:
+            return result
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise NotReadyError(description, timeout, diagnostics() if diagnostics else None)
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def _addresses(nodes):
+    return set(node.address() for node in nodes)
+
+
+# schema
+
+def schema_versions(session):
+    """
+    Returns the schema version of the node session's control connection is
+    connected to, and of each of its peers, by address.
+    """
+    versions = dict((str(row.peer), row.schema_version) for row in session.execute("SELECT peer, schema_version FROM system.peers"))
+    local = session.execute("SELECT broadcast_address, schema_version FROM system.local")[0]
+    versions[str(local.broadcast_address)] = local.schema_version
+    return versions
+
+
+def wait_for_schema_agreement(session, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until every live node reports the same schema version.
+    """
+    if not session.cluster.control_connection.wait_for_schema_agreement(wait_time=timeout):
+        raise NotReadyError("schema agreement", timeout, schema_versions(session))
+
+
+# driver host events
+
+class _HostEvents(HostStateListener):
+    """
+    Wakes up waiters whenever the driver marks a host up or down.
+    """
+
+    def __init__(self):
+        self.changed = threading.Condition()
+
+    def _notify(self, host):
+        with self.changed:
+            self.changed.notify_all()
+
+    on_up = on_down = on_add = on_remove = _notify
+
+
+def driver_host_states(session):
+    """
+    Returns whether the driver considers each host up, by address.
+    """
+    return dict((host.address, host.is_up) for host in session.cluster.metadata.all_hosts())
+
+
+def _ignored_addresses(session):
+    """
+    Returns the addresses of the hosts session's load balancing policy never
+    routes to, e.g. every other node for an exclusive connection. The driver
+    doesn't connect to those, so it never marks them up.
+    """
+    cluster = session.cluster
+    return set(host.address for host in cluster.metadata.all_hosts()
+               if cluster.profile_manager.distance(host) == HostDistance.IGNORED)
+
+
+def _wait_for_hosts(session, nodes, up, timeout):
+    addresses = _addresses(nodes)
+
+    def ready():
+        states = driver_host_states(session)
+        expected = addresses - _ignored_addresses(session) if up else addresses
+        return all(bool(states.get(address)) == up for address in expected)
+
+    listener = _HostEvents()
+    cluster = session.cluster
+    cluster.register_listener(listener)
+    try:
+        deadline = time.time() + timeout
+        with listener.changed:
+            while not ready():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise NotReadyError("the driver to see {} {}".format(sorted(addresses), 'up' if up else 'down'),
+                                        timeout, driver_host_states(session))
+                # the timeout covers events missed while checking
+                listener.changed.wait(min(remaining, 1))
+    finally:
+        cluster.unregister_listener(listener)
+
+
+def wait_for_hosts_up(session, nodes, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until session's driver has marked every node up, i.e. can route
+    requests to it. Nodes its load balancing policy ignores are skipped.
+    """
+    _wait_for_hosts(session, nodes, True, timeout)
+
+
+def wait_for_hosts_down(session, nodes, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until session's driver has marked every node down.
+    """
+    _wait_for_hosts(session, nodes, False, timeout)
+
+
+# gossip
+
+def gossip_states(node):
+    """
+    Returns the status and state node has of each endpoint, from nodetool
+    status, as two-letter codes by address: 'UN' for up and normal, 'DN'
+    for down and normal, 'UJ' for up and joining, etc.
+    """
+    return dict((address, state) for state, address in _STATUS_LINE.findall(node.nodetool('status').stdout))
+
+
+def wait_for_gossip_state(observers, nodes, state='UN', timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until each of observers sees every one of nodes in the given state.
+    """
+    observers = list(observers)
+    addresses = _addresses(nodes)
+    last = {}
+
+    def ready():
+        pending = [o for o in observers if any(last.get(o.name, {}).get(a) != state for a in addresses)]
+        results = on_nodes(pending, gossip_states, raise_errors=False)
+        last.update(results)
+        # e.g. JMX isn't up yet
+        last.update((name, {'error': repr(e)}) for name, e in results.errors.items())
+        return all(last[o.name].get(a) == state for o in pending for a in addresses)
+
+    wait_until(ready, "{} to see {} as {}".format([o.name for o in observers], sorted(addresses), state),
+               timeout=timeout, interval=0.5, max_interval=2, diagnostics=lambda: last)
+
+
+def wait_for_gossip_normal(nodes, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until every node sees every other one as up and normal.
+    """
+    nodes = list(nodes)
+    wait_for_gossip_state(nodes, nodes, 'UN', timeout)
+
+
+# native transport
+
+def native_transport_ready(node):
+    """
+    Returns whether node accepts connections on its native transport port.
+    """
+    address, port = node.network_interfaces['binary']
+    try:
+        socket.create_connection((address, port), timeout=1).close()
+        return True
+    except socket.error:
+        return False
+
+
+def wait_for_native_transport(nodes, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until every node accepts connections on its native transport port.
+    """
+    nodes = list(nodes)
+    wait_until(lambda: all(native_transport_ready(node) for node in nodes),
+               "native transport of {}".format([node.name for node in nodes]), timeout=timeout,
+               diagnostics=lambda: dict((node.name, native_transport_ready(node)) for node in nodes))
+
+
+def wait_for_cluster_ready(session, nodes, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until the live nodes agree on the schema, see each other as up
+    and normal, and are all up for session's driver.
+    """
+    nodes = list(nodes)
+    start = time.time()
+    wait_for_gossip_normal(nodes, timeout)
+    wait_for_hosts_up(session, nodes, timeout)
+    wait_for_schema_agreement(session, timeout)
+    LOG.debug("{} ready after {:.1f}s".format([node.name for node in nodes], time.time() - start))
@@ -0,0 +1,177 @@
+"""
+Sampling of the resources used by each node of a cluster while a test runs.
+
+ResourceMonitor follows the Cassandra process of every node of a cluster
+and records, every interval seconds, one compact JSON line per running
+node:
+
+    {"t": 12.0, "node": "node1", "pid": 1234, "cpu": 35.21, "rss": 512000000, "fds": 310,
+     "data": 1048576, "commitlog": 33554432, "gc_ms": 12.5, "gc_max_ms": 8.1}
+
+t is seconds since the monitor started, cpu the cumulative user and system
+cpu seconds of the process, rss its resident memory in bytes, fds its open
+file descriptors, data and commitlog the bytes in its data and commitlog
+directories, and gc_ms and gc_max_ms the total and longest stop-the-world
+pause since the previous sample, read from the node's gc log (which
+Cassandra writes with -XX:+PrintGCApplicationStoppedTime). Nodes are looked
+up again on every sample, so restarted, added or removed nodes are followed.
+
+Tester starts one for every test when RESOURCE_MONITOR is set, or for
+Testers with monitor_resources = True, and saves the samples next to the
+saved logs.
+
+This module is imported by dtest, so it can't import from it.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger('dtest')
+
+_GC_STOPPED = re.compile(r'Total time for which application threads were stopped: ([\d.]+) seconds')
+
+
+def disk_usage(paths):
+    """
+    Returns the total size in bytes of the files under paths. Files removed
+    while walking, e.g. sstables replaced by a compaction, are skipped.
+    """
+    total = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
+
+def commitlog_dir(node):
+    return os.path.join(node.get_path(), 'commitlogs')
+
+
+def node_storage_dirs(node):
+    """
+    Returns the data and commitlog directories of a node.
+    """
+    return list(node.data_directories()) + [commitlog_dir(node)]
+
+
+class _GCLogReader(object):
+    """
+    Reads the pauses logged to a gc log since the previous read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = ''
+
+    def new_pauses(self):
+        """
+        Returns the pauses, in milliseconds, logged since the previous call.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            # the node restarted, or the log was rotated
+            self.offset, self.partial = 0, ''
+        with open(self.path) as f:
+            f.seek(self.offset)
+            data = self.partial + f.read()
+            self.offset = f.tell()
+        lines = data.split('\n')
+        self.partial = lines.pop()
+        return [float(m.group(1)) * 1000 for m in (_GC_STOPPED.search(line) for line in lines) if m]
+
+
+class ResourceMonitor(threading.Thread):
+    """
+    Samples the resources of the nodes of a cluster to a file until stopped.
+
+    @param cluster The cluster whose nodes to sample
+    @param filename Where to write the samples; truncated when the monitor starts
+    @param interval Seconds between samples
+    """
+
+    def __init__(self, cluster, filename, interval=1.0):
+        super(ResourceMonitor, self).__init__()
+        self.daemon = True
+        self.cluster = cluster
+        self.filename = filename
+        self.interval = interval
+        self._processes = {}
+        self._gc_logs = {}
+        self._start = None
+        self._stop_requested = threading.Event()
+
+    def _process(self, node):
+        pid = node.pid
+        if pid is None:
+            return None
+        process = self._processes.get(node.name)
+        if process is None or process.pid != pid:
+            process = self._processes[node.name] = psutil.Process(pid)
+        return process
+
+    def sample(self, node):
+        """
+        Returns one sample of a node as a dict, or None if it isn't running.
+        """
+        try:
+            process = self._process(node)
+            if process is None:
+                return None
+            cpu = process.cpu_times()
+            record = {
+                't': round(time.time() - self._start, 2),
+                'node': node.name,
+                'pid': process.pid,
+                'cpu': round(cpu.user + cpu.system, 2),
+                'rss': process.memory_info().rss,
+                'fds': process.num_fds(),
+            }
+        except psutil.Error:
+            # not started yet, or stopped since
+            return None
+        record['data'] = disk_usage(node.data_directories())
+        record['commitlog'] = disk_usage([commitlog_dir(node)])
+
+        gc_log = self._gc_logs.get(node.name)
+        if gc_log is None:
+            gc_log = self._gc_logs[node.name] = _GCLogReader(node.gclogfilename())
+        pauses = gc_log.new_pauses()
+        record['gc_ms'] = round(sum(pauses), 2)
+        record['gc_max_ms'] = round(max(pauses), 2) if pauses else 0
+        return record
+
+    def run(self):
+        self._start = time.time()
+        try:
+            with open(self.filename, 'w') as f:
+                # always take a last sample once stop() is called
+                while True:
+                    stopping = self._stop_requested.is_set()
+                    for node in list(self.cluster.nodelist()):
+                        record = self.sample(node)
+                        if record is not None:
+                            f.write(json.dumps(record, sort_keys=True) + '\n')
+                    f.flush()
+                    if stopping:
+                        break
+                    self._stop_requested.wait(self.interval)
+        except Exception:
+            # never fail a test because of the monitor
+            logger.exception("Resource monitor stopped")
+
+    def stop(self, timeout=None):
+        self._stop_requested.set()
+        self.join(timeout)
@@ -0,0 +1,144 @@
+"""
+Reads sstable metadata straight from the Statistics.db component of each
+sstable, instead of running sstablemetadata.
+
+Every sstablemetadata run starts a JVM, and its output then has to be
+parsed with regexes, so tests that check levels or repaired times after
+each step spend most of their time starting tools. The metadata read here
+is cached by path, and read again only when the file changes, e.g. after
+sstablelevelreset or an anticompaction rewrote it.
+
+Only sstable formats from 2.1 ('ka') on are supported; older ones raise
+UnsupportedSSTableFormat.
+
+Example usage:
+
+    levels = sstable_levels(node1, 'keyspace1', 'standard1')
+    repaired = [m for m in node_sstable_metadata(node1, 'ks') if m.repaired_at]
+"""
+import glob
+import os
+import re
+import struct
+from collections import namedtuple
+
+# ordinal of the STATS component in the table of contents of Statistics.db
+_STATS = 2
+
+_DATA_FILE = re.compile(r'(?:^|-)([a-z]{2})-(\d+)-(?:big-)?Data\.db$')
+
+SSTableMetadata = namedtuple('SSTableMetadata', (
+    'path', 'format_version', 'generation', 'min_timestamp', 'max_timestamp', 'level', 'repaired_at'))
+
+# path -> ((mtime, size, inode) of Statistics.db, SSTableMetadata)
+_cache = {}
+
+
+class UnsupportedSSTableFormat(ValueError):
+    pass
+
+
+class _Reader(object):
+    """
+    Reads the big-endian values written by java's DataOutput.
+    """
+
+    def __init__(self, data, position=0):
+        self.data = data
+        self.position = position
+
+    def read(self, fmt):
+        values = struct.unpack_from('>' + fmt, self.data, self.position)
+        self.position += struct.calcsize('>' + fmt)
+        return values if len(values) > 1 else values[0]
+
+    def skip(self, count):
+        self.position += count
+
+
+def parse_data_file_name(path):
+    """
+    Returns the format version and generation of a Data.db file, for both
+    the 'ks-cf-ka-1-Data.db' and the 'mc-1-big-Data.db' naming schemes.
+    """
+    match = _DATA_FILE.search(os.path.basename(path))
+    if match is None:
+        raise ValueError("Not an sstable data file: {}".format(path))
+    return match.group(1), int(match.group(2))
+
+
+def _parse_stats(reader, format_version):
+    # estimated partition sizes and cell counts: a length, then (offset, count) longs
+    for _ in range(2):
+        reader.skip(reader.read('i') * 16)
+    # commit log position: segment id and position
+    reader.skip(12)
+    min_timestamp, max_timestamp = reader.read('qq')
+    if format_version >= 'ma':
+        # min and max local deletion times and ttls
+        reader.skip(16)
+    else:
+        # max local deletion time
+        reader.skip(4)
+    # compression ratio
+    reader.skip(8)
+    # tombstone drop times: max bin size, a length, then (double, long) pairs
+    _, size = reader.read('ii')
+    reader.skip(size * 16)
+    level, repaired_at = reader.read('iq')
+    return min_timestamp, max_timestamp, level, repaired_at
+
+
+def _read(path):
+    format_version, generation = parse_data_file_name(path)
+    if format_version < 'ka':
+        raise UnsupportedSSTableFormat("Can't read the metadata of {} sstables ({})".format(format_version, path))
+    with open(path.replace('Data.db', 'Statistics.db'), 'rb') as f:
+        reader = _Reader(f.read())
+
+    offsets = dict(reader.read('ii') for _ in range(reader.read('i')))
+    if _STATS not in offsets:
+        raise ValueError("No stats metadata in {}".format(path))
+    reader.position = offsets[_STATS]
+    return SSTableMetadata(path, format_version, generation, *_parse_stats(reader, format_version))
+
+
+def read_sstable_metadata(path):
+    """
+    Returns the SSTableMetadata of the sstable with the given Data.db file,
+    from the cache unless its Statistics.db changed.
+    """
+    stat = os.stat(path.replace('Data.db', 'Statistics.db'))
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    cached = _cache.get(path)
+    if cached is None or cached[0] != key:
+        cached = _cache[path] = (key, _read(path))
+    return cached[1]
+
+
+def sstable_data_files(node, keyspace, table=None):
+    """
+    Returns the Data.db files of the live sstables of a table, or of every
+    table of keyspace, in every data directory of node.
+    """
+    table_dirs = [table, table + '-*'] if table else ['*']
+    files = set()
+    for data_dir in node.data_directories():
+        for table_dir in table_dirs:
+            files.update(glob.glob(os.path.join(data_dir, keyspace, table_dir, '*-Data.db')))
+    return sorted(f for f in files if not os.path.exists(f.replace('Data.db', 'Compacted')))
+
+
+def node_sstable_metadata(node, keyspace, table=None):
+    """
+    Returns the SSTableMetadata of every live sstable of a table, or of
+    every table of keyspace, on node.
+    """
+    return [read_sstable_metadata(f) for f in sstable_data_files(node, keyspace, table)]
+
+
+def sstable_levels(node, keyspace, table):
+    """
+    Returns the level of every sstable of a table on node.
+    """
+    return [m.level for m in node_sstable_metadata(node, keyspace, table)]
@@ -0,0 +1,151 @@
+"""
+Copies of sstables, and bulk loading of sstables with sstableloader.
+
+sstableloader streams one table directory per invocation, and most of an
+invocation is spent starting a JVM and waiting on streaming, so loading a
+keyspace one directory at a time leaves the cluster mostly idle. load_tables
+runs one invocation per table directory concurrently, on a bounded pool,
+and records how long each took and how many bytes it streamed.
+
+sstables are immutable, so link_tree hard links them where a copy would
+otherwise be made.
+
+Example usage:
+
+    link_tree(os.path.join(node.get_path(), 'data0', 'ks'), os.path.join(node.get_path(), 'data0_copy', 'ks'))
+    ...
+    results = load_tables(node, table_dirs(os.path.join(node.get_path(), 'data0_copy', 'ks')))
+"""
+from __future__ import division
+
+import errno
+import os
+import shutil
+import subprocess
+import time
+
+from ccmlib import common as ccmcommon
+from concurrent.futures import ThreadPoolExecutor
+
+from dtest import debug
+
+# streaming is mostly bound by the target nodes, so a few loaders at a time are enough
+MAX_WORKERS = 4
+
+
+def link_file(source, target):
+    """
+    Hard links source to target, or copies it when it can't be linked (e.g.
+    across filesystems). Fails if target exists.
+
+    @return the size of the file
+    """
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, target)
+    return os.path.getsize(target)
+
+
+def link_tree(src, dst):
+    """
+    Recreates the directory tree src at dst, hard linking every file, or
+    copying it when it can't be linked. Existing files are replaced.
+
+    @return the number of bytes linked or copied
+    """
+    total = 0
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+        for name in files:
+            source, target = os.path.join(root, name), os.path.join(target_root, name)
+            if os.path.exists(target):
+                os.remove(target)
+            total += link_file(source, target)
+    return total
+
+
+def table_dirs(keyspace_dir):
+    """
+    Returns the table directories of a keyspace directory.
+    """
+    return sorted(os.path.join(keyspace_dir, d) for d in os.listdir(keyspace_dir)
+                  if os.path.isdir(os.path.join(keyspace_dir, d)))
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+
+
+class LoaderResult(object):
+    """
+    The outcome of one sstableloader invocation.
+    """
+
+    def __init__(self, table_dir, returncode, stdout, stderr, size, elapsed):
+        self.table_dir = table_dir
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.size = size
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        """
+        Bytes streamed per second.
+        """
+        return self.size / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return '{}: exit status {}, {} bytes in {:.1f}s ({:.2f} MB/s)'.format(
+            self.table_dir, self.returncode, self.size, self.elapsed, self.throughput / (1024 * 1024))
+
+
+def run_sstableloader(node, table_dir, hosts=None, extra_args=(), env=None):
+    """
+    Streams the sstables of table_dir to the cluster with the sstableloader
+    of node's install dir, and waits for it to finish.
+
+    @param hosts The initial hosts to contact; defaults to node
+    @param env The environment to run sstableloader with; made with ccm's
+               make_cassandra_env when not given
+    @return a LoaderResult
+    """
+    cdir = node.get_install_dir()
+    sstableloader = os.path.join(cdir, 'bin', ccmcommon.platform_binary('sstableloader'))
+    if env is None:
+        env = ccmcommon.make_cassandra_env(cdir, node.get_path())
+    cmd_args = [sstableloader, '--nodes', ','.join(hosts or [node.address()])] + list(extra_args) + [table_dir]
+
+    size = _dir_size(table_dir)
+    start = time.time()
+    p = subprocess.Popen(cmd_args, stderr=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    stdout, stderr = p.communicate()
+    return LoaderResult(table_dir, p.returncode, stdout, stderr, size, time.time() - start)
+
+
+def load_tables(node, dirs, max_workers=MAX_WORKERS, **kwargs):
+    """
+    Runs sstableloader for each of dirs, up to max_workers at a time.
+    Keyword arguments are passed to run_sstableloader.
+
+    @return the LoaderResult of each directory, in the order of dirs
+    """
+    # make_cassandra_env rewrites the node's cassandra.in.sh through a temporary
+    # file named after the pid, so it can't run in several threads at once
+    kwargs.setdefault('env', ccmcommon.make_cassandra_env(node.get_install_dir(), node.get_path()))
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda d: run_sstableloader(node, d, **kwargs), dirs))
+    for result in results:
+        debug(str(result))
+    total = sum(r.size for r in results)
+    elapsed = time.time() - start
+    debug("Loaded {} directories, {} bytes in {:.1f}s ({:.2f} MB/s)".format(
+        len(results), total, elapsed, total / elapsed / (1024 * 1024) if elapsed else 0))
+    return results
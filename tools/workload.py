@@ -0,0 +1,340 @@
+"""
+A continuous, self-verifying read/write workload, for running a cluster
+under load while it is being changed (e.g. during rolling upgrades).
+
+A writer thread keeps a bounded number of asynchronous writes in flight,
+writing new keys and rewriting keys that were already verified. A verifier
+thread reads back every acknowledged write, a batch of keys per request,
+and compares it with what was written. Keys and values are derived from a
+key index and a per-key version number, so the only state kept per key is
+one entry of an array of versions.
+
+Example usage:
+
+    workload = ContinuousWorkload(session)
+    workload.start()
+    workload.wait_for_writes(5000)
+    workload.start_phase('upgrading node1')
+    ...
+    workload.stop()
+    workload.report()
+    workload.check()
+"""
+from __future__ import division
+
+import random
+import threading
+import time
+import uuid
+from array import array
+from collections import deque
+
+from cassandra import ConsistencyLevel
+
+from dtest import debug
+
+
+class PhaseStats(object):
+    """
+    Operation and error counts of a workload during one phase of a test.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.writes = 0
+        self.write_errors = 0
+        self.reads = 0
+        self.read_errors = 0
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def ops(self):
+        return self.writes + self.reads
+
+    @property
+    def error_rate(self):
+        attempts = self.ops + self.write_errors + self.read_errors
+        return (self.write_errors + self.read_errors) / attempts if attempts else 0
+
+    def __str__(self):
+        return ('{name}: {writes} writes ({write_errors} errors), {reads} keys verified ({read_errors} errors) '
+                'in {elapsed:.1f}s: {rate:.0f} ops/s, error rate {error_rate:.2%}').format(
+            name=self.name, writes=self.writes, write_errors=self.write_errors, reads=self.reads,
+            read_errors=self.read_errors, elapsed=self.elapsed,
+            rate=self.ops / self.elapsed if self.elapsed else 0, error_rate=self.error_rate)
+
+
+class ContinuousWorkload(object):
+    """
+    Writes and verifies uuid values in a table created with
+    `CREATE TABLE cf (k uuid PRIMARY KEY, v uuid)`.
+
+    A write that fails may or may not have been applied, so until the key is
+    read back either value is accepted; the one that was read becomes the
+    expected value from then on. Any other value is recorded as a mismatch.
+
+    @param session A driver session connected to the workload's keyspace
+    @param concurrency Maximum number of writes, and of verification reads, in flight
+    @param rewrite_probability Percentage of writes that overwrite an already verified key
+    @param batch_size Number of keys verified by each read
+    @param consistency_level Consistency level of reads and writes
+    """
+
+    write_query = "UPDATE cf SET v=? WHERE k=?"
+    read_query = "SELECT k, v FROM cf WHERE k IN ({})"
+
+    def __init__(self, session, concurrency=32, rewrite_probability=25, batch_size=20,
+                 consistency_level=ConsistencyLevel.QUORUM):
+        self.session = session
+        self.concurrency = concurrency
+        self.rewrite_probability = rewrite_probability
+        self.batch_size = batch_size
+        self.consistency_level = consistency_level
+
+        self._write_statement = self._prepare(self.write_query)
+        self._read_statements = {}
+
+        # random prefixes keep this workload's keys and values apart from other runs'
+        self._key_prefix = random.getrandbits(64) << 64
+        self._value_prefix = random.getrandbits(64) << 64
+        # acknowledged version of each key, by key index; version 0 means never written
+        self._versions = array('L')
+        # versions still possible for keys whose last write failed
+        self._ambiguous = {}
+        self._writing = set()
+        self._pending = deque()
+        self._pending_set = set()
+        self.mismatches = []
+
+        self._lock = threading.Condition()
+        self._write_slots = threading.Semaphore(concurrency)
+        self._read_slots = threading.Semaphore(concurrency)
+        self._stop_writes = threading.Event()
+        self._stop_reads = threading.Event()
+        self._threads = []
+        self._failure = None
+        self.phases = [PhaseStats('initial load')]
+
+    def _prepare(self, query):
+        statement = self.session.prepare(query)
+        statement.consistency_level = self.consistency_level
+        return statement
+
+    def key_for(self, index):
+        return uuid.UUID(int=self._key_prefix | index)
+
+    def value_for(self, index, version):
+        """
+        Returns the value a key holds after the write of the given version,
+        or None for version 0.
+        """
+        if version == 0:
+            return None
+        return uuid.UUID(int=self._value_prefix | (version << 32) | index)
+
+    def write_args(self, index, version):
+        return (self.value_for(index, version), self.key_for(index))
+
+    @property
+    def phase(self):
+        return self.phases[-1]
+
+    def start_phase(self, name):
+        """
+        Starts counting operations towards a new phase, e.g. the upgrade of a node.
+        """
+        with self._lock:
+            self.phase.end = time.time()
+            self.phases.append(PhaseStats(name))
+
+    def start(self):
+        for target in (self._write_loop, self._verify_loop):
+            thread = threading.Thread(target=self._run, args=(target,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self, target):
+        try:
+            target()
+        except Exception as e:
+            debug("Error in continuous workload: {}".format(e))
+            self._failure = e
+            self.abort()
+
+    # writes
+
+    def _next_write(self):
+        """
+        Picks a key to write and reserves it. Returns (index, version).
+        """
+        with self._lock:
+            written = len(self._versions)
+            if written and random.randint(0, 100) <= self.rewrite_probability:
+                index = random.randrange(written)
+                if index not in self._writing and index not in self._pending_set:
+                    self._writing.add(index)
+                    return index, self._versions[index] + 1
+            self._versions.append(0)
+            self._writing.add(written)
+            return written, 1
+
+    def _write_loop(self):
+        while not self._stop_writes.is_set():
+            self._write_slots.acquire()
+            index, version = self._next_write()
+            future = self.session.execute_async(self._write_statement, self.write_args(index, version))
+            future.add_callbacks(callback=self._on_write, callback_args=(index, version),
+                                 errback=self._on_write_error, errback_args=(index, version))
+
+    def _write_done(self, index, version):
+        self._versions[index] = version
+        self._writing.discard(index)
+        if index not in self._pending_set:
+            self._pending_set.add(index)
+            self._pending.append(index)
+        self._lock.notify_all()
+
+    def _on_write(self, _, index, version):
+        with self._lock:
+            self._ambiguous.pop(index, None)
+            self.phase.writes += 1
+            self._write_done(index, version)
+        self._write_slots.release()
+
+    def _on_write_error(self, exc, index, version):
+        with self._lock:
+            possible = self._ambiguous.setdefault(index, {self._versions[index]})
+            possible.add(version)
+            self.phase.write_errors += 1
+            self._write_done(index, version)
+        self._write_slots.release()
+
+    # verification
+
+    def _read_statement(self, size):
+        if size not in self._read_statements:
+            self._read_statements[size] = self._prepare(self.read_query.format(', '.join(['?'] * size)))
+        return self._read_statements[size]
+
+    def _next_batch(self):
+        with self._lock:
+            while not self._pending and not self._stop_reads.is_set():
+                self._lock.wait(1)
+            return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    def _verify_loop(self):
+        while not self._stop_reads.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._read_slots.acquire()
+            future = self.session.execute_async(self._read_statement(len(batch)), [self.key_for(i) for i in batch])
+            future.add_callbacks(callback=self._on_read, callback_args=(batch,),
+                                 errback=self._on_read_error, errback_args=(batch,))
+
+    def _on_read(self, rows, batch):
+        actual = dict((row[0], row[1]) for row in rows)
+        with self._lock:
+            for index in batch:
+                value = actual.get(self.key_for(index))
+                possible = self._ambiguous.pop(index, (self._versions[index],))
+                matched = [v for v in possible if self.value_for(index, v) == value]
+                if matched:
+                    self._versions[index] = matched[0]
+                else:
+                    self.mismatches.append((self.key_for(index), [self.value_for(index, v) for v in possible], value))
+                self._pending_set.discard(index)
+            self.phase.reads += len(batch)
+            self._lock.notify_all()
+        self._read_slots.release()
+
+    def _on_read_error(self, exc, batch):
+        with self._lock:
+            # verify these keys again later
+            self._pending.extend(batch)
+            self.phase.read_errors += 1
+            self._lock.notify_all()
+        self._read_slots.release()
+
+    # waiting and results
+
+    def _wait(self, condition, timeout, description):
+        deadline = time.time() + timeout
+        with self._lock:
+            while not condition():
+                if self._failure is not None:
+                    raise self._failure
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError("Ran out of time waiting for {}. {}".format(description, self.phase))
+                self._lock.wait(min(remaining, 1))
+
+    def wait_for_writes(self, count, timeout=600):
+        """
+        Waits until count keys have been written.
+        """
+        self._wait(lambda: len(self._versions) - len(self._writing) >= count, timeout,
+                   "{} keys to be written".format(count))
+
+    def stop(self, timeout=1200):
+        """
+        Stops writing, waits for the writes in flight and for every
+        acknowledged write to be verified, then stops verifying.
+        """
+        self._stop_writes.set()
+        self._wait(lambda: not self._writing and not self._pending_set, timeout,
+                   "writes to be verified")
+        self._stop_reads.set()
+        for thread in self._threads:
+            thread.join()
+        self.phase.end = time.time()
+
+    def abort(self):
+        """
+        Stops writing and verifying right away, e.g. when a test failed.
+        """
+        self._stop_writes.set()
+        self._stop_reads.set()
+        with self._lock:
+            self._lock.notify_all()
+
+    def report(self):
+        for phase in self.phases:
+            debug(str(phase))
+
+    def check(self, max_error_rate=0.01):
+        """
+        Raises AssertionError if any key didn't read back as written, or if
+        more than max_error_rate of the operations of any phase failed.
+        """
+        if self._failure is not None:
+            raise self._failure
+        if self.mismatches:
+            raise AssertionError("{} keys did not match the values written, e.g. (key, expected, actual): {}".format(
+                len(self.mismatches), self.mismatches[:10]))
+        for phase in self.phases:
+            if phase.error_rate > max_error_rate:
+                raise AssertionError("Too many failed operations while {}".format(phase))
+
+
+class CounterWorkload(ContinuousWorkload):
+    """
+    Increments and verifies counters in a table created with
+    `CREATE TABLE countertable (k1 uuid PRIMARY KEY, c counter)`. The
+    version of a key is its expected count.
+    """
+
+    write_query = "UPDATE countertable SET c = c + 1 WHERE k1=?"
+    read_query = "SELECT k1, c FROM countertable WHERE k1 IN ({})"
+
+    def value_for(self, index, version):
+        return version or None
+
+    def write_args(self, index, version):
+        return (self.key_for(index),)
@@ -0,0 +1,14 @@
+from dtest import WARM_INSTALL_DIRS, debug
+from tools.install_cache import warm_install_dirs
+from upgrade_manifest import upgrade_versions
+
+
+def setup_package():
+    """
+    With WARM_INSTALL_DIRS=true, builds or downloads every version the
+    upgrade paths need before the first test runs, in parallel, instead of
+    one at a time during the tests. It is off by default because it
+    prepares all of them, however few tests are selected.
+    """
+    if WARM_INSTALL_DIRS:
+        debug("Install directories of upgrade versions: {}".format(warm_install_dirs(upgrade_versions())))
@@ -30,11 +30,14 @@ from tools.assertions import (assert_all, assert_invalid, assert_length_equal,
                               assert_none, assert_one, assert_row_count)
 from tools.data import rows_to_list
 from tools.decorators import since
+from tools.readiness import wait_for_gossip_normal, wait_for_schema_agreement
 from upgrade_base import UpgradeTester
 from upgrade_manifest import build_upgrade_pairs
+from shared_upgrade import requires_own_cluster
 
 
 class TestCQL(UpgradeTester):
+    shares_upgrade = True
 
     def static_cf_test(self):
         """ Test static CF syntax """
@@ -78,6 +81,7 @@ class TestCQL(UpgradeTester):
 
             assert_all(cursor, "SELECT * FROM users", [[UUID('f47ac10b-58cc-4372-a567-0e02b2c3d479'), 37, None, None], [UUID('550e8400-e29b-41d4-a716-446655440000'), 36, None, None]])
 
+    @requires_own_cluster
     @since('2.0', max_version='3')  # 3.0+ not compatible with protocol version 2
     def large_collection_errors_test(self):
         """ For large collections, make sure that we are printing warnings """
@@ -1402,6 +1406,7 @@ class TestCQL(UpgradeTester):
             cursor.execute(q % "tags = tags - [ 'bar' ]")
             assert_one(cursor, "SELECT tags FROM user WHERE fn='Bilbo' AND ln='Baggins'", [['m', 'n', 'c', 'c']])
 
+    @requires_own_cluster
     def multi_collection_test(self):
         cursor = self.prepare()
 
@@ -1487,6 +1492,7 @@ class TestCQL(UpgradeTester):
 
             assert_all(cursor, "SELECT * FROM test WHERE token(k1, k2) > " + str(-((2 ** 63) - 1)), [[0, 2, 2, 2], [0, 3, 3, 3], [0, 0, 0, 0], [0, 1, 1, 1]])
 
+    @requires_own_cluster
     @since('2', max_version='4')
     def cql3_insert_thrift_test(self):
         """
@@ -1524,6 +1530,7 @@ class TestCQL(UpgradeTester):
 
             assert_one(cursor, "SELECT * FROM test", [2, 4, 8])
 
+    @requires_own_cluster
     @since('2', max_version='4')
     def cql3_non_compound_range_tombstones_test(self):
         """
@@ -2691,6 +2698,7 @@ class TestCQL(UpgradeTester):
             cursor.execute("INSERT INTO bar (id, i) VALUES (1, 2);")
             assert_one(cursor, "SELECT * FROM bar", [1, 2])
 
+    @requires_own_cluster
     def query_compact_tables_during_upgrade_test(self):
         """
         Check that un-upgraded sstables for compact storage tables
@@ -2972,6 +2980,7 @@ class TestCQL(UpgradeTester):
             cursor.execute("INSERT INTO test (k, b) VALUES (0, 0x)")
             assert_one(cursor, "SELECT * FROM test", [0, ''])
 
+    @requires_own_cluster
     @since('2', max_version='4')
     def rename_test(self):
         cursor = self.prepare(start_rpc=True)
@@ -3711,7 +3720,7 @@ class TestCQL(UpgradeTester):
         cursor.execute("CREATE INDEX ON test(s)")
         cursor.execute("CREATE INDEX ON test(m)")
 
-        time.sleep(5.0)
+        wait_for_schema_agreement(cursor)
 
         for is_upgraded, cursor in self.do_upgrade(cursor):
             debug("Querying {} node".format("upgraded" if is_upgraded else "old"))
@@ -5065,6 +5074,7 @@ class TestCQL(UpgradeTester):
             # A blob that is not 4 bytes should be rejected
             assert_invalid(cursor, "INSERT INTO test(k, v) VALUES (0, blobAsInt(0x01))")
 
+    @requires_own_cluster
     def invalid_string_literals_test(self):
         """
         @jira_ticket CASSANDRA-8101
@@ -5294,6 +5304,7 @@ class TestCQL(UpgradeTester):
 
             assert_none(cursor, "select * from space1.table1 where a=1 and b=1")
 
+    @requires_own_cluster
     def secondary_index_query_test(self):
         """
         Test for fix to bug where secondary index cannot be queried due to Column Family caching changes.
@@ -5342,14 +5353,14 @@ class TestCQL(UpgradeTester):
         assert_all(cursor, "SELECT k FROM test WHERE v = 0", [[0]])
 
         self.cluster.stop()
-        time.sleep(0.5)
         self.cluster.start(wait_for_binary_proto=True)
-        time.sleep(0.5)
+        wait_for_gossip_normal(self.cluster.nodelist())
 
         for is_upgraded, cursor in self.do_upgrade(cursor):
             debug("Querying {} node".format("upgraded" if is_upgraded else "old"))
             assert_all(cursor, "SELECT k FROM ks.test WHERE v = 0", [[0]])
 
+    @requires_own_cluster
     def tracing_prevents_startup_after_upgrading_test(self):
         """
         Test that after upgrading from 2.1 to 3.0, the system_traces.sessions table is properly upgraded to include
@@ -5372,6 +5383,7 @@ class TestCQL(UpgradeTester):
 
             assert_one(cursor, "SELECT * FROM foo.bar", [0, 0])
 
+    @requires_own_cluster
     @since('3.0')
     def materialized_view_simple_test(self):
         """
@@ -0,0 +1,231 @@
+"""
+Shared-upgrade mode for UpgradeTester classes, enabled with SHARED_UPGRADE=true.
+
+Normally every test method prepares its own cluster and upgrades node1, so a
+class of small checks spends almost all of its time starting, draining and
+restarting nodes. In shared-upgrade mode, the first test of a class that
+sets `shares_upgrade = True` runs every test method of the class against a
+single cluster:
+
+  * the cluster is started on the starting version of the upgrade path,
+  * each test runs, in its own thread and its own keyspace, until it calls
+    do_upgrade (or finishes),
+  * node1 is upgraded once,
+  * each test is resumed in turn and runs its checks against the
+    mixed-version cluster.
+
+The schema of every test is therefore created before the upgrade, exactly as
+when it runs on its own. The outcome of each test is then reported when
+nose gets to it. Tests that failed on the shared cluster, that need
+options the shared cluster doesn't have (see UpgradeTester.prepare), or
+that are decorated with @requires_own_cluster are run again the usual way,
+on their own cluster.
+
+Every test method of the class runs in the shared batch, even when only
+some of them were selected, so this mode is meant for running whole classes.
+"""
+import sys
+import threading
+import time
+
+from nose.config import Config
+from unittest.case import SkipTest
+
+from dtest import debug
+
+# how long a test may run, before or after the upgrade, before it is given up on
+SEGMENT_TIMEOUT = 900
+
+PASSED, SKIPPED, FAILED = 'passed', 'skipped', 'failed'
+
+
+def requires_own_cluster(test):
+    """
+    Marks a test method that can't share a cluster with other tests, e.g.
+    because it refers to the 'ks' keyspace by name or stops nodes.
+    """
+    test.requires_own_cluster = True
+    return test
+
+
+class NotShareable(Exception):
+    """
+    Raised in a test running on the shared cluster when it turns out to need
+    a cluster of its own.
+    """
+
+
+class SharedTest(object):
+    """
+    The part of a shared run seen by a single test: its keyspace, and the
+    point where it waits for node1 to be upgraded.
+    """
+
+    def __init__(self, keyspace):
+        self.keyspace = keyspace
+        self.paused = threading.Event()
+        self.resume = threading.Event()
+        self.upgrade_failed = False
+        self.log_errors = False
+        self.waiting_for_upgrade = False
+        self.outcome = None
+
+    def check_prepare_options(self, tester, ordered, create_keyspace, use_cache, nodes, rf, start_rpc, jolokia):
+        if ordered or use_cache or start_rpc or jolokia or not create_keyspace or nodes != tester.NODES or rf != tester.RF:
+            raise NotShareable("prepare() options differ from the shared cluster's")
+
+    def wait_for_upgrade(self, return_nodes):
+        """
+        Called by do_upgrade: blocks the test until node1 has been upgraded.
+        """
+        if return_nodes:
+            raise NotShareable("the test needs the nodes themselves")
+        self.waiting_for_upgrade = True
+        self.paused.set()
+        self.resume.wait()
+        if self.upgrade_failed:
+            raise NotShareable("the shared upgrade failed")
+
+    def run(self, tester):
+        try:
+            getattr(tester, tester._testMethodName)()
+            self.outcome = (PASSED, None)
+        except SkipTest as e:
+            self.outcome = (SKIPPED, str(e))
+        except Exception:
+            self.outcome = (FAILED, sys.exc_info())
+        finally:
+            for con in tester.connections:
+                con.cluster.shutdown()
+            tester.connections = []
+            self.waiting_for_upgrade = False
+            self.paused.set()
+
+    def wait(self):
+        """
+        Waits for the test to pause for the upgrade or to finish. Returns
+        False if it timed out.
+        """
+        if not self.paused.wait(SEGMENT_TIMEOUT) and not self.paused.is_set():
+            self.outcome = (FAILED, "timed out after {}s".format(SEGMENT_TIMEOUT))
+            return False
+        self.paused.clear()
+        return True
+
+
+def shared_test_names(tester_class):
+    test_match = Config().testMatch
+    return sorted(name for name in dir(tester_class)
+                  if not name.startswith('_') and test_match.search(name) and callable(getattr(tester_class, name)) and
+                  not getattr(getattr(tester_class, name), 'requires_own_cluster', False) and
+                  not getattr(getattr(tester_class, name), '__unittest_skip__', False))
+
+
+class SharedUpgradeRun(object):
+    """
+    Runs every shareable test of an UpgradeTester class against one cluster
+    upgraded once, and records their outcomes.
+    """
+
+    _runs = {}
+
+    def __init__(self, tester_class):
+        self.tester_class = tester_class
+        self.outcomes = {}
+
+    @classmethod
+    def for_class(cls, tester_class):
+        if tester_class not in cls._runs:
+            run = cls._runs[tester_class] = SharedUpgradeRun(tester_class)
+            try:
+                run.execute()
+            except Exception as e:
+                # tests without an outcome fall back to running on their own cluster
+                debug("Shared upgrade run of {} failed: {}".format(tester_class.__name__, e))
+        return cls._runs[tester_class]
+
+    def _check_logs(self, owner, tester, shared):
+        if not tester.allow_log_errors and owner.check_logs_for_errors():
+            shared.log_errors = True
+
+    def execute(self):
+        names = shared_test_names(self.tester_class)
+        if not names:
+            return
+        start = time.time()
+        debug("Running {} tests of {} on a shared upgraded cluster".format(len(names), self.tester_class.__name__))
+
+        owner = self.tester_class(names[0])
+        owner.setUp()
+        tests = []
+        try:
+            owner.start_shared_cluster()
+
+            # run every test until it waits for the upgrade, one at a time
+            for i, name in enumerate(names):
+                tester = self.tester_class(name)
+                tester.cluster, tester.test_path = owner.cluster, owner.test_path
+                tester.connections, tester.runners = [], []
+                shared = tester._shared = SharedTest('ks_shared_{}'.format(i))
+                thread = threading.Thread(target=shared.run, args=(tester,), name=name)
+                thread.daemon = True
+                thread.start()
+                tests.append((tester, shared))
+                if shared.wait():
+                    self._check_logs(owner, tester, shared)
+
+            owner.upgrade_shared_cluster()
+
+            # then let each test check the upgraded cluster, one at a time
+            for tester, shared in tests:
+                if shared.waiting_for_upgrade:
+                    shared.resume.set()
+                    if shared.wait():
+                        self._check_logs(owner, tester, shared)
+        finally:
+            for tester, shared in tests:
+                if shared.waiting_for_upgrade and not shared.resume.is_set():
+                    shared.upgrade_failed = True
+                    shared.resume.set()
+                    shared.wait()
+                if shared.log_errors and shared.outcome is not None and shared.outcome[0] != FAILED:
+                    shared.outcome = (FAILED, "unexpected error in log")
+                self.outcomes[tester._testMethodName] = shared.outcome
+            try:
+                owner.tearDown()
+            except Exception as e:
+                debug("Error tearing down the shared cluster: {}".format(e))
+                for name, outcome in self.outcomes.items():
+                    if outcome and outcome[0] == PASSED:
+                        self.outcomes[name] = (FAILED, "error tearing down the shared cluster: {}".format(e))
+
+        debug("Shared upgrade run of {} took {:.0f}s: {}".format(
+            self.tester_class.__name__, time.time() - start,
+            ', '.join('{} {}'.format(sum(1 for o in self.outcomes.values() if o and o[0] == kind), kind)
+                      for kind in (PASSED, SKIPPED, FAILED))))
+
+
+def run_shared(tester, result):
+    """
+    Reports the outcome of tester's test method from the shared run of its
+    class, running the shared run first if needed. Returns False if the test
+    must be run on its own cluster instead.
+    """
+    outcome = SharedUpgradeRun.for_class(type(tester)).outcomes.get(tester._testMethodName)
+    if outcome is None:
+        return False
+
+    kind, detail = outcome
+    if kind == FAILED:
+        if isinstance(detail, tuple):
+            detail = '{}: {}'.format(detail[0].__name__, detail[1])
+        debug("{} failed on the shared cluster ({}); running it on its own cluster".format(tester._testMethodName, detail))
+        return False
+
+    result.startTest(tester)
+    if kind == SKIPPED:
+        result.addSkip(tester, detail)
+    else:
+        result.addSuccess(tester)
+    result.stopTest(tester)
+    return True
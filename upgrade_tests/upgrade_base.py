@@ -1,13 +1,16 @@
 import os
 import sys
-import time
 from abc import ABCMeta
 from unittest import skipIf
 
 from ccmlib.common import get_version_from_build, is_win
+from tools.install_cache import install_dir_args
 from tools.jmxutils import remove_perf_disable_shared_mem
+from tools.readiness import (wait_for_gossip_normal, wait_for_hosts_up,
+                             wait_for_native_transport)
 
-from dtest import CASSANDRA_VERSION_FROM_BUILD, TRACE, DEBUG, Tester, debug, create_ks
+from dtest import CASSANDRA_VERSION_FROM_BUILD, SHARED_UPGRADE, TRACE, DEBUG, Tester, debug, create_ks
+from shared_upgrade import run_shared
 
 
 def switch_jdks(major_version_int):
@@ -42,6 +45,12 @@ class UpgradeTester(Tester):
     __metaclass__ = ABCMeta
     NODES, RF, __test__, CL, UPGRADE_PATH = 2, 1, False, None, None
 
+    # whether the tests of this class can run against a single cluster,
+    # upgraded once, when SHARED_UPGRADE is set; see shared_upgrade.py
+    shares_upgrade = False
+    # the test's part of a shared run, while it runs on the shared cluster
+    _shared = None
+
     # known non-critical bug during teardown:
     # https://issues.apache.org/jira/browse/CASSANDRA-12340
     if CASSANDRA_VERSION_FROM_BUILD < '2.2':
@@ -64,14 +73,29 @@ class UpgradeTester(Tester):
         self.enable_for_jolokia = False
         super(UpgradeTester, self).__init__(*args, **kwargs)
 
+    def run(self, result=None):
+        if (SHARED_UPGRADE and self.shares_upgrade and result is not None and
+                not getattr(self.__class__, '__unittest_skip__', False) and
+                run_shared(self, result)):
+            return
+        super(UpgradeTester, self).run(result)
+
     def setUp(self):
         self.validate_class_config()
-        debug("Upgrade test beginning, setting CASSANDRA_VERSION to {}, and jdk to {}. (Prior values will be restored after test)."
+        debug("Upgrade test beginning, starting from {}, and setting jdk to {}."
               .format(self.UPGRADE_PATH.starting_version, self.UPGRADE_PATH.starting_meta.java_version))
         switch_jdks(self.UPGRADE_PATH.starting_meta.java_version)
-        os.environ['CASSANDRA_VERSION'] = self.UPGRADE_PATH.starting_version
         super(UpgradeTester, self).setUp()
 
+    def cluster_install_args(self):
+        # the cluster is created with the starting version, from the install
+        # cache when it was warmed, so ccm doesn't set it up during the test
+        return install_dir_args(self.UPGRADE_PATH.starting_version)
+
+    @property
+    def keyspace(self):
+        return 'ks' if self._shared is None else self._shared.keyspace
+
     def prepare(self, ordered=False, create_keyspace=True, use_cache=False,
                 nodes=None, rf=None, protocol_version=None, cl=None, **kwargs):
         nodes = self.NODES if nodes is None else nodes
@@ -84,40 +108,91 @@ class UpgradeTester(Tester):
 
         self.protocol_version = protocol_version
 
-        cluster = self.cluster
+        start_rpc = kwargs.pop('start_rpc', False)
+        self.enable_for_jolokia = kwargs.pop('jolokia', False)
+        if self._shared is not None:
+            self._shared.check_prepare_options(self, ordered, create_keyspace, use_cache, nodes, rf, start_rpc, self.enable_for_jolokia)
+        else:
+            cluster = self.cluster
 
-        if (ordered):
-            cluster.set_partitioner("org.apache.cassandra.dht.ByteOrderedPartitioner")
+            if (ordered):
+                cluster.set_partitioner("org.apache.cassandra.dht.ByteOrderedPartitioner")
 
-        if (use_cache):
-            cluster.set_configuration_options(values={'row_cache_size_in_mb': 100})
+            if (use_cache):
+                cluster.set_configuration_options(values={'row_cache_size_in_mb': 100})
 
-        start_rpc = kwargs.pop('start_rpc', False)
-        if start_rpc:
-            cluster.set_configuration_options(values={'start_rpc': True})
+            if start_rpc:
+                cluster.set_configuration_options(values={'start_rpc': True})
+
+            self._start_cluster(nodes)
+
+        node1 = self.cluster.nodelist()[0]
+
+        if cl:
+            session = self.patient_cql_connection(node1, protocol_version=protocol_version, consistency_level=cl, **kwargs)
+        else:
+            session = self.patient_cql_connection(node1, protocol_version=protocol_version, **kwargs)
+        if create_keyspace:
+            create_ks(session, self.keyspace, rf)
+
+        return session
 
+    def _start_cluster(self, nodes):
+        cluster = self.cluster
         cluster.set_configuration_options(values={'internode_compression': 'none'})
 
         cluster.populate(nodes)
         node1 = cluster.nodelist()[0]
-        cluster.set_install_dir(version=self.UPGRADE_PATH.starting_version)
-        self.enable_for_jolokia = kwargs.pop('jolokia', False)
         if self.enable_for_jolokia:
             remove_perf_disable_shared_mem(node1)
 
         cluster.start(wait_for_binary_proto=True)
 
-        node1 = cluster.nodelist()[0]
-        time.sleep(0.2)
+    def _stop_and_upgrade(self, node):
+        """
+        Stops node and switches it, and the jdk, to the upgrade version.
+        """
+        node.drain()
+        node.stop(gently=True)
 
-        if cl:
-            session = self.patient_cql_connection(node1, protocol_version=protocol_version, consistency_level=cl, **kwargs)
-        else:
-            session = self.patient_cql_connection(node1, protocol_version=protocol_version, **kwargs)
-        if create_keyspace:
-            create_ks(session, 'ks', rf)
+        # Ignore errors before upgrade on Windows
+        # We ignore errors from 2.1, because windows 2.1
+        # support is only beta. There are frequent log errors,
+        # related to filesystem interactions that are a direct result
+        # of the lack of full functionality on 2.1 Windows, and we dont
+        # want these to pollute our results.
+        if is_win() and self.cluster.version() <= '2.2':
+            node.mark_log_for_errors()
 
-        return session
+        debug('upgrading {} to {}'.format(node.name, self.UPGRADE_PATH.upgrade_version))
+        switch_jdks(self.UPGRADE_PATH.upgrade_meta.java_version)
+
+        node.set_install_dir(**install_dir_args(self.UPGRADE_PATH.upgrade_version))
+
+    def _start_upgraded(self, node):
+        node.set_log_level("DEBUG" if DEBUG else "TRACE" if TRACE else "INFO")
+        node.set_configuration_options(values={'internode_compression': 'none'})
+
+        if self.enable_for_jolokia:
+            remove_perf_disable_shared_mem(node)
+
+        node.start(wait_for_binary_proto=True, wait_other_notice=True)
+
+    def start_shared_cluster(self):
+        """
+        Starts the cluster shared by the tests of a shared-upgrade run.
+        """
+        self._start_cluster(self.NODES)
+
+    def upgrade_shared_cluster(self):
+        """
+        Upgrades node1 of the cluster shared by the tests of a shared-upgrade
+        run, and waits until every node sees every other one as up again.
+        """
+        node1 = self.cluster.nodelist()[0]
+        self._stop_and_upgrade(node1)
+        self._start_upgraded(node1)
+        wait_for_gossip_normal(self.cluster.nodelist())
 
     def do_upgrade(self, session, return_nodes=False, **kwargs):
         """
@@ -126,28 +201,18 @@ class UpgradeTester(Tester):
         Session is connected to the upgraded node. If `return_nodes`
         is True, a tuple of (is_upgraded, Session, Node) will be
         returned instead.
+
+        When the test runs on a shared cluster, node1 is upgraded once for
+        all of the tests sharing it instead.
         """
         session.cluster.shutdown()
         node1 = self.cluster.nodelist()[0]
         node2 = self.cluster.nodelist()[1]
 
-        # stop the nodes
-        node1.drain()
-        node1.stop(gently=True)
-
-        # Ignore errors before upgrade on Windows
-        # We ignore errors from 2.1, because windows 2.1
-        # support is only beta. There are frequent log errors,
-        # related to filesystem interactions that are a direct result
-        # of the lack of full functionality on 2.1 Windows, and we dont
-        # want these to pollute our results.
-        if is_win() and self.cluster.version() <= '2.2':
-            node1.mark_log_for_errors()
-
-        debug('upgrading node1 to {}'.format(self.UPGRADE_PATH.upgrade_version))
-        switch_jdks(self.UPGRADE_PATH.upgrade_meta.java_version)
-
-        node1.set_install_dir(version=self.UPGRADE_PATH.upgrade_version)
+        if self._shared is not None:
+            self._shared.wait_for_upgrade(return_nodes)
+        else:
+            self._stop_and_upgrade(node1)
 
         # this is a bandaid; after refactoring, upgrades should account for protocol version
         new_version_from_build = get_version_from_build(node1.get_install_dir())
@@ -161,20 +226,17 @@ class UpgradeTester(Tester):
         if (new_version_from_build >= '3' and self.protocol_version is not None and self.protocol_version < 3):
             self.skip('Protocol version {} incompatible '
                       'with Cassandra version {}'.format(self.protocol_version, new_version_from_build))
-        node1.set_log_level("DEBUG" if DEBUG else "TRACE" if TRACE else "INFO")
-        node1.set_configuration_options(values={'internode_compression': 'none'})
-
-        if self.enable_for_jolokia:
-            remove_perf_disable_shared_mem(node1)
 
-        node1.start(wait_for_binary_proto=True, wait_other_notice=True)
+        if self._shared is None:
+            self._start_upgraded(node1)
+            wait_for_gossip_normal(self.cluster.nodelist())
 
         sessions_and_meta = []
         if self.CL:
             session = self.patient_exclusive_cql_connection(node1, protocol_version=self.protocol_version, consistency_level=self.CL, **kwargs)
         else:
             session = self.patient_exclusive_cql_connection(node1, protocol_version=self.protocol_version, **kwargs)
-        session.set_keyspace('ks')
+        session.set_keyspace(self.keyspace)
 
         if return_nodes:
             sessions_and_meta.append((True, session, node1))
@@ -186,20 +248,21 @@ class UpgradeTester(Tester):
             session = self.patient_exclusive_cql_connection(node2, protocol_version=self.protocol_version, consistency_level=self.CL, **kwargs)
         else:
             session = self.patient_exclusive_cql_connection(node2, protocol_version=self.protocol_version, **kwargs)
-        session.set_keyspace('ks')
+        session.set_keyspace(self.keyspace)
 
         if return_nodes:
             sessions_and_meta.append((False, session, node2))
         else:
             sessions_and_meta.append((False, session))
 
-        # Let the nodes settle briefly before yielding connections in turn (on the upgraded and non-upgraded alike)
-        # CASSANDRA-11396 was the impetus for this change, wherein some apparent perf noise was preventing
-        # CL.ALL from being reached. The newly upgraded node needs to settle because it has just barely started, and each
-        # non-upgraded node needs a chance to settle as well, because the entire cluster (or isolated nodes) may have been doing resource intensive activities
-        # immediately before.
-        for s in sessions_and_meta:
-            time.sleep(5)
+        # Make sure every node is reachable before yielding each session, on the upgraded and non-upgraded
+        # alike. CASSANDRA-11396 was the impetus for this, wherein CL.ALL couldn't be reached right after the upgrade,
+        # because the newly upgraded node had only just started. Every node already sees every other one as up and
+        # normal at this point (see above). The sessions are exclusive, so their driver only ever marks their own
+        # node up; the other nodes are reached through it, and only need to accept clients.
+        wait_for_native_transport(self.cluster.nodelist())
+        for s, node in zip(sessions_and_meta, (node1, node2)):
+            wait_for_hosts_up(s[1], [node])
             yield s
 
     def get_version(self):
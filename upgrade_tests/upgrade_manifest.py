@@ -1,5 +1,7 @@
 from collections import namedtuple
 
+from six import string_types
+
 from dtest import (CASSANDRA_GITREF, CASSANDRA_VERSION_FROM_BUILD,
                    RUN_STATIC_UPGRADE_MATRIX, debug)
 
@@ -191,3 +193,18 @@ def build_upgrade_pairs():
             )
 
     return valid_upgrade_pairs
+
+
+def upgrade_versions():
+    """
+    Returns the set of versions the upgrade paths that apply to the current
+    env start from or upgrade to. The version of the current env is only
+    included when it is a git ref (CASSANDRA_GITREF), as the tests then
+    install it from that ref; a build version means CASSANDRA_DIR is used
+    as it is.
+    """
+    versions = set()
+    for path in build_upgrade_pairs():
+        if RUN_STATIC_UPGRADE_MATRIX or OVERRIDE_MANIFEST or path.upgrade_meta.matches_current_env_version_family:
+            versions.update(v for v in (path.starting_version, path.upgrade_version) if isinstance(v, string_types))
+    return versions
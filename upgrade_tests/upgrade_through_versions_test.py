@@ -1,233 +1,33 @@
-import operator
 import os
 import pprint
 import random
-import signal
-import time
 import uuid
 from collections import defaultdict, namedtuple
-from multiprocessing import Process, Queue
-from Queue import Empty, Full
 from unittest import skipUnless
 
-import psutil
 from cassandra import ConsistencyLevel, WriteTimeout
 from cassandra.query import SimpleStatement
 from nose.plugins.attrib import attr
 from six import print_
 
 from dtest import RUN_STATIC_UPGRADE_MATRIX, Tester, debug
+from tools.install_cache import install_dir_args
 from tools.misc import generate_ssl_stores, new_node
+from tools.readiness import wait_for_gossip_normal, wait_for_hosts_up
+from tools.workload import ContinuousWorkload, CounterWorkload
 from upgrade_base import switch_jdks
 from upgrade_manifest import (build_upgrade_pairs, current_2_0_x,
                               current_2_1_x, current_2_2_x, current_3_0_x,
                               indev_2_2_x, indev_3_x)
 
 
-def data_writer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
-    """
-    Process for writing/rewriting data continuously.
-
-    Pushes to a queue to be consumed by data_checker.
-
-    Pulls from a queue of already-verified rows written by data_checker that it can overwrite.
-
-    Intended to be run using multiprocessing.
-    """
-    # 'tester' is a cloned object so we shouldn't be inappropriately sharing anything with another process
-    session = tester.patient_cql_connection(tester.node1, keyspace="upgrade", protocol_version=tester.protocol_version)
-
-    prepared = session.prepare("UPDATE cf SET v=? WHERE k=?")
-    prepared.consistency_level = ConsistencyLevel.QUORUM
-
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        to_verify_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
-
-    while True:
-        try:
-            key = None
-
-            if (rewrite_probability > 0) and (random.randint(0, 100) <= rewrite_probability):
-                try:
-                    key = verification_done_queue.get_nowait()
-                except Empty:
-                    # we wanted a re-write but the re-writable queue was empty. oh well.
-                    pass
-
-            key = key or uuid.uuid4()
-
-            val = uuid.uuid4()
-
-            session.execute(prepared, (val, key))
-
-            to_verify_queue.put_nowait((key, val,))
-        except Exception:
-            debug("Error in data writer process!")
-            to_verify_queue.close()
-            raise
-
-
-def data_checker(tester, to_verify_queue, verification_done_queue):
-    """
-    Process for checking data continuously.
-
-    Pulls from a queue written to by data_writer to know what to verify.
-
-    Pushes to a queue to tell data_writer what's been verified and could be a candidate for re-writing.
-
-    Intended to be run using multiprocessing.
-    """
-    # 'tester' is a cloned object so we shouldn't be inappropriately sharing anything with another process
-    session = tester.patient_cql_connection(tester.node1, keyspace="upgrade", protocol_version=tester.protocol_version)
-
-    prepared = session.prepare("SELECT v FROM cf WHERE k=?")
-    prepared.consistency_level = ConsistencyLevel.QUORUM
-
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        verification_done_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
-
-    while True:
-        try:
-            # here we could block, but if the writer process terminates early with an empty queue
-            # we would end up blocking indefinitely
-            (key, expected_val) = to_verify_queue.get_nowait()
-
-            actual_val = session.execute(prepared, (key,))[0][0]
-        except Empty:
-            time.sleep(0.1)  # let's not eat CPU if the queue is empty
-            continue
-        except Exception:
-            debug("Error in data verifier process!")
-            verification_done_queue.close()
-            raise
-        else:
-            try:
-                verification_done_queue.put_nowait(key)
-            except Full:
-                # the rewritable queue is full, not a big deal. drop this one.
-                # we keep the rewritable queue held to a modest max size
-                # and allow dropping some rewritables because we don't want to
-                # rewrite rows in the same sequence as originally written
-                pass
-
-        tester.assertEqual(expected_val, actual_val, "Data did not match expected value!")
-
-
-def counter_incrementer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
-    """
-    Process for incrementing counters continuously.
-
-    Pushes to a queue to be consumed by counter_checker.
-
-    Pulls from a queue of already-verified rows written by data_checker that it can increment again.
-
-    Intended to be run using multiprocessing.
-    """
-    # 'tester' is a cloned object so we shouldn't be inappropriately sharing anything with another process
-    session = tester.patient_cql_connection(tester.node1, keyspace="upgrade", protocol_version=tester.protocol_version)
-
-    prepared = session.prepare("UPDATE countertable SET c = c + 1 WHERE k1=?")
-    prepared.consistency_level = ConsistencyLevel.QUORUM
-
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        to_verify_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
-
-    while True:
-        try:
-            key = None
-            count = 0  # this will get set to actual last known count if we do a re-write
-
-            if (rewrite_probability > 0) and (random.randint(0, 100) <= rewrite_probability):
-                try:
-                    key, count = verification_done_queue.get_nowait()
-                except Empty:
-                    # we wanted a re-write but the re-writable queue was empty. oh well.
-                    pass
-
-            key = key or uuid.uuid4()
-
-            session.execute(prepared, (key))
-
-            to_verify_queue.put_nowait((key, count + 1,))
-        except Exception:
-            debug("Error in counter incrementer process!")
-            to_verify_queue.close()
-            raise
-
-
-def counter_checker(tester, to_verify_queue, verification_done_queue):
-    """
-    Process for checking counters continuously.
-
-    Pulls from a queue written to by counter_incrementer to know what to verify.
-
-    Pushes to a queue to tell counter_incrementer what's been verified and could be a candidate for incrementing again.
-
-    Intended to be run using multiprocessing.
-    """
-    # 'tester' is a cloned object so we shouldn't be inappropriately sharing anything with another process
-    session = tester.patient_cql_connection(tester.node1, keyspace="upgrade", protocol_version=tester.protocol_version)
-
-    prepared = session.prepare("SELECT c FROM countertable WHERE k1=?")
-    prepared.consistency_level = ConsistencyLevel.QUORUM
-
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        verification_done_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
-
-    while True:
-        try:
-            # here we could block, but if the writer process terminates early with an empty queue
-            # we would end up blocking indefinitely
-            (key, expected_count) = to_verify_queue.get_nowait()
-
-            actual_count = session.execute(prepared, (key,))[0][0]
-        except Empty:
-            time.sleep(0.1)  # let's not eat CPU if the queue is empty
-            continue
-        except Exception:
-            debug("Error in counter verifier process!")
-            verification_done_queue.close()
-            raise
-        else:
-            tester.assertEqual(expected_count, actual_count, "Data did not match expected value!")
-
-            try:
-                verification_done_queue.put_nowait((key, actual_count))
-            except Full:
-                # the rewritable queue is full, not a big deal. drop this one.
-                # we keep the rewritable queue held to a modest max size
-                # and allow dropping some rewritables because we don't want to
-                # rewrite rows in the same sequence as originally written
-                pass
-
-
 @attr("resource-intensive")
 class UpgradeTester(Tester):
     """
     Upgrades a 3-node Murmur3Partitioner cluster through versions specified in test_version_metas.
     """
     test_version_metas = None  # set on init to know which versions to use
-    subprocs = None  # holds any subprocesses, for status checking and cleanup
+    workloads = None  # holds any continuous workloads, for cleanup
     extra_config = None  # holds a non-mutable structure that can be cast as dict()
     __test__ = False  # this is a base class only
     ignore_log_patterns = (
@@ -243,18 +43,20 @@ class UpgradeTester(Tester):
     )
 
     def __init__(self, *args, **kwargs):
-        self.subprocs = []
+        self.workloads = []
         Tester.__init__(self, *args, **kwargs)
 
     def setUp(self):
-        debug("Upgrade test beginning, setting CASSANDRA_VERSION to {}, and jdk to {}. (Prior values will be restored after test)."
+        debug("Upgrade test beginning, starting from {}, and setting jdk to {}."
               .format(self.test_version_metas[0].version, self.test_version_metas[0].java_version))
-        os.environ['CASSANDRA_VERSION'] = self.test_version_metas[0].version
         switch_jdks(self.test_version_metas[0].java_version)
 
         super(UpgradeTester, self).setUp()
         debug("Versions to test (%s): %s" % (type(self), str([v.version for v in self.test_version_metas])))
 
+    def cluster_install_args(self):
+        return install_dir_args(self.test_version_metas[0].version)
+
     def init_config(self):
         Tester.init_config(self)
 
@@ -325,38 +127,38 @@ class UpgradeTester(Tester):
                 self._create_schema()
         else:
             debug("Skipping schema creation (should already be built)")
-        time.sleep(5)  # sigh...
+        wait_for_gossip_normal(self.cluster.nodelist())
 
         self._log_current_ver(self.test_version_metas[0])
 
         if rolling:
-            # start up processes to write and verify data
-            write_proc, verify_proc, verification_queue = self._start_continuous_write_and_verify(wait_for_rowcount=5000)
+            # start up a workload to write and verify data
+            workload = self._start_continuous_write_and_verify(wait_for_rowcount=5000)
 
             # upgrade through versions
             for version_meta in self.test_version_metas[1:]:
                 for num, node in enumerate(self.cluster.nodelist()):
-                    # sleep (sigh) because driver needs extra time to keep up with topo and make quorum possible
-                    # this is ok, because a real world upgrade would proceed much slower than this programmatic one
-                    # additionally this should provide more time for timeouts and other issues to crop up as well, which we could
-                    # possibly "speed past" in an overly fast upgrade test
-                    time.sleep(60)
-
+                    # the driver needs to keep up with the topology for quorum to be possible: wait until every node is
+                    # up and normal, and the workload's driver routes requests to all of them again, before taking the
+                    # next node down
+                    workload.start_phase('waiting before upgrading {} to {}'.format(node.name, version_meta.version))
+                    wait_for_gossip_normal(self.cluster.nodelist())
+                    wait_for_hosts_up(workload.session, self.cluster.nodelist())
+
+                    workload.start_phase('upgrading {} to {}'.format(node.name, version_meta.version))
                     self.upgrade_to_version(version_meta, partial=True, nodes=(node,))
 
-                    self._check_on_subprocs(self.subprocs)
+                    workload.check()
                     debug('Successfully upgraded %d of %d nodes to %s' %
                           (num + 1, len(self.cluster.nodelist()), version_meta.version))
 
-                self.cluster.set_install_dir(version=version_meta.version)
+                self.cluster.set_install_dir(**install_dir_args(version_meta.version))
 
-            # Stop write processes
-            write_proc.terminate()
-            # wait for the verification queue's to empty (and check all rows) before continuing
-            self._wait_until_queue_condition('writes pending verification', verification_queue, operator.le, 0, max_wait_s=1200)
-            self._check_on_subprocs([verify_proc])  # make sure the verification processes are running still
-
-            self._terminate_subprocs()
+            # stop writing, and wait for all rows to be checked before continuing
+            workload.start_phase('verifying remaining writes')
+            workload.stop()
+            workload.report()
+            workload.check()
         # not a rolling upgrade, do everything in parallel:
         else:
             # upgrade through versions
@@ -365,7 +167,7 @@ class UpgradeTester(Tester):
                 self._increment_counters()
 
                 self.upgrade_to_version(version_meta)
-                self.cluster.set_install_dir(version=version_meta.version)
+                self.cluster.set_install_dir(**install_dir_args(version_meta.version))
 
                 self._check_values()
                 self._check_counters()
@@ -382,34 +184,11 @@ class UpgradeTester(Tester):
 
     def tearDown(self):
         # just to be super sure we get cleaned up
-        self._terminate_subprocs()
+        for workload in self.workloads:
+            workload.abort()
 
         super(UpgradeTester, self).tearDown()
 
-    def _check_on_subprocs(self, subprocs):
-        """
-        Check on given subprocesses.
-
-        If any are not alive, we'll go ahead and terminate any remaining alive subprocesses since this test is going to fail.
-        """
-        subproc_statuses = [s.is_alive() for s in subprocs]
-        if not all(subproc_statuses):
-            message = "A subprocess has terminated early. Subprocess statuses: "
-            for s in subprocs:
-                message += "{name} (is_alive: {aliveness}), ".format(name=s.name, aliveness=s.is_alive())
-            message += "attempting to terminate remaining subprocesses now."
-            self._terminate_subprocs()
-            raise RuntimeError(message)
-
-    def _terminate_subprocs(self):
-        for s in self.subprocs:
-            if s.is_alive():
-                try:
-                    psutil.Process(s.pid).kill()  # with fire damnit
-                except Exception:
-                    debug("Error terminating subprocess. There could be a lingering process.")
-                    pass
-
     def upgrade_to_version(self, version_meta, partial=False, nodes=None):
         """
         Upgrade Nodes - if *partial* is True, only upgrade those nodes
@@ -429,7 +208,7 @@ class UpgradeTester(Tester):
             node.stop(wait_other_notice=False)
 
         for node in nodes:
-            node.set_install_dir(version=version_meta.version)
+            node.set_install_dir(**install_dir_args(version_meta.version))
             debug("Set new cassandra dir for %s: %s" % (node.name, node.get_install_dir()))
 
         # hacky? yes. We could probably extend ccm to allow this publicly.
@@ -510,95 +289,32 @@ class UpgradeTester(Tester):
                 self.assertEqual(x, k)
                 self.assertEqual(str(x), v)
 
-    def _wait_until_queue_condition(self, label, queue, opfunc, required_len, max_wait_s=600):
+    def _start_continuous_write_and_verify(self, wait_for_rowcount=0, max_wait_s=600, workload_class=ContinuousWorkload):
         """
-        Waits up to max_wait_s for queue size to return True when evaluated against a condition function from the operator module.
-
-        Label is just a string identifier for easier debugging.
-
-        On Mac OS X may not be able to check queue size, in which case it will not block.
-
-        If time runs out, raises RuntimeError.
-        """
-        wait_end_time = time.time() + max_wait_s
-
-        while time.time() < wait_end_time:
-            try:
-                qsize = queue.qsize()
-            except NotImplementedError:
-                debug("Queue size may not be checkable on Mac OS X. Test will continue without waiting.")
-                break
-            if opfunc(qsize, required_len):
-                debug("{} queue size ({}) is '{}' to {}. Continuing.".format(label, qsize, opfunc.__name__, required_len))
-                break
-
-            if divmod(round(time.time()), 30)[1] == 0:
-                debug("{} queue size is at {}, target is to reach '{}' {}".format(label, qsize, opfunc.__name__, required_len))
-
-            time.sleep(0.1)
-            continue
-        else:
-            raise RuntimeError("Ran out of time waiting for queue size ({}) to be '{}' to {}. Aborting.".format(qsize, opfunc.__name__, required_len))
-
-    def _start_continuous_write_and_verify(self, wait_for_rowcount=0, max_wait_s=600):
-        """
-        Starts a writer process, a verifier process, a queue to track writes,
-        and a queue to track successful verifications (which are rewrite candidates).
+        Starts a workload that continuously writes rows, rewrites some of
+        them, and verifies every write.
 
         wait_for_rowcount provides a number of rows to write before unblocking and continuing.
 
-        Returns the writer process, verifier process, and the to_verify_queue.
+        Returns the running workload.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue()
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
-
-        writer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
-        # daemon subprocesses are killed automagically when the parent process exits
-        writer.daemon = True
-        self.subprocs.append(writer)
-        writer.start()
+        session = self.patient_cql_connection(self.node1, keyspace="upgrade", protocol_version=self.protocol_version)
+        workload = workload_class(session)
+        self.workloads.append(workload)
+        workload.start()
 
         if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('rows written (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
-
-        verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
-        # daemon subprocesses are killed automagically when the parent process exits
-        verifier.daemon = True
-        self.subprocs.append(verifier)
-        verifier.start()
+            workload.wait_for_writes(wait_for_rowcount, timeout=max_wait_s)
+        workload.start_phase('before upgrade')
 
-        return writer, verifier, to_verify_queue
+        return workload
 
     def _start_continuous_counter_increment_and_verify(self, wait_for_rowcount=0, max_wait_s=600):
         """
-        Starts a counter incrementer process, a verifier process, a queue to track writes,
-        and a queue to track successful verifications (which are re-increment candidates).
-
-        Returns the writer process, verifier process, and the to_verify_queue.
+        Like _start_continuous_write_and_verify, but continuously increments
+        and verifies counters.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue()
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
-
-        incrementer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
-        # daemon subprocesses are killed automagically when the parent process exits
-        incrementer.daemon = True
-        self.subprocs.append(incrementer)
-        incrementer.start()
-
-        if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('counters incremented (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
-
-        count_verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
-        # daemon subprocesses are killed automagically when the parent process exits
-        count_verifier.daemon = True
-        self.subprocs.append(count_verifier)
-        count_verifier.start()
-
-        return incrementer, count_verifier, to_verify_queue
+        return self._start_continuous_write_and_verify(wait_for_rowcount, max_wait_s, workload_class=CounterWorkload)
 
     def _increment_counters(self, opcount=25000):
         debug("performing {opcount} counter increments".format(opcount=opcount))